@@ -1,6 +1,16 @@
+import array
+import collections
+import collections.abc
 import datetime
+import json
+import math
+import operator
+import os
+import re
 import struct
-import io
+import sys
+import tempfile
+import time
 import asyncio
 import uuid
 import argparse
@@ -15,6 +25,11 @@ class MessageException(BaseException):
         super().__init__(self.service_id + ": " + self.message)
 
 
+class ProtocolError(ValueError):
+    # A frame the client does not know how to read
+    pass
+
+
 class PacketType(Enum):
     NEGOTIATE = b'\x00'
     CONNECT = b'\x01'
@@ -52,252 +67,297 @@ class EndpointDataType(Enum):
 
 
 class MessageType(Enum):
-    GET_AGENT_ADMINS_REQUEST = chr(0).encode()
-    GET_AGENT_ADMINS_RESPONSE = chr(1).encode()
-    GET_CLUSTER_ADMINS_REQUEST = chr(2).encode()
-    GET_CLUSTER_ADMINS_RESPONSE = chr(3).encode()
-    REG_AGENT_ADMIN_REQUEST = chr(4).encode()
-    REG_CLUSTER_ADMIN_REQUEST = chr(5).encode()
-    UNREG_AGENT_ADMIN_REQUEST = chr(6).encode()
-    UNREG_CLUSTER_ADMIN_REQUEST = chr(7).encode()
-    AUTHENTICATE_AGENT_REQUEST = chr(8).encode()  # Auth on agent
-    AUTHENTICATE_REQUEST = chr(9).encode()  # Auth on cluster
-    ADD_AUTHENTICATION_REQUEST = chr(10).encode()  # Auth on infobase
-    GET_CLUSTERS_REQUEST = chr(11).encode()
-    GET_CLUSTERS_RESPONSE = chr(12).encode()
-    GET_CLUSTER_INFO_REQUEST = chr(13).encode()
-    GET_CLUSTER_INFO_RESPONSE = chr(14).encode()
-    REG_CLUSTER_REQUEST = chr(15).encode()
-    REG_CLUSTER_RESPONSE = chr(16).encode()
-    UNREG_CLUSTER_REQUEST = chr(17).encode()
-    GET_CLUSTER_MANAGERS_REQUEST = chr(18).encode()
-    GET_CLUSTER_MANAGERS_RESPONSE = chr(19).encode()
-    GET_CLUSTER_MANAGER_INFO_REQUEST = chr(20).encode()
-    GET_CLUSTER_MANAGER_INFO_RESPONSE = chr(21).encode()
-    GET_WORKING_SERVERS_REQUEST = chr(22).encode()
-    GET_WORKING_SERVERS_RESPONSE = chr(23).encode()
-    GET_WORKING_SERVER_INFO_REQUEST = chr(24).encode()
-    GET_WORKING_SERVER_INFO_RESPONSE = chr(25).encode()
-    REG_WORKING_SERVER_REQUEST = chr(26).encode()
-    REG_WORKING_SERVER_RESPONSE = chr(27).encode()
-    UNREG_WORKING_SERVER_REQUEST = chr(28).encode()
-    GET_WORKING_PROCESSES_REQUEST = chr(29).encode()
-    GET_WORKING_PROCESSES_RESPONSE = chr(30).encode()
-    GET_WORKING_PROCESS_INFO_REQUEST = chr(31).encode()
-    GET_WORKING_PROCESS_INFO_RESPONSE = chr(32).encode()
-    GET_SERVER_WORKING_PROCESSES_REQUEST = chr(33).encode()
-    GET_SERVER_WORKING_PROCESSES_RESPONSE = chr(34).encode()
-    GET_CLUSTER_SERVICES_REQUEST = chr(35).encode()
-    GET_CLUSTER_SERVICES_RESPONSE = chr(36).encode()
-    CREATE_INFOBASE_REQUEST = chr(37).encode()
-    CREATE_INFOBASE_RESPONSE = chr(38).encode()
-    UPDATE_INFOBASE_SHORT_REQUEST = chr(39).encode()
-    UPDATE_INFOBASE_REQUEST = chr(40).encode()
-    DROP_INFOBASE_REQUEST = chr(41).encode()
-    GET_INFOBASES_SHORT_REQUEST = chr(42).encode()
-    GET_INFOBASES_SHORT_RESPONSE = chr(43).encode()
-    GET_INFOBASES_REQUEST = chr(44).encode()
-    GET_INFOBASES_RESPONSE = chr(45).encode()
-    GET_INFOBASE_SHORT_INFO_REQUEST = chr(46).encode()
-    GET_INFOBASE_SHORT_INFO_RESPONSE = chr(47).encode()
-    GET_INFOBASE_INFO_REQUEST = chr(48).encode()
-    GET_INFOBASE_INFO_RESPONSE = chr(49).encode()
-    GET_CONNECTIONS_SHORT_REQUEST = chr(50).encode()
-    GET_CONNECTIONS_SHORT_RESPONSE = chr(51).encode()
-    GET_INFOBASE_CONNECTIONS_SHORT_REQUEST = chr(52).encode()
-    GET_INFOBASE_CONNECTIONS_SHORT_RESPONSE = chr(53).encode()
-    GET_CONNECTION_INFO_SHORT_REQUEST = chr(54).encode()
-    GET_CONNECTION_INFO_SHORT_RESPONSE = chr(55).encode()
-    GET_INFOBASE_CONNECTIONS_REQUEST = chr(56).encode()
-    GET_INFOBASE_CONNECTIONS_RESPONSE = chr(57).encode()
+    GET_AGENT_ADMINS_REQUEST = bytes([0])
+    GET_AGENT_ADMINS_RESPONSE = bytes([1])
+    GET_CLUSTER_ADMINS_REQUEST = bytes([2])
+    GET_CLUSTER_ADMINS_RESPONSE = bytes([3])
+    REG_AGENT_ADMIN_REQUEST = bytes([4])
+    REG_CLUSTER_ADMIN_REQUEST = bytes([5])
+    UNREG_AGENT_ADMIN_REQUEST = bytes([6])
+    UNREG_CLUSTER_ADMIN_REQUEST = bytes([7])
+    AUTHENTICATE_AGENT_REQUEST = bytes([8])  # Auth on agent
+    AUTHENTICATE_REQUEST = bytes([9])  # Auth on cluster
+    ADD_AUTHENTICATION_REQUEST = bytes([10])  # Auth on infobase
+    GET_CLUSTERS_REQUEST = bytes([11])
+    GET_CLUSTERS_RESPONSE = bytes([12])
+    GET_CLUSTER_INFO_REQUEST = bytes([13])
+    GET_CLUSTER_INFO_RESPONSE = bytes([14])
+    REG_CLUSTER_REQUEST = bytes([15])
+    REG_CLUSTER_RESPONSE = bytes([16])
+    UNREG_CLUSTER_REQUEST = bytes([17])
+    GET_CLUSTER_MANAGERS_REQUEST = bytes([18])
+    GET_CLUSTER_MANAGERS_RESPONSE = bytes([19])
+    GET_CLUSTER_MANAGER_INFO_REQUEST = bytes([20])
+    GET_CLUSTER_MANAGER_INFO_RESPONSE = bytes([21])
+    GET_WORKING_SERVERS_REQUEST = bytes([22])
+    GET_WORKING_SERVERS_RESPONSE = bytes([23])
+    GET_WORKING_SERVER_INFO_REQUEST = bytes([24])
+    GET_WORKING_SERVER_INFO_RESPONSE = bytes([25])
+    REG_WORKING_SERVER_REQUEST = bytes([26])
+    REG_WORKING_SERVER_RESPONSE = bytes([27])
+    UNREG_WORKING_SERVER_REQUEST = bytes([28])
+    GET_WORKING_PROCESSES_REQUEST = bytes([29])
+    GET_WORKING_PROCESSES_RESPONSE = bytes([30])
+    GET_WORKING_PROCESS_INFO_REQUEST = bytes([31])
+    GET_WORKING_PROCESS_INFO_RESPONSE = bytes([32])
+    GET_SERVER_WORKING_PROCESSES_REQUEST = bytes([33])
+    GET_SERVER_WORKING_PROCESSES_RESPONSE = bytes([34])
+    GET_CLUSTER_SERVICES_REQUEST = bytes([35])
+    GET_CLUSTER_SERVICES_RESPONSE = bytes([36])
+    CREATE_INFOBASE_REQUEST = bytes([37])
+    CREATE_INFOBASE_RESPONSE = bytes([38])
+    UPDATE_INFOBASE_SHORT_REQUEST = bytes([39])
+    UPDATE_INFOBASE_REQUEST = bytes([40])
+    DROP_INFOBASE_REQUEST = bytes([41])
+    GET_INFOBASES_SHORT_REQUEST = bytes([42])
+    GET_INFOBASES_SHORT_RESPONSE = bytes([43])
+    GET_INFOBASES_REQUEST = bytes([44])
+    GET_INFOBASES_RESPONSE = bytes([45])
+    GET_INFOBASE_SHORT_INFO_REQUEST = bytes([46])
+    GET_INFOBASE_SHORT_INFO_RESPONSE = bytes([47])
+    GET_INFOBASE_INFO_REQUEST = bytes([48])
+    GET_INFOBASE_INFO_RESPONSE = bytes([49])
+    GET_CONNECTIONS_SHORT_REQUEST = bytes([50])
+    GET_CONNECTIONS_SHORT_RESPONSE = bytes([51])
+    GET_INFOBASE_CONNECTIONS_SHORT_REQUEST = bytes([52])
+    GET_INFOBASE_CONNECTIONS_SHORT_RESPONSE = bytes([53])
+    GET_CONNECTION_INFO_SHORT_REQUEST = bytes([54])
+    GET_CONNECTION_INFO_SHORT_RESPONSE = bytes([55])
+    GET_INFOBASE_CONNECTIONS_REQUEST = bytes([56])
+    GET_INFOBASE_CONNECTIONS_RESPONSE = bytes([57])
     # reserved 58 to 63  # Unknown messages types
-    DISCONNECT_REQUEST = chr(64).encode()
-    GET_SESSIONS_REQUEST = chr(65).encode()
-    GET_SESSIONS_RESPONSE = chr(66).encode()
-    GET_INFOBASE_SESSIONS_REQUEST = chr(67).encode()
-    GET_INFOBASE_SESSIONS_RESPONSE = chr(68).encode()
-    GET_SESSION_INFO_REQUEST = chr(69).encode()
-    GET_SESSION_INFO_RESPONSE = chr(70).encode()
-    TERMINATE_SESSION_REQUEST = chr(71).encode()
-    GET_LOCKS_REQUEST = chr(72).encode()
-    GET_LOCKS_RESPONSE = chr(73).encode()
-    GET_INFOBASE_LOCKS_REQUEST = chr(74).encode()
-    GET_INFOBASE_LOCKS_RESPONSE = chr(75).encode()
-    GET_CONNECTION_LOCKS_REQUEST = chr(76).encode()
-    GET_CONNECTION_LOCKS_RESPONSE = chr(77).encode()
-    GET_SESSION_LOCKS_REQUEST = chr(78).encode()
-    GET_SESSION_LOCKS_RESPONSE = chr(79).encode()
+    DISCONNECT_REQUEST = bytes([64])
+    GET_SESSIONS_REQUEST = bytes([65])
+    GET_SESSIONS_RESPONSE = bytes([66])
+    GET_INFOBASE_SESSIONS_REQUEST = bytes([67])
+    GET_INFOBASE_SESSIONS_RESPONSE = bytes([68])
+    GET_SESSION_INFO_REQUEST = bytes([69])
+    GET_SESSION_INFO_RESPONSE = bytes([70])
+    TERMINATE_SESSION_REQUEST = bytes([71])
+    GET_LOCKS_REQUEST = bytes([72])
+    GET_LOCKS_RESPONSE = bytes([73])
+    GET_INFOBASE_LOCKS_REQUEST = bytes([74])
+    GET_INFOBASE_LOCKS_RESPONSE = bytes([75])
+    GET_CONNECTION_LOCKS_REQUEST = bytes([76])
+    GET_CONNECTION_LOCKS_RESPONSE = bytes([77])
+    GET_SESSION_LOCKS_REQUEST = bytes([78])
+    GET_SESSION_LOCKS_RESPONSE = bytes([79])
     # reserved 80  # Unknown messages type
-    APPLY_ASSIGNMENT_RULES_REQUEST = chr(81).encode()
-    REG_ASSIGNMENT_RULE_REQUEST = chr(82).encode()
-    REG_ASSIGNMENT_RULE_RESPONSE = chr(83).encode()
-    UNREG_ASSIGNMENT_RULE_REQUEST = chr(84).encode()
-    GET_ASSIGNMENT_RULES_REQUEST = chr(85).encode()
-    GET_ASSIGNMENT_RULES_RESPONSE = chr(86).encode()
-    GET_ASSIGNMENT_RULE_INFO_REQUEST = chr(87).encode()
-    GET_ASSIGNMENT_RULE_INFO_RESPONSE = chr(88).encode()
-    GET_SECURITY_PROFILES_REQUEST = chr(89).encode()
-    GET_SECURITY_PROFILES_RESPONSE = chr(90).encode()
-    CREATE_SECURITY_PROFILE_REQUEST = chr(91).encode()
-    DROP_SECURITY_PROFILE_REQUEST = chr(92).encode()
-    GET_VIRTUAL_DIRECTORIES_REQUEST = chr(93).encode()
-    GET_VIRTUAL_DIRECTORIES_RESPONSE = chr(94).encode()
-    CREATE_VIRTUAL_DIRECTORY_REQUEST = chr(95).encode()
-    DROP_VIRTUAL_DIRECTORY_REQUEST = chr(96).encode()
-    GET_COM_CLASSES_REQUEST = chr(97).encode()
-    GET_COM_CLASSES_RESPONSE = chr(98).encode()
-    CREATE_COM_CLASS_REQUEST = chr(99).encode()
-    DROP_COM_CLASS_REQUEST = chr(100).encode()
-    GET_ALLOWED_ADDINS_REQUEST = chr(101).encode()
-    GET_ALLOWED_ADDINS_RESPONSE = chr(102).encode()
-    CREATE_ALLOWED_ADDIN_REQUEST = chr(103).encode()
-    DROP_ALLOWED_ADDIN_REQUEST = chr(104).encode()
-    GET_EXTERNAL_MODULES_REQUEST = chr(105).encode()
-    GET_EXTERNAL_MODULES_RESPONSE = chr(106).encode()
-    CREATE_EXTERNAL_MODULE_REQUEST = chr(107).encode()
-    DROP_EXTERNAL_MODULE_REQUEST = chr(108).encode()
-    GET_ALLOWED_APPLICATIONS_REQUEST = chr(109).encode()
-    GET_ALLOWED_APPLICATIONS_RESPONSE = chr(110).encode()
-    CREATE_ALLOWED_APPLICATION_REQUEST = chr(111).encode()
-    DROP_ALLOWED_APPLICATION_REQUEST = chr(112).encode()
-    GET_INTERNET_RESOURCES_REQUEST = chr(113).encode()
-    GET_INTERNET_RESOURCES_RESPONSE = chr(114).encode()
-    CREATE_INTERNET_RESOURCE_REQUEST = chr(115).encode()
-    DROP_INTERNET_RESOURCE_REQUEST = chr(116).encode()
-    INTERRUPT_SESSION_CURRENT_SERVER_CALL_REQUEST = chr(117).encode()
-    GET_RESOURCE_COUNTERS_REQUEST = chr(118).encode()
-    GET_RESOURCE_COUNTERS_RESPONSE = chr(119).encode()
-    GET_RESOURCE_COUNTER_INFO_REQUEST = chr(120).encode()
-    GET_RESOURCE_COUNTER_INFO_RESPONSE = chr(121).encode()
-    REG_RESOURCE_COUNTER_REQUEST = chr(122).encode()
-    UNREG_RESOURCE_COUNTER_REQUEST = chr(123).encode()
-    GET_RESOURCE_LIMITS_REQUEST = chr(124).encode()
-    GET_RESOURCE_LIMITS_RESPONSE = chr(125).encode()
-    GET_RESOURCE_LIMIT_INFO_REQUEST = chr(126).encode()
-    GET_RESOURCE_LIMIT_INFO_RESPONSE = chr(127).encode()
-    REG_RESOURCE_LIMIT_REQUEST = chr(128).encode()
-    UNREG_RESOURCE_LIMIT_REQUEST = chr(129).encode()
-    GET_COUNTER_VALUES_REQUEST = chr(130).encode()
-    GET_COUNTER_VALUES_RESPONSE = chr(131).encode()
-    CLEAR_COUNTER_VALUE_REQUEST = chr(132).encode()
-    GET_COUNTER_ACCUMULATED_VALUES_REQUEST = chr(133).encode()
-    GET_COUNTER_ACCUMULATED_VALUES_RESPONSE = chr(134).encode()
-    GET_AGENT_VERSION_REQUEST = chr(135).encode()
-    GET_AGENT_VERSION_RESPONSE = chr(136).encode()
+    APPLY_ASSIGNMENT_RULES_REQUEST = bytes([81])
+    REG_ASSIGNMENT_RULE_REQUEST = bytes([82])
+    REG_ASSIGNMENT_RULE_RESPONSE = bytes([83])
+    UNREG_ASSIGNMENT_RULE_REQUEST = bytes([84])
+    GET_ASSIGNMENT_RULES_REQUEST = bytes([85])
+    GET_ASSIGNMENT_RULES_RESPONSE = bytes([86])
+    GET_ASSIGNMENT_RULE_INFO_REQUEST = bytes([87])
+    GET_ASSIGNMENT_RULE_INFO_RESPONSE = bytes([88])
+    GET_SECURITY_PROFILES_REQUEST = bytes([89])
+    GET_SECURITY_PROFILES_RESPONSE = bytes([90])
+    CREATE_SECURITY_PROFILE_REQUEST = bytes([91])
+    DROP_SECURITY_PROFILE_REQUEST = bytes([92])
+    GET_VIRTUAL_DIRECTORIES_REQUEST = bytes([93])
+    GET_VIRTUAL_DIRECTORIES_RESPONSE = bytes([94])
+    CREATE_VIRTUAL_DIRECTORY_REQUEST = bytes([95])
+    DROP_VIRTUAL_DIRECTORY_REQUEST = bytes([96])
+    GET_COM_CLASSES_REQUEST = bytes([97])
+    GET_COM_CLASSES_RESPONSE = bytes([98])
+    CREATE_COM_CLASS_REQUEST = bytes([99])
+    DROP_COM_CLASS_REQUEST = bytes([100])
+    GET_ALLOWED_ADDINS_REQUEST = bytes([101])
+    GET_ALLOWED_ADDINS_RESPONSE = bytes([102])
+    CREATE_ALLOWED_ADDIN_REQUEST = bytes([103])
+    DROP_ALLOWED_ADDIN_REQUEST = bytes([104])
+    GET_EXTERNAL_MODULES_REQUEST = bytes([105])
+    GET_EXTERNAL_MODULES_RESPONSE = bytes([106])
+    CREATE_EXTERNAL_MODULE_REQUEST = bytes([107])
+    DROP_EXTERNAL_MODULE_REQUEST = bytes([108])
+    GET_ALLOWED_APPLICATIONS_REQUEST = bytes([109])
+    GET_ALLOWED_APPLICATIONS_RESPONSE = bytes([110])
+    CREATE_ALLOWED_APPLICATION_REQUEST = bytes([111])
+    DROP_ALLOWED_APPLICATION_REQUEST = bytes([112])
+    GET_INTERNET_RESOURCES_REQUEST = bytes([113])
+    GET_INTERNET_RESOURCES_RESPONSE = bytes([114])
+    CREATE_INTERNET_RESOURCE_REQUEST = bytes([115])
+    DROP_INTERNET_RESOURCE_REQUEST = bytes([116])
+    INTERRUPT_SESSION_CURRENT_SERVER_CALL_REQUEST = bytes([117])
+    GET_RESOURCE_COUNTERS_REQUEST = bytes([118])
+    GET_RESOURCE_COUNTERS_RESPONSE = bytes([119])
+    GET_RESOURCE_COUNTER_INFO_REQUEST = bytes([120])
+    GET_RESOURCE_COUNTER_INFO_RESPONSE = bytes([121])
+    REG_RESOURCE_COUNTER_REQUEST = bytes([122])
+    UNREG_RESOURCE_COUNTER_REQUEST = bytes([123])
+    GET_RESOURCE_LIMITS_REQUEST = bytes([124])
+    GET_RESOURCE_LIMITS_RESPONSE = bytes([125])
+    GET_RESOURCE_LIMIT_INFO_REQUEST = bytes([126])
+    GET_RESOURCE_LIMIT_INFO_RESPONSE = bytes([127])
+    REG_RESOURCE_LIMIT_REQUEST = bytes([128])
+    UNREG_RESOURCE_LIMIT_REQUEST = bytes([129])
+    GET_COUNTER_VALUES_REQUEST = bytes([130])
+    GET_COUNTER_VALUES_RESPONSE = bytes([131])
+    CLEAR_COUNTER_VALUE_REQUEST = bytes([132])
+    GET_COUNTER_ACCUMULATED_VALUES_REQUEST = bytes([133])
+    GET_COUNTER_ACCUMULATED_VALUES_RESPONSE = bytes([134])
+    GET_AGENT_VERSION_REQUEST = bytes([135])
+    GET_AGENT_VERSION_RESPONSE = bytes([136])
+
+
+def encode_varint(val, bits):
+    mask = (1 << bits) - 1
+    total = bytearray()
+    while val > mask:
+        total.append((1 << bits) | (val & mask))
+        val >>= bits
+    total.append(val)
+    return bytes(total)
+
+
+# Encodings of every value below 4096 (two base64 digits) are precomputed
+VARINT_TABLE_SIZE = 4096
+VARINT_BASE64_TABLE = [encode_varint(val, 6) for val in range(VARINT_TABLE_SIZE)]
+VARINT_BASE128_TABLE = [encode_varint(val, 7) for val in range(VARINT_TABLE_SIZE)]
 
 
 def pack_varint_base64(val):
-    total = b''
-    while val >= 0x40:
-        bits = val & 0x3F
-        val >>= 6
-        total += struct.pack('B', (0x40 | bits))
-    bits = val & 0x3F
-    total += struct.pack('B', bits)
-    return total
+    if val < VARINT_TABLE_SIZE:
+        return VARINT_BASE64_TABLE[val]
+    return encode_varint(val, 6)
 
 
 def pack_varint_base128(val):
-    total = b''
-    while val >= 0x80:
-        bits = val & 0x7F
-        val >>= 7
-        total += struct.pack('B', (0x80 | bits))
-    bits = val & 0x7F
-    total += struct.pack('B', bits)
-    return total
-
-
-async def unpack_varint_base64(stream):
-    total = 0
-    shift = 0
-    val = 0x40
-    while val & 0x40:
-        if type(stream) is io.BytesIO:
-            data = stream.read(1)
-        else:
-            data = await stream.read(1)
-        if data == b'':
-            return None
-        unpacked_data = struct.unpack('B', data)
-        val = unpacked_data[0]
-        total |= ((val & 0x3F) << shift)
-        shift += 6
-    return total
-
-
-async def unpack_varint_base128(stream):
-    total = 0
-    shift = 0
-    val = 0x80
-    while val & 0x80:
-        if type(stream) is io.BytesIO:
-            data = stream.read(1)
-        else:
-            data = await stream.read(1)
-        if data == b'':
-            return None
-        unpacked_data = struct.unpack('B', data)
-        val = unpacked_data[0]
-        total |= ((val & 0x7F) << shift)
-        shift += 7
-    return total
-
-
-def varint_prefixed_data_base64(data):
-    return pack_varint_base64(len(data)) + data
-
-
-def read_uuid(reader):
-    return uuid.UUID(bytes=reader.read(16))
-
-
-def read_uint16(reader):
-    return struct.unpack('>H', reader.read(2))[0]
+    if val < VARINT_TABLE_SIZE:
+        return VARINT_BASE128_TABLE[val]
+    return encode_varint(val, 7)
+
+
+UINT16 = struct.Struct('>H')
+INT32 = struct.Struct('>i')
+INT64 = struct.Struct('>q')
+DOUBLE = struct.Struct('>d')
+
+
+class Decoder:
+    # Reads fields from an in-memory frame by offset. Slices are taken from a memoryview, so only
+    # the values handed out to the caller (strings, UUIDs, bytes) are allocated.
+    def __init__(self, data, pos=0):
+        self.data = memoryview(data)
+        self.pos = pos
+
+    def remaining(self):
+        return len(self.data) - self.pos
+
+    def read_raw(self, size):
+        pos = self.pos
+        self.pos = pos + size
+        return self.data[pos:pos + size]
+
+    def read_byte(self):
+        pos = self.pos
+        self.pos = pos + 1
+        return self.data[pos:pos + 1].tobytes()
+
+    def read_varint_base64(self):
+        data = self.data
+        pos = self.pos
+        val = data[pos]
+        pos += 1
+        total = val & 0x3F
+        shift = 6
+        while val & 0x40:
+            val = data[pos]
+            pos += 1
+            total |= (val & 0x3F) << shift
+            shift += 6
+        self.pos = pos
+        return total
+
+    def read_varint_base128(self):
+        data = self.data
+        pos = self.pos
+        val = data[pos]
+        pos += 1
+        total = val & 0x7F
+        shift = 7
+        while val & 0x80:
+            val = data[pos]
+            pos += 1
+            total |= (val & 0x7F) << shift
+            shift += 7
+        self.pos = pos
+        return total
+
+    def read_uuid(self):
+        pos = self.pos
+        self.pos = pos + 16
+        return uuid.UUID(bytes=self.data[pos:pos + 16].tobytes())
+
+    def read_uint16(self):
+        pos = self.pos
+        self.pos = pos + 2
+        return UINT16.unpack_from(self.data, pos)[0]
+
+    def read_int32(self):
+        pos = self.pos
+        self.pos = pos + 4
+        return INT32.unpack_from(self.data, pos)[0]
+
+    def read_int64(self):
+        pos = self.pos
+        self.pos = pos + 8
+        return INT64.unpack_from(self.data, pos)[0]
+
+    def read_double(self):
+        pos = self.pos
+        self.pos = pos + 8
+        return DOUBLE.unpack_from(self.data, pos)[0]
+
+    def read_bool(self):
+        pos = self.pos
+        self.pos = pos + 1
+        return self.data[pos] == 1
+
+    def read_bytes(self):
+        size = self.read_varint_base64()
+        pos = self.pos
+        self.pos = pos + size
+        return self.data[pos:pos + size].tobytes()
+
+    def read_string(self):
+        size = self.read_varint_base64()
+        pos = self.pos
+        self.pos = pos + size
+        return str(self.data[pos:pos + size], 'utf-8')
+
+    def skip_string(self):
+        size = self.read_varint_base64()
+        self.pos += size
+
+
+def struct_run(fmt, *names):
+    # A run of consecutive fixed-width fields decoded by a single unpack_from call. UUIDs are
+    # unpacked as 16s and converted by the caller.
+    layout = struct.Struct('>' + fmt)
+    assert len(layout.unpack(bytes(layout.size))) == len(names)
+    return layout, names
 
 
 def write_uint16(value):
-    return struct.pack('>H', value)
-
-
-def read_int32(reader):
-    return struct.unpack('>i', reader.read(4))[0]
+    return UINT16.pack(value)
 
 
 def write_int32(value):
-    return struct.pack('>i', value)
-
-
-def read_int64(reader):
-    return struct.unpack('>q', reader.read(8))[0]
+    return INT32.pack(value)
 
 
 def write_int64(value):
-    return struct.pack('>q', value)
-
-
-async def read_bytes(reader):
-    return reader.read(await unpack_varint_base64(reader))
-
-
-async def read_string(reader):
-    return (await read_bytes(reader)).decode()
-
-
-def read_bool(reader):
-    return reader.read(1) == b'\x01'
+    return INT64.pack(value)
 
 
 def write_bool(value):
     return b'\x01' if value == 1 or value is True else b'\x00'
 
 
-def read_double(reader):
-    return struct.unpack('>d', reader.read(8))[0]
-
-
 def write_double(value):
-    return struct.pack('>d', value)
+    return DOUBLE.pack(value)
 
 
 def age_delta():
@@ -316,454 +376,2593 @@ def date_to_int64(value):
     return int(value.timestamp() * 10000 + age_delta())
 
 
+ENDPOINT_MESSAGE_FORMAT = b'\x00\x00' + EndpointDataType.MESSAGE.value
+PACKET_HEADER_RESERVE = 14  # packet type, up to five base128 length digits and the endpoint message header
+
+
 class Packet:
-    def __init__(self, packet_type, message_type=None):
-        self.data = []
+    # The packet is serialized into a single bytearray. Space for the headers is reserved in front
+    # of the body and filled in by get_frame(), so the whole frame is sent with one write. Endpoint
+    # messages are addressed to self.endpoint_id, which may be changed until the frame is sent.
+    def __init__(self, packet_type, message_type=None, endpoint_id=1):
+        self.data = bytearray(PACKET_HEADER_RESERVE)
         self.type = packet_type
+        self.message_type = message_type
+        self.endpoint_id = endpoint_id
+        self.frame = None
+        self.frame_endpoint_id = None
         if packet_type == PacketType.ENDPOINT_MESSAGE:
-            self.append_header()
             self.append_raw(message_type.value)
 
     def append(self, element):
-        self.data.append(varint_prefixed_data_base64(element))
+        data = self.data
+        size = len(element)
+        data += VARINT_BASE64_TABLE[size] if size < VARINT_TABLE_SIZE else encode_varint(size, 6)
+        data += element
 
     def append_raw(self, element):
-        self.data.append(element)
-
-    def append_header(self):
-        self.append_raw(b'\x01\x00\x00\x01')
-
-    def get_parts(self):
-        body = b''.join(self.data)
-        if self.type != PacketType.ENDPOINT_MESSAGE:
-            body += b'\x80'
-        packet_length = pack_varint_base128(len(body))
-        header = self.type.value + packet_length
-        return header, body
-
-
-async def read_cluster(packet):
-    cluster = {}
-    cluster['cluster'] = read_uuid(packet)
-    cluster['expiration-timeout'] = read_int32(packet)
-    cluster['host'] = await read_string(packet)
-    cluster['lifetime-limit'] = read_int32(packet)
-    cluster['port'] = read_uint16(packet)
-    cluster['max-memory-size'] = read_int32(packet)  # deprecated
-    cluster['max-memory-time-limit'] = read_int32(packet)  # deprecated
-    cluster['name'] = await read_string(packet)
-    cluster['security-level'] = read_int32(packet)
-    cluster['session-fault-tolerance-level'] = read_int32(packet)
-    cluster['load-balancing-mode'] = 'performance' if read_int32(packet) == 0 else 'memory'
-    cluster['errors-count-threshold'] = read_int32(packet)  # deprecated
-    cluster['kill-problem-processes'] = int(read_bool(packet))
-    cluster['kill-by-memory-with-dump'] = int(read_bool(packet))
-    return cluster
-
-
-def write_cluster(cluster, packet):
-    packet.append_raw(cluster['cluster'].bytes)
-    packet.append_raw(write_int32(cluster['expiration-timeout']))
-    packet.append(cluster['host'].encode())
-    packet.append_raw(write_int32(cluster['lifetime-limit']))
-    packet.append_raw(write_uint16(cluster['port']))
-    packet.append_raw(write_int32(cluster['max-memory-size']))
-    packet.append_raw(write_int32(cluster['max-memory-time-limit']))
-    packet.append(cluster['name'].encode())
-    packet.append_raw(write_int32(cluster['security-level']))
-    packet.append_raw(write_int32(cluster['session-fault-tolerance-level']))
-    packet.append_raw(write_int32(0 if cluster['load-balancing-mode'] == 'performance' else 1))
-    packet.append_raw(write_int32(cluster['errors-count-threshold']))
-    packet.append_raw(write_bool(cluster['kill-problem-processes']))
-    packet.append_raw(write_bool(cluster['kill-by-memory-with-dump']))
-
-
-async def read_infobase(packet):
-    infobase = {}
-    infobase['infobase'] = read_uuid(packet)
-    infobase['date_offset'] = read_int32(packet)
-    infobase['dbms'] = await read_string(packet)
-    infobase['db_name'] = await read_string(packet)
-    infobase['db_password'] = await read_bytes(packet)
-    infobase['db_server_name'] = await read_string(packet)
-    infobase['db_user'] = await read_string(packet)
-    infobase['denied_from'] = date_from_int64(read_int64(packet))
-    infobase['denied_message'] = await read_string(packet)
-    infobase['denied_parameter'] = await read_string(packet)
-    infobase['denied_to'] = date_from_int64(read_int64(packet))
-    infobase['descr'] = await read_string(packet)
-    infobase['locale'] = await read_string(packet)
-    infobase['name'] = await read_string(packet)
-    infobase['permission_code'] = await read_string(packet)
-    infobase['scheduled_jobs_denied'] = read_bool(packet)
-    infobase['security_level'] = read_int32(packet)
-    infobase['sessions_denied'] = read_bool(packet)
-    infobase['license_distribution'] = read_int32(packet)
-    infobase['external_connection_string'] = await read_string(packet)
-    infobase['external_session_manager_required'] = read_bool(packet)
-    infobase['securirty_profile'] = await read_string(packet)
-    infobase['safe_mode_securirty_profile'] = await read_string(packet)
-    infobase['reserve_working_processes'] = read_bool(packet)
-    return infobase
-
-
-def write_infobase(infobase, packet):
-    packet.append_raw(infobase['infobase'].bytes)
-    packet.append_raw(write_int32(infobase['date_offset']))
-    packet.append(infobase['dbms'].encode())
-    packet.append(infobase['db_name'].encode())
-    packet.append(infobase['db_password'])
-    packet.append(infobase['db_server_name'].encode())
-    packet.append(infobase['db_user'].encode())
-    packet.append_raw(write_int64(date_to_int64(infobase['denied_from'])))
-    packet.append(infobase['denied_message'].encode())
-    packet.append(infobase['denied_parameter'].encode())
-    packet.append_raw(write_int64(date_to_int64(infobase['denied_to'])))
-    packet.append(infobase['descr'].encode())
-    packet.append(infobase['locale'].encode())
-    packet.append(infobase['name'].encode())
-    packet.append(infobase['permission_code'].encode())
-    packet.append_raw(write_bool(infobase['scheduled_jobs_denied']))
-    packet.append_raw(write_int32(infobase['security_level']))
-    packet.append_raw(write_bool(infobase['sessions_denied']))
-    packet.append_raw(write_int32(infobase['license_distribution']))
-    packet.append(infobase['external_connection_string'].encode())
-    packet.append_raw(write_bool(infobase['external_session_manager_required']))
-    packet.append(infobase['securirty_profile'].encode())
-    packet.append(infobase['safe_mode_securirty_profile'].encode())
-    packet.append_raw(write_bool(infobase['reserve_working_processes']))
-
-
-async def read_infobase_short(packet):
-    infobase = {}
-    infobase['infobase'] = read_uuid(packet)
-    infobase['descr'] = await read_string(packet)
-    infobase['name'] = await read_string(packet)
-    return infobase
-
-
-async def read_session(packet):
-    session = {}
-    session['session_id'] = read_uuid(packet)
-    session['app_id'] = await read_string(packet)
-    session['blocked_by_dbms'] = read_int32(packet)
-    session['blocked_by_ls'] = read_int32(packet)
-    session['bytes_all'] = read_int64(packet)
-    session['bytes_last5min'] = read_int64(packet)
-    session['calls_all'] = read_int32(packet)
-    session['calls_last5min'] = read_int64(packet)
-    session['connection_id'] = read_uuid(packet)
-    session['dbms_bytes_all'] = read_int64(packet)
-    session['dbms_bytes_last5min'] = read_int64(packet)
-    session['db_proc_info'] = await read_string(packet)
-    session['db_proc_took'] = read_int32(packet)
-    session['db_proc_took_at'] = read_int64(packet)
-    session['duration_all'] = read_int32(packet)
-    session['duration_all_dbms'] = read_int32(packet)
-    session['duration_current'] = read_int32(packet)
-    session['duration_current_dbms'] = read_int32(packet)
-    session['duration_last_5_min'] = read_int64(packet)
-    session['duration_last_5_min_dbms'] = read_int64(packet)
-    session['host'] = await read_string(packet)
-    session['infobase_id'] = read_uuid(packet)
-    session['last_active_at'] = read_int64(packet)
-    session['hibernate'] = read_bool(packet)
-    session['passive_session_hibernate_time'] = read_int32(packet)
-    session['hibernate_session_terminate_time'] = read_int32(packet)
-    session['licenses'] = []
-    lic_count = await unpack_varint_base64(packet)
-    for lic_number in range(lic_count):
-        lic = {}
-        lic['full_name'] = await read_string(packet)
-        lic['full_presentation'] = await read_string(packet)
-        lic['issued_by_server'] = read_bool(packet)
-        lic['license_type'] = read_int32(packet)
-        lic['max_users_all'] = read_int32(packet)
-        lic['max_users_cur'] = read_int32(packet)
-        lic['net'] = read_bool(packet)
-        lic['rmngr_address'] = await read_string(packet)
-        lic['rmngr_pid'] = await read_string(packet)
-        lic['rmngr_port'] = read_int32(packet)
-        lic['series'] = await read_string(packet)
-        lic['short_presentation'] = await read_string(packet)
-        session['licenses'].append(lic)
-    session['locale'] = await read_string(packet)
-    session['process_id'] = read_uuid(packet)
-    session['id'] = read_int32(packet)
-    session['started_at'] = read_int64(packet)
-    session['user_name'] = await read_string(packet)
-    # version >= 4
-    session['memory_current'] = read_int64(packet)
-    session['memory_last5min'] = read_int64(packet)
-    session['memory_total'] = read_int64(packet)
-    session['read_current'] = read_int64(packet)
-    session['read_last5min'] = read_int64(packet)
-    session['read_total'] = read_int64(packet)
-    session['write_current'] = read_int64(packet)
-    session['write_last5min'] = read_int64(packet)
-    session['write_total'] = read_int64(packet)
-    # version >= 5
-    session['duration_current_service'] = read_int32(packet)
-    session['duration_last5min_service'] = read_int64(packet)
-    session['duration_all_service'] = read_int32(packet)
-    session['current_service_name'] = await read_string(packet)
-    # version >= 6
-    session['cpu_time_current'] = read_int64(packet)
-    session['cpu_time_last5min'] = read_int64(packet)
-    session['cpu_time_total'] = read_int64(packet)
-    # version >= 7
-    session['data_separation'] = await read_string(packet)
-    # version >= 10
-    session['client_ip_address'] = await read_string(packet)
-    return session
-
-
-async def read_packet(reader):
-    packet_type = PacketType(await reader.read(1))
-    packet_size = await unpack_varint_base128(reader)
-    packet_data = (await reader.readexactly(packet_size))
-    packet = io.BytesIO(packet_data)
-    packet_array = []
+        self.data += element
+
+    def get_frame(self):
+        if self.frame is None or self.frame_endpoint_id != self.endpoint_id:
+            data = self.data
+            if self.type == PacketType.ENDPOINT_MESSAGE:
+                header = pack_varint_base128(self.endpoint_id) + ENDPOINT_MESSAGE_FORMAT
+            else:
+                data += b'\x80'
+                header = b''
+            size = len(data) - PACKET_HEADER_RESERVE + len(header)
+            header = self.type.value + pack_varint_base128(size) + header
+            start = PACKET_HEADER_RESERVE - len(header)
+            data[start:PACKET_HEADER_RESERVE] = header
+            self.frame = memoryview(data)[start:]
+            self.frame_endpoint_id = self.endpoint_id
+        return self.frame
+
+
+STRING = 'string'
+LICENSES = 'license[]'
+
+# Record layouts, following the messages described in https://github.com/v8platform/protos. A layout
+# lists the fields of a record in wire order as (name, kind) pairs. Fixed-width kinds are listed in
+# FIELD_KINDS, 'string' and 'bytes' are prefixed with a base64 length, and 'name[]' is a list of
+# records of layout name prefixed with a base64 count.
+FIELD_KINDS = {
+    # kind: (struct code, expression that decodes {}, expression that encodes {})
+    'uuid': ('16s', 'UUID(bytes={})', '{}.bytes'),
+    'bool': ('?', '{}', '{} == 1'),
+    'flag': ('?', 'int({})', '{} == 1'),  # a boolean kept as 0 or 1
+    'short': ('H', '{}', '{}'),
+    'int': ('i', '{}', '{}'),
+    'long': ('q', '{}', '{}'),
+    'double': ('d', '{}', '{}'),
+    'date': ('q', 'date_from_int64({})', 'date_to_int64({})'),
+    'load_balancing_mode': ('i', "'performance' if {} == 0 else 'memory'", "0 if {} == 'performance' else 1"),
+}
+
+RECORD_LAYOUTS = {
+    'agent_version': (('version', STRING),),
+    # Registration responses carry the id of the created object
+    'cluster_id': (('cluster', 'uuid'),),
+    'server_id': (('server', 'uuid'),),
+    'infobase_id': (('infobase', 'uuid'),),
+    'rule_id': (('rule', 'uuid'),),
+    # Agent and cluster administrators
+    'admin': (
+        ('name', STRING), ('descr', STRING), ('password_hash', STRING), ('password_auth_allowed', 'bool'),
+        ('sys_auth_allowed', 'bool'), ('sys_user_name', STRING),
+    ),
+    'cluster': (
+        ('cluster', 'uuid'), ('expiration-timeout', 'int'), ('host', STRING), ('lifetime-limit', 'int'),
+        ('port', 'short'),
+        # max-memory-size and max-memory-time-limit are deprecated
+        ('max-memory-size', 'int'), ('max-memory-time-limit', 'int'),
+        ('name', STRING), ('security-level', 'int'), ('session-fault-tolerance-level', 'int'),
+        ('load-balancing-mode', 'load_balancing_mode'),
+        ('errors-count-threshold', 'int'),  # deprecated
+        ('kill-problem-processes', 'flag'), ('kill-by-memory-with-dump', 'flag'),
+    ),
+    'cluster_manager': (
+        ('manager', 'uuid'), ('descr', STRING), ('host', STRING), ('main_manager', 'int'), ('port', 'short'),
+        ('pid', STRING),
+    ),
+    'service_manager': (('manager', 'uuid'),),
+    'cluster_service': (
+        ('name', STRING), ('descr', STRING), ('main_only', 'int'), ('managers', 'service_manager[]'),
+    ),
+    'port_range': (('high', 'short'), ('low', 'short')),
+    'working_server': (
+        ('server', 'uuid'), ('agent_host', STRING), ('agent_port', 'short'), ('cluster_port', 'short'),
+        ('connections_limit', 'int'), ('dedicate_managers', 'bool'), ('infobases_limit', 'int'),
+        ('main_server', 'bool'), ('name', STRING), ('port_ranges', 'port_range[]'),
+        ('safe_call_memory_limit', 'long'), ('safe_working_processes_memory_limit', 'long'),
+        ('memory_limit', 'long'),
+        # version >= 8
+        ('critical_total_memory', 'long'), ('temporary_allowed_total_memory', 'long'),
+        ('temporary_allowed_total_memory_time_limit', 'long'),
+    ),
+    'license': (
+        ('full_name', STRING), ('full_presentation', STRING), ('issued_by_server', 'bool'), ('license_type', 'int'),
+        ('max_users_all', 'int'), ('max_users_cur', 'int'), ('net', 'bool'), ('rmngr_address', STRING),
+        ('rmngr_pid', STRING), ('rmngr_port', 'int'), ('series', STRING), ('short_presentation', STRING),
+    ),
+    'working_process': (
+        ('process', 'uuid'), ('avg_back_call_time', 'double'), ('avg_call_time', 'double'),
+        ('avg_db_call_time', 'double'), ('avg_lock_call_time', 'double'), ('avg_server_call_time', 'double'),
+        ('avg_threads', 'double'), ('capacity', 'int'), ('connections', 'int'), ('host', STRING),
+        ('enable', 'bool'), ('licenses', LICENSES), ('port', 'short'), ('memory_excess_time', 'int'),
+        ('memory_size', 'int'), ('pid', STRING), ('running', 'int'), ('selection_size', 'int'),
+        ('started_at', 'date'), ('use', 'int'), ('available_performance', 'int'),
+        ('reserve', 'bool'),  # version >= 9
+    ),
+    'infobase_short': (('infobase', 'uuid'), ('descr', STRING), ('name', STRING)),
+    'infobase': (
+        ('infobase', 'uuid'), ('date_offset', 'int'), ('dbms', STRING), ('db_name', STRING),
+        ('db_password', 'bytes'), ('db_server_name', STRING), ('db_user', STRING), ('denied_from', 'date'),
+        ('denied_message', STRING), ('denied_parameter', STRING), ('denied_to', 'date'), ('descr', STRING),
+        ('locale', STRING), ('name', STRING), ('permission_code', STRING), ('scheduled_jobs_denied', 'bool'),
+        ('security_level', 'int'), ('sessions_denied', 'bool'), ('license_distribution', 'int'),
+        ('external_connection_string', STRING), ('external_session_manager_required', 'bool'),
+        ('securirty_profile', STRING), ('safe_mode_securirty_profile', STRING),
+        ('reserve_working_processes', 'bool'),
+    ),
+    'connection_short': (
+        ('connection', 'uuid'), ('application', STRING), ('blocked_by_ls', 'int'), ('connected_at', 'date'),
+        ('conn_id', 'int'), ('host', STRING), ('infobase', 'uuid'), ('process', 'uuid'),
+        ('session_number', 'int'),
+    ),
+    'infobase_connection': (
+        ('connection', 'uuid'), ('application', STRING), ('connected_at', 'date'), ('conn_id', 'int'),
+        ('db_conn_mode', 'int'), ('db_proc_info', STRING), ('db_proc_took', 'int'), ('db_proc_took_at', 'date'),
+        ('host', STRING), ('ib_conn_mode', 'int'), ('thread_mode', 'int'), ('user_name', STRING),
+        ('process', 'uuid'),
+    ),
+    'session': (
+        ('session_id', 'uuid'), ('app_id', STRING), ('blocked_by_dbms', 'int'), ('blocked_by_ls', 'int'),
+        ('bytes_all', 'long'), ('bytes_last5min', 'long'), ('calls_all', 'int'), ('calls_last5min', 'long'),
+        ('connection_id', 'uuid'), ('dbms_bytes_all', 'long'), ('dbms_bytes_last5min', 'long'),
+        ('db_proc_info', STRING), ('db_proc_took', 'int'), ('db_proc_took_at', 'long'), ('duration_all', 'int'),
+        ('duration_all_dbms', 'int'), ('duration_current', 'int'), ('duration_current_dbms', 'int'),
+        ('duration_last_5_min', 'long'), ('duration_last_5_min_dbms', 'long'), ('host', STRING),
+        ('infobase_id', 'uuid'), ('last_active_at', 'long'), ('hibernate', 'bool'),
+        ('passive_session_hibernate_time', 'int'), ('hibernate_session_terminate_time', 'int'),
+        ('licenses', LICENSES), ('locale', STRING), ('process_id', 'uuid'), ('id', 'int'), ('started_at', 'long'),
+        ('user_name', STRING),
+        # version >= 4
+        ('memory_current', 'long'), ('memory_last5min', 'long'), ('memory_total', 'long'),
+        ('read_current', 'long'), ('read_last5min', 'long'), ('read_total', 'long'), ('write_current', 'long'),
+        ('write_last5min', 'long'), ('write_total', 'long'),
+        # version >= 5
+        ('duration_current_service', 'int'), ('duration_last5min_service', 'long'),
+        ('duration_all_service', 'int'), ('current_service_name', STRING),
+        # version >= 6
+        ('cpu_time_current', 'long'), ('cpu_time_last5min', 'long'), ('cpu_time_total', 'long'),
+        ('data_separation', STRING),  # version >= 7
+        ('client_ip_address', STRING),  # version >= 10
+    ),
+    'lock': (
+        ('connection', 'uuid'), ('descr', STRING), ('locked_at', 'date'), ('object', 'uuid'), ('session', 'uuid'),
+    ),
+    'assignment_rule': (
+        ('rule', 'uuid'), ('application_ext', STRING), ('infobase_name', STRING), ('object_type', 'int'),
+        ('priority', 'int'), ('rule_type', 'int'),
+    ),
+    'security_profile': (
+        ('name', STRING), ('descr', STRING), ('safe_mode_profile', 'bool'), ('full_privileges', 'bool'),
+        ('file_system_full_access', 'bool'), ('com_full_access', 'bool'), ('addin_full_access', 'bool'),
+        ('module_full_access', 'bool'), ('application_full_access', 'bool'), ('internet_full_access', 'bool'),
+        ('privileged_mode_roles', STRING), ('crypto', 'bool'), ('right_extension', 'bool'),
+        ('right_extension_definition_roles', STRING), ('all_modules_extension', 'bool'),
+        ('modules_available_for_extension', STRING), ('modules_not_available_for_extension', STRING),
+    ),
+    # The lists a security profile allows
+    'virtual_directory': (
+        ('alias', STRING), ('allowed_read', 'bool'), ('allowed_write', 'bool'), ('descr', STRING),
+        ('physical_path', STRING),
+    ),
+    'com_class': (
+        ('name', STRING), ('computer', STRING), ('descr', STRING), ('file_name', STRING), ('object_uuid', 'uuid'),
+    ),
+    'allowed_addin': (('name', STRING), ('descr', STRING), ('hash', STRING)),
+    'external_module': (('name', STRING), ('descr', STRING), ('hash', STRING)),
+    'allowed_application': (('name', STRING), ('descr', STRING), ('wild', STRING)),
+    'internet_resource': (
+        ('name', STRING), ('address', STRING), ('descr', STRING), ('port', 'int'), ('protocol', STRING),
+    ),
+    'resource_counter': (
+        ('name', STRING), ('collection_time', 'long'), ('group', 'int'), ('filter_type', 'int'), ('filter', STRING),
+        ('duration', 'bool'), ('cpu_time', 'bool'), ('memory', 'bool'), ('read', 'bool'), ('write', 'bool'),
+        ('duration_dbms', 'bool'), ('dbms_bytes', 'bool'), ('service', 'bool'), ('call', 'bool'),
+        ('number_of_active_sessions', 'bool'), ('number_of_sessions', 'bool'), ('descr', STRING),
+    ),
+    'counter_value': (
+        ('object', STRING), ('duration', 'long'), ('cpu_time', 'long'), ('memory', 'long'), ('read', 'long'),
+        ('write', 'long'), ('duration_dbms', 'long'), ('dbms_bytes', 'long'), ('service', 'long'), ('call', 'long'),
+        ('number_of_active_sessions', 'long'), ('number_of_sessions', 'long'),
+    ),
+    'resource_limit': (
+        ('name', STRING), ('counter', STRING), ('action', 'int'), ('duration', 'long'), ('cpu_time', 'long'),
+        ('memory', 'long'), ('read', 'long'), ('write', 'long'), ('duration_dbms', 'long'), ('dbms_bytes', 'long'),
+        ('service', 'long'), ('call', 'long'), ('number_of_active_sessions', 'long'), ('number_of_sessions', 'long'),
+        ('error_message', STRING), ('descr', STRING),
+    ),
+}
+
+
+def record_runs(layout):
+    # Groups consecutive fixed-width fields into struct runs. Variable-length fields are returned
+    # as (kind, name).
+    items = []
+    codes = ''
+    names = ()
+    for name, kind in layout:
+        if kind in FIELD_KINDS:
+            codes += FIELD_KINDS[kind][0]
+            names += (name,)
+            continue
+        if names:
+            items.append(struct_run(codes, *names))
+            codes = ''
+            names = ()
+        items.append((kind, name))
+    if names:
+        items.append(struct_run(codes, *names))
+    return tuple(items)
+
+
+def compile_record_codec(name, layout, namespace):
+    # Generates read_<name>(packet), write_<name>(record, packet) and skip_<name>(packet) from the
+    # layout. Each run of fixed-width fields is a single unpack_from or pack call, short strings
+    # are sliced from the frame without a method call, and the record dict is built in one step.
+    kinds = dict(layout)
+    variables = {field: 'v%d' % number for number, (field, kind) in enumerate(layout)}
+    read = ['def read_%s(packet):' % name, '    data = packet.data', '    pos = packet.pos']
+    write = ['def write_%s(record, packet):' % name, '    data = packet.data']
+    skip = ['def skip_%s(packet):' % name, '    data = packet.data', '    pos = packet.pos']
+    for number, item in enumerate(record_runs(layout)):
+        if isinstance(item[0], struct.Struct):
+            namespace['%s_RUN_%d' % (name.upper(), number)] = item
+            layout_struct, names = item
+            targets = ''.join(variables[field] + ', ' for field in names)
+            read += ['    %s= %s_RUN_%d[0].unpack_from(data, pos)' % (targets, name.upper(), number),
+                     '    pos += %d' % layout_struct.size]
+            skip.append('    pos += %d' % layout_struct.size)
+            values = ', '.join(FIELD_KINDS[kinds[field]][2].format('record[%r]' % field) for field in names)
+            write.append('    data += %s_RUN_%d[0].pack(%s)' % (name.upper(), number, values))
+            continue
+        kind, field = item
+        variable = variables[field]
+        if kind == STRING:
+            read += ['    size = data[pos]',
+                     '    if size < 0x40:',
+                     "        %s = str(data[pos + 1:pos + 1 + size], 'utf-8')" % variable,
+                     '        pos += 1 + size',
+                     '    else:',
+                     '        packet.pos = pos',
+                     '        %s = packet.read_string()' % variable,
+                     '        pos = packet.pos']
+            skip += ['    size = data[pos]',
+                     '    if size < 0x40:',
+                     '        pos += 1 + size',
+                     '    else:',
+                     '        packet.pos = pos',
+                     '        packet.skip_string()',
+                     '        pos = packet.pos']
+            write += ['    value = record[%r].encode()' % field,
+                      '    data += pack_varint_base64(len(value))',
+                      '    data += value']
+        elif kind == 'bytes':
+            read += ['    packet.pos = pos', '    %s = packet.read_bytes()' % variable, '    pos = packet.pos']
+            skip += ['    packet.pos = pos', '    packet.skip_string()', '    pos = packet.pos']
+            write += ['    value = record[%r]' % field,
+                      '    data += pack_varint_base64(len(value))',
+                      '    data += value']
+        else:
+            element = kind[:-2]
+            read += ['    packet.pos = pos',
+                     '    count = packet.read_varint_base64()',
+                     '    %s = [read_%s(packet) for number in range(count)]' % (variable, element),
+                     '    pos = packet.pos']
+            skip += ['    packet.pos = pos',
+                     '    for number in range(packet.read_varint_base64()):',
+                     '        skip_%s(packet)' % element,
+                     '    pos = packet.pos']
+            write += ['    data += pack_varint_base64(len(record[%r]))' % field,
+                      '    for element in record[%r]:' % field,
+                      '        write_%s(element, packet)' % element]
+    fields = ', '.join('%r: %s' % (field, FIELD_KINDS[kind][1].format(variables[field]) if kind in FIELD_KINDS
+                                   else variables[field]) for field, kind in layout)
+    read += ['    packet.pos = pos', '    return {%s}' % fields]
+    skip.append('    packet.pos = pos')
+    exec('\n'.join(read + write + skip), namespace)
+    return namespace['read_' + name], namespace['write_' + name], namespace['skip_' + name]
+
+
+RECORD_NAMESPACE = {'UUID': uuid.UUID, 'date_from_int64': date_from_int64, 'date_to_int64': date_to_int64,
+                    'pack_varint_base64': pack_varint_base64}
+RECORD_CODECS = {name: compile_record_codec(name, layout, RECORD_NAMESPACE)
+                 for name, layout in RECORD_LAYOUTS.items()}
+
+read_cluster, write_cluster, skip_cluster = RECORD_CODECS['cluster']
+read_infobase, write_infobase, skip_infobase = RECORD_CODECS['infobase']
+read_infobase_short, write_infobase_short, skip_infobase_short = RECORD_CODECS['infobase_short']
+read_license, write_license, skip_license = RECORD_CODECS['license']
+read_session, write_session, skip_session = RECORD_CODECS['session']
+read_connection_short, write_connection_short, skip_connection_short = RECORD_CODECS['connection_short']
+read_lock, write_lock, skip_lock = RECORD_CODECS['lock']
+read_resource_counter, write_resource_counter, skip_resource_counter = RECORD_CODECS['resource_counter']
+read_counter_value, write_counter_value, skip_counter_value = RECORD_CODECS['counter_value']
+
+# The response messages that carry records: the record layout and whether the body is a list
+# prefixed with a base128 count or a single record. Every response of MessageType is listed; a
+# message type byte missing here raises ProtocolError rather than passing for an empty list.
+RESPONSE_RECORDS = {
+    MessageType.GET_AGENT_ADMINS_RESPONSE: ('admin', True),
+    MessageType.GET_CLUSTER_ADMINS_RESPONSE: ('admin', True),
+    MessageType.GET_CLUSTERS_RESPONSE: ('cluster', True),
+    MessageType.GET_CLUSTER_INFO_RESPONSE: ('cluster', False),
+    MessageType.GET_CLUSTER_MANAGERS_RESPONSE: ('cluster_manager', True),
+    MessageType.GET_CLUSTER_MANAGER_INFO_RESPONSE: ('cluster_manager', False),
+    MessageType.GET_WORKING_SERVERS_RESPONSE: ('working_server', True),
+    MessageType.GET_WORKING_SERVER_INFO_RESPONSE: ('working_server', False),
+    MessageType.GET_WORKING_PROCESSES_RESPONSE: ('working_process', True),
+    MessageType.GET_WORKING_PROCESS_INFO_RESPONSE: ('working_process', False),
+    MessageType.GET_SERVER_WORKING_PROCESSES_RESPONSE: ('working_process', True),
+    MessageType.GET_CLUSTER_SERVICES_RESPONSE: ('cluster_service', True),
+    MessageType.GET_INFOBASES_SHORT_RESPONSE: ('infobase_short', True),
+    MessageType.GET_INFOBASE_SHORT_INFO_RESPONSE: ('infobase_short', False),
+    MessageType.GET_INFOBASES_RESPONSE: ('infobase', True),
+    MessageType.GET_INFOBASE_INFO_RESPONSE: ('infobase', False),
+    MessageType.GET_CONNECTIONS_SHORT_RESPONSE: ('connection_short', True),
+    MessageType.GET_INFOBASE_CONNECTIONS_SHORT_RESPONSE: ('connection_short', True),
+    MessageType.GET_CONNECTION_INFO_SHORT_RESPONSE: ('connection_short', False),
+    MessageType.GET_INFOBASE_CONNECTIONS_RESPONSE: ('infobase_connection', True),
+    MessageType.GET_SESSIONS_RESPONSE: ('session', True),
+    MessageType.GET_INFOBASE_SESSIONS_RESPONSE: ('session', True),
+    MessageType.GET_SESSION_INFO_RESPONSE: ('session', False),
+    MessageType.GET_LOCKS_RESPONSE: ('lock', True),
+    MessageType.GET_INFOBASE_LOCKS_RESPONSE: ('lock', True),
+    MessageType.GET_CONNECTION_LOCKS_RESPONSE: ('lock', True),
+    MessageType.GET_SESSION_LOCKS_RESPONSE: ('lock', True),
+    MessageType.GET_ASSIGNMENT_RULES_RESPONSE: ('assignment_rule', True),
+    MessageType.GET_ASSIGNMENT_RULE_INFO_RESPONSE: ('assignment_rule', False),
+    MessageType.GET_SECURITY_PROFILES_RESPONSE: ('security_profile', True),
+    MessageType.GET_VIRTUAL_DIRECTORIES_RESPONSE: ('virtual_directory', True),
+    MessageType.GET_COM_CLASSES_RESPONSE: ('com_class', True),
+    MessageType.GET_ALLOWED_ADDINS_RESPONSE: ('allowed_addin', True),
+    MessageType.GET_EXTERNAL_MODULES_RESPONSE: ('external_module', True),
+    MessageType.GET_ALLOWED_APPLICATIONS_RESPONSE: ('allowed_application', True),
+    MessageType.GET_INTERNET_RESOURCES_RESPONSE: ('internet_resource', True),
+    MessageType.GET_RESOURCE_COUNTERS_RESPONSE: ('resource_counter', True),
+    MessageType.GET_RESOURCE_COUNTER_INFO_RESPONSE: ('resource_counter', False),
+    MessageType.GET_RESOURCE_LIMITS_RESPONSE: ('resource_limit', True),
+    MessageType.GET_RESOURCE_LIMIT_INFO_RESPONSE: ('resource_limit', False),
+    MessageType.GET_COUNTER_VALUES_RESPONSE: ('counter_value', True),
+    MessageType.GET_COUNTER_ACCUMULATED_VALUES_RESPONSE: ('counter_value', True),
+    MessageType.GET_AGENT_VERSION_RESPONSE: ('agent_version', False),
+    MessageType.REG_CLUSTER_RESPONSE: ('cluster_id', False),
+    MessageType.REG_WORKING_SERVER_RESPONSE: ('server_id', False),
+    MessageType.CREATE_INFOBASE_RESPONSE: ('infobase_id', False),
+    MessageType.REG_ASSIGNMENT_RULE_RESPONSE: ('rule_id', False),
+}
+# Keyed by the message type byte, so the reader is found without constructing the enum member
+RESPONSE_READERS = {message_type.value[0]: (RECORD_CODECS[name][0], many)
+                    for message_type, (name, many) in RESPONSE_RECORDS.items()}
+MESSAGE_TYPE_NAMES = {message_type.value[0]: message_type.name for message_type in MessageType}
+
+SESSION_LAYOUT = record_runs(RECORD_LAYOUTS['session'])
+SESSION_UUID_FIELDS = tuple(name for name, kind in RECORD_LAYOUTS['session'] if kind == 'uuid')
+
+
+def read_string_at(data, pos):
+    return Decoder(data, pos).read_string()
+
+
+def read_licenses_at(data, pos):
+    packet = Decoder(data, pos)
+    return [read_license(packet) for lic_number in range(packet.read_varint_base64())]
+
+
+def skip_licenses(packet):
+    for lic_number in range(packet.read_varint_base64()):
+        skip_license(packet)
+
+
+def run_field_reader(code, is_uuid):
+    unpack_from = struct.Struct('>' + code).unpack_from
+    if is_uuid:
+        return lambda data, pos: uuid.UUID(bytes=unpack_from(data, pos)[0])
+    return lambda data, pos: unpack_from(data, pos)[0]
+
+
+def compile_lazy_layout(layout, uuid_fields):
+    # Returns the steps that skip over a record and a table of field readers. Fields are addressed
+    # relative to an anchor: the record start or the end of a variable-length item. The steps
+    # hold the number of fixed bytes before each variable-length item and the item kind.
+    steps = []
+    fields = {}
+    gap = 0
+    for item in layout:
+        if isinstance(item[0], struct.Struct):
+            layout_struct, names = item
+            codes = re.findall(r'\d*s|[a-zA-Z?]', layout_struct.format.lstrip('>'))
+            for name, code in zip(names, codes):
+                fields[name] = (len(steps), gap, run_field_reader(code, name in uuid_fields))
+                gap += struct.calcsize('>' + code)
+        else:
+            kind, name = item
+            fields[name] = (len(steps), gap, read_licenses_at if kind == LICENSES else read_string_at)
+            steps.append((gap, kind))
+            gap = 0
+    return tuple(steps), fields
+
+
+SESSION_SCAN, SESSION_FIELDS = compile_lazy_layout(SESSION_LAYOUT, SESSION_UUID_FIELDS)
+
+
+class Session(collections.abc.Mapping):
+    # A session record that keeps a view of the frame and the offsets of its variable-length
+    # items, and decodes a field only when it is accessed. materialize() returns the same dict
+    # read_session() builds.
+    __slots__ = ('raw', 'offsets')
+
+    def __init__(self, raw, offsets):
+        self.raw = raw
+        self.offsets = offsets
+
+    def __getitem__(self, key):
+        anchor, delta, read = SESSION_FIELDS[key]
+        return read(self.raw, self.offsets[anchor] + delta)
+
+    def __iter__(self):
+        return iter(SESSION_FIELDS)
+
+    def __len__(self):
+        return len(SESSION_FIELDS)
+
+    def __repr__(self):
+        return 'Session(%r)' % self.materialize()
+
+    def materialize(self):
+        return read_session(Decoder(self.raw, self.offsets[0]))
+
+
+def scan_session(packet):
+    offsets = array.array('I', [packet.pos])
+    for gap, kind in SESSION_SCAN:
+        packet.pos += gap
+        if kind == STRING:
+            packet.skip_string()
+        else:
+            skip_licenses(packet)
+        offsets.append(packet.pos)
+    return Session(packet.data, offsets)
+
+
+def raw_field_value(kind, value):
+    # The bytes a field of this kind holds on the wire when it is equal to value
+    if kind == STRING:
+        value = value.encode()
+        return pack_varint_base64(len(value)) + value
+    if kind == 'uuid':
+        return uuid_bytes(value)
+    if kind in FIELD_KINDS:
+        return struct.pack('>' + FIELD_KINDS[kind][0], value)
+    raise ValueError(f'Session fields of kind {kind} can not be filtered')
+
+
+def raw_equals(expected):
+    size = len(expected)
+    return lambda data, pos: data[pos:pos + size] == expected
+
+
+def raw_at_least(code, minimum):
+    unpack_from = struct.Struct('>' + code).unpack_from
+    return lambda data, pos: unpack_from(data, pos)[0] >= minimum
+
+
+class SessionFilter:
+    # Conditions on session fields compiled into checks of the raw record bytes. A record is walked
+    # like scan_session() does and every check runs as soon as the offset of its field is known;
+    # the rest of a record that fails one is skipped without decoding anything. Only the matches
+    # are returned, as dicts or, with materialize=False, as lazy Session records. equals maps field
+    # names to strings, UUIDs or numbers, minimum maps numeric fields to the least value that passes.
+    def __init__(self, equals=None, minimum=None, materialize=True):
+        self.materialize = materialize
+        kinds = dict(RECORD_LAYOUTS['session'])
+        checks = [[] for step in range(len(SESSION_SCAN) + 1)]
+        for name, value in (equals or {}).items():
+            anchor, delta, read = SESSION_FIELDS[name]
+            checks[anchor].append((delta, raw_equals(raw_field_value(kinds[name], value))))
+        for name, value in (minimum or {}).items():
+            anchor, delta, read = SESSION_FIELDS[name]
+            if kinds[name] not in FIELD_KINDS or kinds[name] == 'uuid':
+                raise ValueError(f'Session field {name} is not a number')
+            checks[anchor].append((delta, raw_at_least(FIELD_KINDS[kinds[name]][0], value)))
+        self.checks = tuple(tuple(step_checks) for step_checks in checks)
+
+    def scan(self, packet):
+        # Returns the record, or None when it does not match. Either way packet.pos is left at
+        # the end of the record.
+        data = packet.data
+        start = packet.pos
+        checks = self.checks
+        offsets = array.array('I', [start])
+        for index, (gap, kind) in enumerate(SESSION_SCAN):
+            for delta, test in checks[index]:
+                if not test(data, offsets[index] + delta):
+                    # The items before this step are walked already; only the rest is skipped
+                    for gap, kind in SESSION_SCAN[index:]:
+                        packet.pos += gap
+                        if kind == STRING:
+                            packet.skip_string()
+                        else:
+                            skip_licenses(packet)
+                    return None
+            packet.pos += gap
+            if kind == STRING:
+                packet.skip_string()
+            else:
+                skip_licenses(packet)
+            offsets.append(packet.pos)
+        for delta, test in checks[-1]:
+            if not test(data, offsets[-1] + delta):
+                return None
+        if not self.materialize:
+            return Session(data, offsets)
+        end = packet.pos
+        packet.pos = start
+        session = read_session(packet)
+        packet.pos = end
+        return session
+
+    def iter_records(self, packet, count):
+        scan = self.scan
+        for ras_data_number in range(count):
+            session = scan(packet)
+            if session is not None:
+                yield session
+
+
+COLUMNS = 'columns'
+COLUMN_TYPECODES = {'i': 'i', 'q': 'q', '?': 'B', 'H': 'H', 'd': 'd'}
+SESSION_DATE_FIELDS = ('db_proc_took_at', 'last_active_at', 'started_at')
+
+
+def compile_columnar_layout(layout):
+    # Returns one step per variable-length item: the struct of the fixed fields in front of it with
+    # their names, and the item kind and name. The fixed fields of all records are collected per
+    # step and transposed into columns at the end.
+    steps = []
+    codes = ''
+    names = ()
+    for item in layout:
+        if isinstance(item[0], struct.Struct):
+            codes += item[0].format.lstrip('>')
+            names += item[1]
+        else:
+            steps.append((struct.Struct('>' + codes), names) + item)
+            codes = ''
+            names = ()
+    return tuple(steps)
+
+
+SESSION_COLUMNAR_STEPS = compile_columnar_layout(SESSION_LAYOUT)
+
+
+class SessionColumns:
+    # Sessions decoded column by column. Numbers are kept in array.array columns, UUIDs as 16-byte
+    # values packed one after another and strings dictionary-encoded: an array of codes and the list
+    # of distinct values. The license list of a session is reduced to license_count. to_numpy() and
+    # to_arrow() build tables for vectorized analysis; numpy and pyarrow are imported only there.
+    def __init__(self, count, names, numbers, uuids, strings):
+        self.count = count
+        self.names = names
+        self.numbers = numbers
+        self.uuids = uuids
+        self.strings = strings
+
+    def __len__(self):
+        return self.count
+
+    def column(self, name):
+        if name in self.uuids:
+            data = self.uuids[name]
+            return [uuid.UUID(bytes=data[pos:pos + 16]) for pos in range(0, len(data), 16)]
+        if name in self.strings:
+            codes, values = self.strings[name]
+            return [values[code] for code in codes]
+        return self.numbers[name]
+
+    def to_numpy(self):
+        import numpy
+        table = numpy.empty(self.count, [(name, self.numpy_dtype(name)) for name in self.names])
+        for name in self.names:
+            if name in self.uuids:
+                table[name] = numpy.frombuffer(self.uuids[name], 'V16')
+            elif name in self.strings:
+                codes, values = self.strings[name]
+                table[name] = numpy.array(values, object)[numpy.frombuffer(codes, numpy.int32)]
+            elif name in SESSION_DATE_FIELDS:
+                ticks = numpy.frombuffer(self.numbers[name], numpy.int64)
+                dates = ((ticks - age_delta()) // 10).astype('datetime64[ms]')
+                dates[ticks == 0] = numpy.datetime64('NaT')
+                table[name] = dates
+            else:
+                table[name] = numpy.frombuffer(self.numbers[name], self.numpy_dtype(name))
+        return table
+
+    def numpy_dtype(self, name):
+        if name in self.uuids:
+            return 'V16'
+        if name in self.strings:
+            return object
+        if name in SESSION_DATE_FIELDS:
+            return 'datetime64[ms]'
+        typecode = self.numbers[name].typecode
+        return '?' if typecode == 'B' else typecode
+
+    def to_arrow(self):
+        import pyarrow
+        arrow_types = {'i': pyarrow.int32(), 'q': pyarrow.int64(), 'H': pyarrow.uint16(), 'd': pyarrow.float64()}
+
+        def from_buffer(arrow_type, data):
+            return pyarrow.Array.from_buffers(arrow_type, self.count, [None, pyarrow.py_buffer(data)])
+
+        columns = {}
+        for name in self.names:
+            if name in self.uuids:
+                columns[name] = from_buffer(pyarrow.binary(16), self.uuids[name])
+            elif name in self.strings:
+                codes, values = self.strings[name]
+                columns[name] = pyarrow.DictionaryArray.from_arrays(from_buffer(pyarrow.int32(), codes),
+                                                                    pyarrow.array(values, pyarrow.string()))
+            elif name in SESSION_DATE_FIELDS:
+                delta = age_delta()
+                milliseconds = [(ticks - delta) // 10 if ticks else None for ticks in self.numbers[name]]
+                columns[name] = pyarrow.array(milliseconds, pyarrow.timestamp('ms', 'UTC'))
+            elif self.numbers[name].typecode == 'B':
+                columns[name] = from_buffer(pyarrow.uint8(), self.numbers[name]).cast(pyarrow.bool_())
+            else:
+                columns[name] = from_buffer(arrow_types[self.numbers[name].typecode], self.numbers[name])
+        return pyarrow.table(columns)
+
+
+def read_session_columns(packet, count, steps=SESSION_COLUMNAR_STEPS):
+    # The fixed fields in front of each variable-length item are copied as raw bytes, so the only
+    # per-record work is walking the strings. Repeated strings are looked up by their raw bytes and
+    # decoded once. The frame is read in place, without copying it first.
+    data = packet.data
+    pos = packet.pos
+    fixed = [bytearray() for step in steps]
+    strings = {}
+    for layout_struct, names, kind, name in steps:
+        if kind == STRING:
+            strings[name] = (array.array('i'), [], {})
+    record_steps = [(buffer, layout_struct.size, kind, strings.get(name))
+                    for buffer, (layout_struct, names, kind, name) in zip(fixed, steps)]
+    license_count = array.array('i')
+    for record_number in range(count):
+        for buffer, size, kind, string_column in record_steps:
+            end = pos + size
+            buffer += data[pos:end]
+            if kind == STRING:
+                size = data[end]
+                if size < 0x40:
+                    pos = end + 1 + size
+                    value = data[end + 1:pos].tobytes()
+                else:
+                    packet.pos = end
+                    value = packet.read_bytes()
+                    pos = packet.pos
+                codes, values, index = string_column
+                code = index.get(value)
+                if code is None:
+                    code = index[value] = len(values)
+                    values.append(value.decode('utf-8'))
+                codes.append(code)
+            else:
+                packet.pos = end
+                license_count.append(packet.read_varint_base64())
+                packet.pos = end
+                skip_licenses(packet)
+                pos = packet.pos
+    packet.pos = pos
+    names = []
+    numbers = {}
+    uuids = {}
+    for buffer, (layout_struct, run_names, kind, name) in zip(fixed, steps):
+        columns = zip(*layout_struct.iter_unpack(buffer)) if count and run_names else [()] * len(run_names)
+        codes = re.findall(r'\d*s|[a-zA-Z?]', layout_struct.format.lstrip('>'))
+        for run_name, code, column in zip(run_names, codes, columns):
+            if code == '16s':
+                uuids[run_name] = b''.join(column)
+            else:
+                numbers[run_name] = array.array(COLUMN_TYPECODES[code], column)
+        names.extend(run_names)
+        names.append('license_count' if kind == LICENSES else name)
+    numbers['license_count'] = license_count
+    return SessionColumns(count, names, numbers, uuids, {name: value[:2] for name, value in strings.items()})
+
+
+PACKET_TYPES = {packet_type.value[0]: packet_type for packet_type in PacketType}
+
+
+class FrameReader:
+    # Splits the stream into frames (type byte, base128 length, body). The stream is read in large
+    # chunks, so several frames that arrive in one segment are parsed without further reads.
+    # KEEP_ALIVE frames are absorbed here and never returned, unless absorb_keep_alive is False.
+    # last_frame_at is the time any frame, keep-alives included, was last received.
+    def __init__(self, reader, chunk_size=65536, absorb_keep_alive=True):
+        self.reader = reader
+        self.chunk_size = chunk_size
+        self.absorb_keep_alive = absorb_keep_alive
+        self.buffer = bytearray()
+        self.pos = 0
+        self.last_frame_at = time.monotonic()
+
+    async def read_frame(self):
+        while True:
+            buffer = self.buffer
+            end = len(buffer)
+            header_end = self.pos + 1
+            size = 0
+            shift = 0
+            val = 0x80
+            while val & 0x80 and header_end < end:
+                val = buffer[header_end]
+                header_end += 1
+                size |= (val & 0x7F) << shift
+                shift += 7
+            if not val & 0x80:
+                missing = header_end + size - end
+                if missing > 0:
+                    # The header is complete, so the rest of a large frame is read in one call
+                    buffer += await self.reader.readexactly(missing)
+                packet_type = PACKET_TYPES[buffer[self.pos]]
+                with memoryview(buffer) as view:
+                    packet_data = view[header_end:header_end + size].tobytes()
+                self.pos = header_end + size
+                # The consumed part is released now rather than on the next read, so a large frame
+                # does not stay in the buffer while the connection is idle
+                if self.pos == len(buffer):
+                    self.buffer = bytearray()
+                    self.pos = 0
+                elif self.pos > self.chunk_size:
+                    del buffer[:self.pos]
+                    self.pos = 0
+                self.last_frame_at = time.monotonic()
+                if packet_type == PacketType.KEEP_ALIVE and self.absorb_keep_alive:
+                    continue
+                return packet_type, packet_data
+            await self.fill()
+
+    async def fill(self):
+        data = await self.reader.read(self.chunk_size)
+        if not data:
+            raise asyncio.IncompleteReadError(bytes(self.buffer[self.pos:]), None)
+        if self.pos:
+            del self.buffer[:self.pos]
+            self.pos = 0
+        self.buffer += data
+
+
+async def read_packet(frames, materialize=True):
+    packet_type, packet_data = await frames.read_frame()
+    return decode_packet(packet_type, packet_data, materialize)
+
+
+def decode_packet(packet_type, packet_data, materialize=True):
+    return packet_type, list(iter_packet_records(packet_type, packet_data, materialize))
+
+
+def iter_packet_records(packet_type, packet_data, materialize=True):
+    # The header is parsed (and errors are raised) right away; records are decoded one by one as
+    # the returned iterator is consumed.
+    packet = Decoder(packet_data)
     if packet_type == PacketType.ENDPOINT_OPEN_ACK:
-        packet_array.append(await read_bytes(packet))
-        packet_array.append(await read_bytes(packet))
-        packet_array.append(await unpack_varint_base64(packet))
+        return iter([packet.read_bytes(), packet.read_bytes(), packet.read_varint_base64()])
     elif packet_type == PacketType.ENDPOINT_FAILURE:
-        service_id = await read_string(packet)
-        version = await read_string(packet)
-        endpoint_id = await unpack_varint_base128(packet)
-        class_cause = await read_bytes(packet)
-        message = await read_string(packet)
+        service_id = packet.read_string()
+        version = packet.read_string()
+        endpoint_id = packet.read_varint_base128()
+        class_cause = packet.read_bytes()
+        message = packet.read_string()
         raise MessageException(service_id, message)
     elif packet_type == PacketType.ENDPOINT_MESSAGE:
-        endpoint_id = await unpack_varint_base128(packet)
-        endpoint_format = packet.read(2)
-        endpoint_data_type = EndpointDataType(packet.read(1))
+        endpoint_id = packet.read_varint_base128()
+        endpoint_format = packet.read_raw(2)
+        endpoint_data_type = EndpointDataType(packet.read_byte())
         if endpoint_data_type == EndpointDataType.EXCEPTION:
-            service_id = await read_string(packet)
-            message = await read_string(packet)
+            service_id = packet.read_string()
+            message = packet.read_string()
             raise MessageException(service_id, message)
         if endpoint_data_type == EndpointDataType.MESSAGE:
-            raw_ras_data_type = packet.read(1)
-            ras_data_type = MessageType(raw_ras_data_type)
-            if ras_data_type == MessageType.GET_CLUSTER_INFO_RESPONSE:
-                cluster = await read_cluster(packet)
-                packet_array.append(cluster)
-            elif ras_data_type == MessageType.GET_INFOBASE_INFO_RESPONSE:
-                infobase = await read_infobase(packet)
-                packet_array.append(infobase)
-            else:
-                ras_data_count = await unpack_varint_base128(packet)
-                for ras_data_number in range(ras_data_count):
-                    if ras_data_type == MessageType.GET_CLUSTERS_RESPONSE:
-                        cluster = await read_cluster(packet)
-                        packet_array.append(cluster)
-                    elif ras_data_type == MessageType.GET_INFOBASES_SHORT_RESPONSE:
-                        infobase = await read_infobase_short(packet)
-                        packet_array.append(infobase)
-                    elif ras_data_type in [MessageType.GET_INFOBASE_SESSIONS_RESPONSE,
-                                           MessageType.GET_SESSIONS_RESPONSE]:
-                        session = await read_session(packet)
-                        packet_array.append(session)
-
-    return packet_type, packet_array
+            ras_data_type = packet.data[packet.pos]
+            packet.pos += 1
+            if ras_data_type not in RESPONSE_READERS:
+                name = MESSAGE_TYPE_NAMES.get(ras_data_type, ras_data_type)
+                raise ProtocolError(f'Unknown response message type {name}')
+            read_record, many = RESPONSE_READERS[ras_data_type]
+            if not many:
+                return iter([read_record(packet)])
+            ras_data_count = packet.read_varint_base128()
+            if read_record is read_session:
+                if materialize is COLUMNS:
+                    return iter([read_session_columns(packet, ras_data_count)])
+                if isinstance(materialize, SessionFilter):
+                    return materialize.iter_records(packet, ras_data_count)
+                if not materialize:
+                    read_record = scan_session
+            return iter_records(packet, ras_data_count, read_record)
+    return iter(())
+
+
+def iter_records(packet, count, read_record):
+    for ras_data_number in range(count):
+        yield read_record(packet)
+
+
+def cache_key(*ids):
+    return ''.join('/' + str(uuid.UUID(bytes=uuid_bytes(value))) for value in ids)
 
 
 def send_packet(writer, packet):
-    header, body = packet.get_parts()
-    writer.write(header)
-    writer.write(body)
-
-
-async def ras_command(ras_args):
-    reader, writer = await asyncio.open_connection(
-        ras_args.ras_host, ras_args.ras_port)
-    data = struct.pack(">ihh", 475223888, 256, 256)  # magic numbers voodoo numbers
-    writer.write(data)
-    packet = Packet(PacketType.CONNECT)
-    packet.append_raw(b'\x01')
-    packet.append(b'connect.timeout')
-    packet.append_raw(ParamType.INT.value + struct.pack(">i", 2000))
-    send_packet(writer, packet)
-    packet_type, packet_array = await read_packet(reader)
-    assert packet_type == PacketType.CONNECT_ACK
-    assert len(packet_array) == 0
-
-    packet = Packet(PacketType.ENDPOINT_OPEN)
-    packet.append(b'v8.service.Admin.Cluster')
-    packet.append(b'10.0')
-    send_packet(writer, packet)
-    packet_type, packet_array = await read_packet(reader)
-    assert packet_type == PacketType.ENDPOINT_OPEN_ACK
-    assert packet_array[0] == b'v8.service.Admin.Cluster'
-    assert packet_array[1] == b'10.0'
-    endpoint_id = packet_array[2]
+    writer.write(packet.get_frame())
+
+
+def uuid_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    if not isinstance(value, uuid.UUID):
+        value = uuid.UUID(value)
+    return value.bytes
+
+
+CONNECTION_ERRORS = (OSError, EOFError, asyncio.TimeoutError)
+# Requests that change nothing on the server. Only these are sent again after the connection was
+# lost while waiting for the response, since a change may have been applied before that.
+# Accumulated counter values are reset by the request that reads them.
+READ_ONLY_REQUESTS = frozenset(message_type for message_type in MessageType
+                               if message_type.name.startswith('GET_') and message_type.name.endswith('_REQUEST')
+                               and message_type != MessageType.GET_COUNTER_ACCUMULATED_VALUES_REQUEST)
+
+
+def frame_endpoint_id(packet_type, packet_data):
+    packet = Decoder(packet_data)
+    if packet_type == PacketType.ENDPOINT_MESSAGE:
+        return packet.read_varint_base128()
+    if packet_type == PacketType.ENDPOINT_FAILURE:
+        packet.skip_string()  # service_id
+        packet.skip_string()  # version
+        return packet.read_varint_base128()
+    return None
+
+
+class Histogram:
+    # Log2 buckets of microseconds: bucket n counts durations in [2 ** (n - 1), 2 ** n) us, so adding
+    # a value costs a multiplication, bit_length() and an array increment. Percentiles are reported
+    # as the upper bound of their bucket.
+    BUCKETS = 40
+
+    def __init__(self):
+        self.buckets = array.array('Q', bytes(8 * self.BUCKETS))
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.buckets[min(int(seconds * 1000000).bit_length(), self.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        rank = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min((1 << bucket) / 1000000, self.max)
+        return self.max
+
+    def summary(self):
+        return {'count': self.count, 'mean': self.total / self.count if self.count else 0.0,
+                'p50': self.percentile(0.5), 'p90': self.percentile(0.9), 'p99': self.percentile(0.99),
+                'max': self.max}
+
+
+class RequestStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.wait = Histogram()
+        self.decode = Histogram()
+
+
+class RequestTracer:
+    # Collects a trace per request: the message type, frame sizes, the time from sending the request
+    # to receiving the response (network and server), the time spent decoding it and the error, if
+    # any. Traces are aggregated per message type and passed to every callback as a dict.
+    def __init__(self, callbacks=()):
+        self.stats = {}
+        self.callbacks = list(callbacks)
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def begin(self, packet):
+        return {'message_type': packet.message_type.name, 'bytes_sent': 0, 'bytes_received': 0,
+                'started': time.perf_counter(), 'wait': 0.0, 'decode': 0.0, 'error': None}
+
+    def received(self, trace, packet, frame):
+        trace['wait'] = time.perf_counter() - trace['started']
+        trace['bytes_sent'] = len(packet.get_frame())
+        size = len(frame[1])
+        trace['bytes_received'] = 1 + len(pack_varint_base128(size)) + size
+
+    def record(self, trace):
+        stats = self.stats.get(trace['message_type'])
+        if stats is None:
+            stats = self.stats[trace['message_type']] = RequestStats()
+        stats.count += 1
+        stats.errors += trace['error'] is not None
+        stats.bytes_sent += trace['bytes_sent']
+        stats.bytes_received += trace['bytes_received']
+        stats.wait.add(trace['wait'])
+        stats.decode.add(trace['decode'])
+        for callback in self.callbacks:
+            callback(trace)
+
+    def summary(self):
+        return [{'message_type': message_type, 'count': stats.count, 'errors': stats.errors,
+                 'bytes_sent': stats.bytes_sent, 'bytes_received': stats.bytes_received,
+                 'wait': stats.wait.summary(), 'decode': stats.decode.summary()}
+                for message_type, stats in self.stats.items()]
+
+
+class EndpointApi:
+    # Requests of the v8.service.Admin.Cluster service. RasClient sends them over the endpoint it
+    # opens on connect, RasEndpoint over an additional endpoint of the same connection. Agent,
+    # cluster and infobase authentication belongs to the endpoint it was done on: agent_auth,
+    # cluster_auth and infobase_auth keep the credentials to repeat after a reconnect, active_auth
+    # the ones the server has accepted on the current endpoint_id.
+    @staticmethod
+    def authenticate_agent_packet(user, pwd):
+        packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.AUTHENTICATE_AGENT_REQUEST)
+        packet.append(user.encode())
+        packet.append(pwd.encode())
+        return packet
+
+    @staticmethod
+    def authenticate_cluster_packet(cluster, user, pwd):
+        packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.AUTHENTICATE_REQUEST)
+        packet.append_raw(uuid_bytes(cluster))
+        packet.append(user.encode())
+        packet.append(pwd.encode())
+        return packet
+
+    @staticmethod
+    def authenticate_infobase_packet(cluster, user, pwd):
+        packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.ADD_AUTHENTICATION_REQUEST)
+        packet.append_raw(uuid_bytes(cluster))
+        packet.append(user.encode())
+        packet.append(pwd.encode())
+        return packet
+
+    def authentication_requests(self):
+        # (active_auth key, credentials, packet) of every authentication to repeat on a new endpoint_id
+        if self.agent_auth is not None:
+            yield ('agent', None), self.agent_auth, self.authenticate_agent_packet(*self.agent_auth)
+        for cluster, (user, pwd) in self.cluster_auth.items():
+            yield ('cluster', cluster), (user, pwd), self.authenticate_cluster_packet(cluster, user, pwd)
+        for cluster, (user, pwd) in self.infobase_auth.items():
+            yield ('infobase', cluster), (user, pwd), self.authenticate_infobase_packet(cluster, user, pwd)
+
+    async def cached_call(self, kind, key, packet, fresh=False):
+        # Answers from the metadata cache while its entry is fresh; otherwise (or with fresh=True)
+        # sends the request and stores the records
+        cache = self.metadata_cache
+        if cache is None:
+            return await self.call(packet)
+        key = self.cache_scope + key
+        records = None if fresh else cache.get(kind, key)
+        if records is None:
+            records = await self.call(packet)
+            cache.put(kind, key, records)
+        return records
+
+    def invalidate_cache(self, kind, key):
+        if self.metadata_cache is not None:
+            self.metadata_cache.invalidate(kind, self.cache_scope + key)
+
+    async def call(self, packet, materialize=True):
+        tracer = self.tracer
+        if tracer is None:
+            packet_type, packet_array = decode_packet(*await self.exchange(packet), materialize)
+            assert packet_type == PacketType.ENDPOINT_MESSAGE
+            return packet_array
+        trace = tracer.begin(packet)
+        try:
+            frame = await self.exchange(packet)
+            tracer.received(trace, packet, frame)
+            start = time.perf_counter()
+            packet_type, packet_array = decode_packet(*frame, materialize)
+            trace['decode'] = time.perf_counter() - start
+        except (Exception, MessageException) as e:
+            trace['error'] = type(e).__name__
+            raise
+        finally:
+            tracer.record(trace)
+        assert packet_type == PacketType.ENDPOINT_MESSAGE
+        return packet_array
 
-    if ras_args.command == 'cluster':
-        if ras_args.subcommand1 == 'list':
-            packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.GET_CLUSTERS_REQUEST)
-            send_packet(writer, packet)
-            packet_type, packet_array = await read_packet(reader)
+    async def iter_call(self, packet, materialize=True):
+        tracer = self.tracer
+        if tracer is None:
+            packet_type, packet_data = await self.exchange(packet)
+            records = iter_packet_records(packet_type, packet_data, materialize)
             assert packet_type == PacketType.ENDPOINT_MESSAGE
-            pp(packet_array)
-        elif ras_args.subcommand1 == 'info' or ras_args.subcommand1 == 'update':
-            cluster_id = uuid.UUID(ras_args.cluster).bytes
-            packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.GET_CLUSTER_INFO_REQUEST)
-            packet.append_raw(cluster_id)
-            send_packet(writer, packet)
-            packet_type, packet_array = await read_packet(reader)
+            for record in records:
+                yield record
+            return
+        # Decode time is the time spent producing records, not the time the caller spends on them
+        trace = tracer.begin(packet)
+        try:
+            frame = await self.exchange(packet)
+            tracer.received(trace, packet, frame)
+            start = time.perf_counter()
+            records = iter_packet_records(*frame, materialize)
+            trace['decode'] = time.perf_counter() - start
+            assert frame[0] == PacketType.ENDPOINT_MESSAGE
+            while True:
+                start = time.perf_counter()
+                record = next(records, None)
+                trace['decode'] += time.perf_counter() - start
+                if record is None:
+                    break
+                yield record
+        except (Exception, MessageException) as e:
+            trace['error'] = type(e).__name__
+            raise
+        finally:
+            tracer.record(trace)
+
+    async def authenticate(self, key, credentials, packet):
+        # The request is only sent when the server has not accepted these credentials on this
+        # endpoint yet, so a long-lived client can authenticate before every operation for free.
+        # After a failure the state on the server is unknown, and the next call sends it again.
+        if self.active_auth.get(key) == credentials:
+            return
+        self.active_auth.pop(key, None)
+        await self.call(packet)
+        self.active_auth[key] = credentials
+
+    async def authenticate_agent(self, user, pwd):
+        await self.authenticate(('agent', None), (user, pwd), self.authenticate_agent_packet(user, pwd))
+        self.agent_auth = (user, pwd)
+
+    async def authenticate_cluster(self, cluster, user, pwd):
+        await self.authenticate(('cluster', uuid_bytes(cluster)), (user, pwd),
+                                self.authenticate_cluster_packet(cluster, user, pwd))
+        self.cluster_auth[uuid_bytes(cluster)] = (user, pwd)
+
+    async def authenticate_infobase(self, cluster, user, pwd):
+        await self.authenticate(('infobase', uuid_bytes(cluster)), (user, pwd),
+                                self.authenticate_infobase_packet(cluster, user, pwd))
+        self.infobase_auth[uuid_bytes(cluster)] = (user, pwd)
+
+    async def get_clusters(self, fresh=False):
+        packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.GET_CLUSTERS_REQUEST)
+        return await self.cached_call('clusters', '', packet, fresh)
+
+    async def resolve_cluster(self, name, fresh=False):
+        # Cluster names are compared case-insensitively, like the platform does. A name missing from a
+        # cached list may belong to a cluster registered since, so the list is then read once more.
+        # With fresh=True the cached list is not used at all.
+        for refresh in ((True,) if fresh else (False, True)):
+            clusters = [cluster['cluster'] for cluster in await self.get_clusters(refresh)
+                        if cluster['name'].casefold() == name.casefold()]
+            if clusters:
+                break
+        if len(clusters) != 1:
+            raise LookupError(f'Cluster {name!r} ' + ('is ambiguous' if clusters else 'not found'))
+        return clusters[0]
+
+    async def get_cluster_info(self, cluster):
+        packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.GET_CLUSTER_INFO_REQUEST)
+        packet.append_raw(uuid_bytes(cluster))
+        return (await self.call(packet))[0]
+
+    async def update_cluster(self, cluster):
+        packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.REG_CLUSTER_REQUEST)
+        write_cluster(cluster, packet)
+        try:
+            await self.call(packet)
+        finally:
+            self.invalidate_cache('clusters', '')
+
+    @staticmethod
+    def get_infobases_short_packet(cluster):
+        packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.GET_INFOBASES_SHORT_REQUEST)
+        packet.append_raw(uuid_bytes(cluster))
+        return packet
+
+    async def get_infobases_short(self, cluster, fresh=False):
+        return await self.cached_call('infobases', cache_key(cluster), self.get_infobases_short_packet(cluster),
+                                      fresh)
+
+    async def iter_infobases(self, cluster):
+        # Always read from the server and decoded while printing; the cache is only for resolving names
+        async for infobase in self.iter_call(self.get_infobases_short_packet(cluster)):
+            yield infobase
+
+    async def get_infobase_short_info(self, cluster, infobase):
+        packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.GET_INFOBASE_SHORT_INFO_REQUEST)
+        packet.append_raw(uuid_bytes(cluster))
+        packet.append_raw(uuid_bytes(infobase))
+        return (await self.call(packet))[0]
+
+    async def resolve_infobase(self, cluster, name, fresh=False):
+        # Like resolve_cluster(). An id from the cached list is trusted while the list is fresh; a caller
+        # whose request for it fails resolves the name again with fresh=True.
+        for refresh in ((True,) if fresh else (False, True)):
+            infobases = [infobase['infobase'] for infobase in await self.get_infobases_short(cluster, refresh)
+                         if infobase['name'].casefold() == name.casefold()]
+            if infobases:
+                break
+        if len(infobases) != 1:
+            raise LookupError(f'Infobase {name!r} ' + ('is ambiguous' if infobases else 'not found'))
+        return infobases[0]
+
+    @staticmethod
+    def get_infobase_info_packet(cluster, infobase):
+        packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.GET_INFOBASE_INFO_REQUEST)
+        packet.append_raw(uuid_bytes(cluster))
+        packet.append_raw(uuid_bytes(infobase))
+        return packet
+
+    async def get_infobase_info(self, cluster, infobase, fresh=False):
+        packet = self.get_infobase_info_packet(cluster, infobase)
+        return (await self.cached_call('infobase', cache_key(cluster, infobase), packet, fresh))[0]
+
+    async def get_infobases_info(self, cluster, infobases, window=64):
+        # Pipelined get_infobase_info() of many infobases, always read from the server. Yields
+        # (infobase, record, None) or (infobase, None, MessageException) in request order.
+        async for infobase, records, error in self.call_pipelined(
+                infobases, lambda infobase: self.get_infobase_info_packet(cluster, infobase), window):
+            yield infobase, records and records[0], error
+
+    @staticmethod
+    def update_infobase_packet(cluster, infobase):
+        packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.UPDATE_INFOBASE_REQUEST)
+        packet.append_raw(uuid_bytes(cluster))
+        write_infobase(infobase, packet)
+        return packet
+
+    async def update_infobase(self, cluster, infobase):
+        try:
+            await self.call(self.update_infobase_packet(cluster, infobase))
+        finally:
+            # The name and description in the short list may have changed as well
+            self.invalidate_cache('infobase', cache_key(cluster, infobase['infobase']))
+            self.invalidate_cache('infobases', cache_key(cluster))
+
+    async def update_infobases(self, cluster, infobases, window=64):
+        # Pipelined update_infobase() of many infobase records. Yields (record, None) on success and
+        # (record, MessageException) on failure, in request order.
+        try:
+            async for infobase, records, error in self.call_pipelined(
+                    infobases, lambda infobase: self.update_infobase_packet(cluster, infobase), window):
+                self.invalidate_cache('infobase', cache_key(cluster, infobase['infobase']))
+                yield infobase, error
+        finally:
+            self.invalidate_cache('infobases', cache_key(cluster))
+
+    @staticmethod
+    def get_sessions_packet(cluster, infobase=None):
+        if infobase:
+            packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.GET_INFOBASE_SESSIONS_REQUEST)
+            packet.append_raw(uuid_bytes(cluster))
+            packet.append_raw(uuid_bytes(infobase))
+        else:
+            packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.GET_SESSIONS_REQUEST)
+            packet.append_raw(uuid_bytes(cluster))
+        return packet
+
+    async def get_sessions(self, cluster, infobase=None, materialize=False, session_filter=None):
+        # A SessionFilter drops sessions before they are decoded and decides how matches are returned
+        return await self.call(self.get_sessions_packet(cluster, infobase), session_filter or materialize)
+
+    async def get_session_columns(self, cluster, infobase=None):
+        return (await self.call(self.get_sessions_packet(cluster, infobase), COLUMNS))[0]
+
+    async def iter_sessions(self, cluster, infobase=None, materialize=True, session_filter=None):
+        async for session in self.iter_call(self.get_sessions_packet(cluster, infobase),
+                                            session_filter or materialize):
+            yield session
+
+    @staticmethod
+    def get_connections_packet(cluster, infobase=None):
+        if infobase:
+            packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.GET_INFOBASE_CONNECTIONS_SHORT_REQUEST)
+            packet.append_raw(uuid_bytes(cluster))
+            packet.append_raw(uuid_bytes(infobase))
+        else:
+            packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.GET_CONNECTIONS_SHORT_REQUEST)
+            packet.append_raw(uuid_bytes(cluster))
+        return packet
+
+    async def get_connections(self, cluster, infobase=None):
+        return await self.call(self.get_connections_packet(cluster, infobase))
+
+    @staticmethod
+    def get_locks_packet(cluster, infobase=None):
+        if infobase:
+            packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.GET_INFOBASE_LOCKS_REQUEST)
+            packet.append_raw(uuid_bytes(cluster))
+            packet.append_raw(uuid_bytes(infobase))
+        else:
+            packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.GET_LOCKS_REQUEST)
+            packet.append_raw(uuid_bytes(cluster))
+        return packet
+
+    async def get_locks(self, cluster, infobase=None):
+        return await self.call(self.get_locks_packet(cluster, infobase))
+
+    async def get_lock_graph(self, cluster, infobase=None):
+        # The three lists are requested at once, so the join waits for one round trip
+        sessions, locks, connections = await asyncio.gather(self.get_sessions(cluster, infobase),
+                                                            self.get_locks(cluster, infobase),
+                                                            self.get_connections(cluster, infobase))
+        return LockGraph(sessions, locks, connections)
+
+    async def get_resource_counters(self, cluster):
+        packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.GET_RESOURCE_COUNTERS_REQUEST)
+        packet.append_raw(uuid_bytes(cluster))
+        return await self.call(packet)
+
+    @staticmethod
+    def get_counter_values_packet(cluster, counter, counter_object='', accumulated=False):
+        # An empty object returns the values of every object the counter groups by. Accumulated
+        # values are the totals since the previous accumulated request; the server resets them.
+        packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.GET_COUNTER_ACCUMULATED_VALUES_REQUEST
+                        if accumulated else MessageType.GET_COUNTER_VALUES_REQUEST)
+        packet.append_raw(uuid_bytes(cluster))
+        packet.append(counter.encode())
+        packet.append(counter_object.encode())
+        return packet
+
+    async def get_counter_values(self, cluster, counter, counter_object='', accumulated=False):
+        return await self.call(self.get_counter_values_packet(cluster, counter, counter_object, accumulated))
+
+    @staticmethod
+    def terminate_session_packet(cluster, session, message):
+        packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.TERMINATE_SESSION_REQUEST)
+        packet.append_raw(uuid_bytes(cluster))
+        packet.append_raw(uuid_bytes(session))
+        packet.append(message.encode())
+        return packet
+
+    async def terminate_session(self, cluster, session, message='Session terminated by admin'):
+        await self.call(self.terminate_session_packet(cluster, session, message))
+
+    async def terminate_sessions(self, cluster, sessions, message='Session terminated by admin', window=64):
+        # Yields (session, None) on success and (session, MessageException) on failure, in request order
+        async for session, records, error in self.call_pipelined(
+                sessions, lambda session: self.terminate_session_packet(cluster, session, message), window):
+            yield session, error
+
+    async def call_pipelined(self, items, make_packet, window=64):
+        # Up to `window` requests are written before the first response is awaited. Yields
+        # (item, records, None) on success and (item, None, MessageException) on failure, in request
+        # order; connection errors are raised.
+        pending = collections.deque()
+        try:
+            for item in items:
+                packet = make_packet(item)
+                trace = self.tracer and self.tracer.begin(packet)
+                pending.append((item, self.submit(packet), packet, trace))
+                if len(pending) >= window:
+                    await self.drain()
+                    yield await self.pipelined_result(*pending.popleft())
+            while pending:
+                yield await self.pipelined_result(*pending.popleft())
+        finally:
+            # Responses nobody is going to read any more when the caller stops early
+            for item, future, packet, trace in pending:
+                future.cancel()
+
+    async def pipelined_result(self, item, future, packet, trace):
+        # The wait time of a pipelined request runs until its response is taken from the window
+        try:
+            frame = await self.wait_response(future)
+            if trace is not None:
+                self.tracer.received(trace, packet, frame)
+                start = time.perf_counter()
+            packet_type, packet_array = decode_packet(*frame)
             assert packet_type == PacketType.ENDPOINT_MESSAGE
-            if ras_args.subcommand1 == 'info':
-                pp(packet_array)
+        except (Exception, MessageException) as e:
+            if trace is not None:
+                trace['error'] = type(e).__name__
+                self.tracer.record(trace)
+            if isinstance(e, MessageException):
+                return item, None, e
+            raise
+        if trace is not None:
+            trace['decode'] = time.perf_counter() - start
+            self.tracer.record(trace)
+        return item, packet_array, None
+
+
+class RasEndpoint(EndpointApi):
+    # An additional endpoint opened with RasClient.open_endpoint(). It shares the connection, the
+    # dispatcher and the reconnect logic of the client but has its own endpoint_id and authentication.
+    def __init__(self, client, service, version):
+        self.client = client
+        self.service = service
+        self.version = version
+        self.endpoint_id = None
+        self.agent_auth = None
+        self.cluster_auth = {}
+        self.infobase_auth = {}
+        self.active_auth = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    @property
+    def tracer(self):
+        return self.client.tracer
+
+    @property
+    def metadata_cache(self):
+        return self.client.metadata_cache
+
+    @property
+    def cache_scope(self):
+        return self.client.cache_scope
+
+    async def close(self):
+        await self.client.close_endpoint(self)
+
+    def submit(self, packet):
+        return self.client.submit(packet, self)
+
+    async def exchange(self, packet):
+        return await self.client.exchange(packet, self)
+
+    async def wait_response(self, future):
+        return await self.client.wait_response(future)
+
+    async def drain(self):
+        await self.client.drain()
+
+
+class RasClient(EndpointApi):
+    # A dispatcher task owns the reader once the connection is established. Each request puts a
+    # future in the FIFO queue of its endpoint before the packet is written; the dispatcher hands
+    # every response frame to the oldest waiting future of the endpoint it came from. Responses are
+    # decoded by the waiting task, so MessageException is raised there. Independent tasks can share
+    # one client without waiting for each other's responses.
+    #
+    # The client itself talks to the v8.service.Admin.Cluster endpoint opened on connect. More
+    # endpoints can be opened over the same connection with open_endpoint(); ENDPOINT_OPEN
+    # requests wait in a separate control queue.
+    #
+    # With keep_alive_interval set, a KEEP_ALIVE frame is sent whenever the connection has been
+    # idle for that long. With keep_alive_misses set as well, a connection that has received nothing,
+    # not even a keep-alive, for that many intervals is considered half-open and dropped; this only
+    # works with a server that answers KEEP_ALIVE, so it is off by default. A request that times out
+    # fails alone: its cancelled future stays queued, so its late response is still matched to it
+    # and discarded instead of going to the next waiter. After timeout_limit timeouts in a row, with
+    # no response reaching a waiting request in between, the connection is considered dead and
+    # dropped, which also empties the queues. With reconnect_attempts set, a request that finds the
+    # connection dead is sent over a new connection, and a read-only request whose connection is lost
+    # while it waits is retried once; reconnecting backs off exponentially between attempts, reopens
+    # every endpoint and replays the authentication done on it so far.
+    #
+    # With a RequestTracer, every request of the client and its endpoints is traced. With a
+    # MetadataCache, cluster and infobase metadata is answered from it while fresh.
+    SERVICE = 'v8.service.Admin.Cluster'
+    VERSION = '10.0'
+
+    def __init__(self, host='localhost', port=1545, connect_timeout=2000, keep_alive_interval=None,
+                 request_timeout=None, reconnect_attempts=0, reconnect_delay=0.5, reconnect_max_delay=30,
+                 tracer=None, metadata_cache=None, keep_alive_misses=None, timeout_limit=3):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.keep_alive_interval = keep_alive_interval
+        self.keep_alive_misses = keep_alive_misses
+        self.request_timeout = request_timeout
+        self.timeout_limit = timeout_limit
+        self.reconnect_attempts = reconnect_attempts
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.tracer = tracer
+        self.metadata_cache = metadata_cache
+        self.service = self.SERVICE
+        self.version = self.VERSION
+        self.reader = None
+        self.writer = None
+        self.frames = None
+        self.endpoint_id = None
+        self.endpoints = []
+        self.cluster_endpoints = {}
+        self.dispatcher = None
+        self.pending = {}
+        self.generation = 0
+        self.reconnect_lock = asyncio.Lock()
+        self.keep_alive_task = None
+        self.last_sent_at = 0
+        self.timeouts = 0
+        self.agent_auth = None
+        self.cluster_auth = {}
+        self.infobase_auth = {}
+        self.active_auth = {}
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    @property
+    def cache_scope(self):
+        return f'{self.host}:{self.port}'
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def connect(self):
+        await self.open()
+        if self.keep_alive_interval and self.keep_alive_task is None:
+            self.keep_alive_task = asyncio.create_task(self.keep_alive())
+
+    async def open(self):
+        # The handshake is limited by the request timeout, so a stalled server cannot hang a reconnect
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port),
+                                                          self.request_timeout)
+        self.frames = FrameReader(self.reader)
+        data = struct.pack(">ihh", 475223888, 256, 256)  # magic numbers voodoo numbers
+        self.writer.write(data)
+        packet = Packet(PacketType.CONNECT)
+        packet.append_raw(b'\x01')
+        packet.append(b'connect.timeout')
+        packet.append_raw(ParamType.INT.value + struct.pack(">i", self.connect_timeout))
+        self.send(packet)
+        packet_type, packet_array = await asyncio.wait_for(read_packet(self.frames), self.request_timeout)
+        assert packet_type == PacketType.CONNECT_ACK
+        assert len(packet_array) == 0
+        self.dispatcher = asyncio.create_task(self.dispatch(self.frames))
+        await self.open_endpoint_id(self)
+        for endpoint in self.endpoints:
+            await self.open_endpoint_id(endpoint)
+
+    async def open_endpoint_id(self, endpoint):
+        packet = Packet(PacketType.ENDPOINT_OPEN)
+        packet.append(endpoint.service.encode())
+        packet.append(endpoint.version.encode())
+        packet_type, packet_array = decode_packet(*await self.wait_response(self.enqueue(None, packet)))
+        assert packet_type == PacketType.ENDPOINT_OPEN_ACK
+        assert packet_array[0] == endpoint.service.encode()
+        assert packet_array[1] == endpoint.version.encode()
+        endpoint.endpoint_id = packet_array[2]
+
+    async def open_endpoint(self, service=SERVICE, version=VERSION):
+        endpoint = RasEndpoint(self, service, version)
+        await self.open_endpoint_id(endpoint)
+        self.endpoints.append(endpoint)
+        return endpoint
+
+    async def cluster_endpoint(self, cluster):
+        # A dedicated endpoint per cluster keeps the authentication of each cluster apart, so several
+        # clusters of one agent can be queried at the same time over one connection.
+        key = uuid_bytes(cluster)
+        endpoint = self.cluster_endpoints.get(key)
+        if endpoint is None:
+            endpoint = self.cluster_endpoints[key] = await self.open_endpoint()
+        return endpoint
+
+    def send_endpoint_close(self, endpoint):
+        packet = Packet(PacketType.ENDPOINT_CLOSE)
+        packet.append(pack_varint_base64(endpoint.endpoint_id))
+        self.send(packet)
+
+    async def close_endpoint(self, endpoint):
+        if endpoint in self.endpoints:
+            self.endpoints.remove(endpoint)
+        for key, value in list(self.cluster_endpoints.items()):
+            if value is endpoint:
+                del self.cluster_endpoints[key]
+        if self.is_alive() and endpoint.endpoint_id is not None:
+            self.send_endpoint_close(endpoint)
+            for future in self.pending.pop(endpoint.endpoint_id, ()):
+                if not future.done():
+                    future.set_exception(ConnectionResetError('RAS endpoint closed'))
+        endpoint.endpoint_id = None
+        endpoint.active_auth = {}
+
+    async def close(self):
+        if self.keep_alive_task is not None:
+            self.keep_alive_task.cancel()
+            self.keep_alive_task = None
+        if self.writer is None:
+            return
+        writer = self.writer
+        if self.is_alive():
+            for endpoint in self.endpoints:
+                self.send_endpoint_close(endpoint)
+            self.send_endpoint_close(self)
+            self.send(Packet(PacketType.DISCONNECT))
+        self.endpoints = []
+        self.cluster_endpoints = {}
+        self.drop_connection()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    def is_alive(self):
+        return (self.writer is not None and not self.writer.is_closing()
+                and self.dispatcher is not None and not self.dispatcher.done())
+
+    def drop_connection(self, error=None):
+        if self.dispatcher is not None:
+            self.dispatcher.cancel()
+        if self.writer is not None:
+            self.writer.close()
+        self.fail_pending(error or ConnectionResetError('RAS connection closed'))
+        self.reader = self.writer = self.frames = self.endpoint_id = self.dispatcher = None
+        self.timeouts = 0
+        self.active_auth = {}
+        for endpoint in self.endpoints:
+            endpoint.endpoint_id = None
+            endpoint.active_auth = {}
+
+    def fail_pending(self, error):
+        pending, self.pending = self.pending, {}
+        for waiters in pending.values():
+            for future in waiters:
+                if not future.done():
+                    future.set_exception(error)
+
+    async def dispatch(self, frames):
+        # Frames are routed by the endpoint_id of ENDPOINT_MESSAGE and ENDPOINT_FAILURE. Everything
+        # else, and a failure of an endpoint that is still being opened, goes to the control queue.
+        try:
+            while True:
+                packet_type, packet_data = await frames.read_frame()
+                waiters = self.pending.get(frame_endpoint_id(packet_type, packet_data))
+                if not waiters and packet_type == PacketType.ENDPOINT_FAILURE:
+                    waiters = self.pending.get(None)
+                if not waiters:
+                    continue
+                future = waiters.popleft()
+                if not future.done():
+                    self.timeouts = 0
+                    future.set_result((packet_type, packet_data))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if self.frames is frames:
+                self.fail_pending(e if isinstance(e, CONNECTION_ERRORS) else ConnectionResetError(str(e)))
+
+    async def reconnect(self, generation):
+        # Only the first of several tasks that saw the same connection fail reconnects; the others
+        # wait for it and retry over the new connection.
+        async with self.reconnect_lock:
+            if generation != self.generation and self.is_alive():
+                return
+            self.drop_connection()
+            delay = self.reconnect_delay
+            for attempt in range(1, self.reconnect_attempts + 1):
+                try:
+                    await self.open()
+                    await self.replay_authentication()
+                    self.generation += 1
+                    return
+                except CONNECTION_ERRORS:
+                    self.drop_connection()
+                    if attempt == self.reconnect_attempts:
+                        raise
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.reconnect_max_delay)
+
+    async def replay_authentication(self):
+        for endpoint in [self, *self.endpoints]:
+            for key, credentials, packet in list(endpoint.authentication_requests()):
+                decode_packet(*await self.wait_response(self.submit(packet, endpoint)))
+                endpoint.active_auth[key] = credentials
+
+    async def keep_alive(self):
+        while True:
+            if self.is_alive():
+                await asyncio.sleep(self.keep_alive_interval - (time.monotonic() - self.last_sent_at))
+            else:
+                await asyncio.sleep(self.keep_alive_interval)
+            if not self.is_alive():
+                continue
+            now = time.monotonic()
+            if self.keep_alive_misses and now - self.frames.last_frame_at >= (self.keep_alive_misses *
+                                                                              self.keep_alive_interval):
+                # The next request reconnects when reconnect_attempts is set
+                self.drop_connection(ConnectionResetError('RAS connection is not responding'))
+            elif now - self.last_sent_at >= self.keep_alive_interval:
+                self.send(Packet(PacketType.KEEP_ALIVE))
+
+    def send(self, packet):
+        send_packet(self.writer, packet)
+        self.last_sent_at = time.monotonic()
+
+    async def drain(self):
+        await self.writer.drain()
+
+    def enqueue(self, key, packet):
+        # Queues a future for the response and writes the request; both happen without yielding to
+        # the event loop, so the queue order always matches the order on the wire.
+        if not self.is_alive():
+            raise ConnectionResetError('RAS connection closed')
+        future = asyncio.get_running_loop().create_future()
+        self.pending.setdefault(key, collections.deque()).append(future)
+        self.send(packet)
+        return future
+
+    def submit(self, packet, endpoint=None):
+        endpoint = endpoint or self
+        if endpoint.endpoint_id is None:
+            raise ConnectionResetError('RAS endpoint closed')
+        packet.endpoint_id = endpoint.endpoint_id
+        return self.enqueue(endpoint.endpoint_id, packet)
+
+    async def wait_response(self, future):
+        try:
+            return await asyncio.wait_for(future, self.request_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            if self.timeout_limit and self.timeouts >= self.timeout_limit and self.is_alive():
+                self.drop_connection(ConnectionResetError('RAS connection is not responding'))
+            raise
+
+    async def exchange(self, packet, endpoint=None):
+        # Sends a request and returns the raw response frame
+        generation = self.generation
+        if self.reconnect_attempts and (not self.is_alive() or self.reconnect_lock.locked()):
+            await self.reconnect(generation)
+            generation = self.generation
+        try:
+            future = self.submit(packet, endpoint)
+        except CONNECTION_ERRORS:
+            # Nothing was written, so any request can go over the new connection
+            if not self.reconnect_attempts:
+                raise
+        else:
+            try:
+                return await self.wait_response(future)
+            except asyncio.TimeoutError:
+                # The connection stays unless this timeout was the one that dropped it
+                if (self.is_alive() and self.generation == generation or not self.reconnect_attempts
+                        or packet.message_type not in READ_ONLY_REQUESTS):
+                    raise
+            except CONNECTION_ERRORS:
+                if not self.reconnect_attempts or packet.message_type not in READ_ONLY_REQUESTS:
+                    raise
+        await self.reconnect(generation)
+        return await self.wait_response(self.submit(packet, endpoint))
+
+
+SESSION_COUNTERS = ('calls_all', 'bytes_all', 'dbms_bytes_all', 'cpu_time_total', 'duration_all', 'duration_all_dbms',
+                    'memory_total', 'read_total', 'write_total')
+SESSION_WATCH_FIELDS = ('hibernate', 'blocked_by_dbms', 'blocked_by_ls', 'current_service_name')
+
+
+class SessionSnapshot:
+    # Keeps the previous poll indexed by session_id and turns the next poll into added, removed and
+    # changed events in one pass over it. Only the counters and watched fields of each session are
+    # compared; a changed event carries the counter deltas and the old and new watched values.
+    def __init__(self, counters=SESSION_COUNTERS, fields=SESSION_WATCH_FIELDS):
+        self.counters = counters
+        self.fields = fields
+        self.values = operator.itemgetter(*counters, *fields)
+        self.sessions = {}
+
+    def update(self, sessions):
+        previous = self.sessions
+        current = {}
+        events = []
+        counter_count = len(self.counters)
+        for session in sessions:
+            session_id = session['session_id']
+            values = self.values(session)
+            current[session_id] = (session, values)
+            old = previous.get(session_id)
+            if old is None:
+                events.append({'event': 'added', 'session_id': session_id, 'session': session})
+            elif old[1] != values:
+                old_values = old[1]
+                deltas = {name: values[index] - old_values[index] for index, name in enumerate(self.counters)
+                          if values[index] != old_values[index]}
+                changes = {name: [old_values[index], values[index]]
+                           for index, name in enumerate(self.fields, counter_count)
+                           if values[index] != old_values[index]}
+                events.append({'event': 'changed', 'session_id': session_id, 'session': session,
+                               'deltas': deltas, 'changes': changes})
+        for session_id, (session, values) in previous.items():
+            if session_id not in current:
+                events.append({'event': 'removed', 'session_id': session_id, 'session': session})
+        self.sessions = current
+        return events
+
+
+LOCK_SESSION_FIELDS = ('session_id', 'id', 'infobase_id', 'user_name', 'app_id', 'host', 'blocked_by_dbms',
+                       'blocked_by_ls', 'duration_current', 'db_proc_info')
+LOCK_FIELDS = ('object', 'descr', 'locked_at')
+
+
+class LockGraph:
+    # Joins the locks, connections and sessions of a cluster through dict indexes built in one
+    # pass over each list, so the lock list and the blocking tree take linear time. A session waits
+    # in the lock manager on the session numbered blocked_by_ls and in the DBMS on the connection
+    # numbered blocked_by_dbms. A lock names its session, or only its connection when it is held
+    # outside of a session.
+    def __init__(self, sessions, locks, connections):
+        self.locks = locks
+        self.sessions = {}
+        self.session_numbers = {}
+        for session in sessions:
+            self.sessions[session['session_id']] = session
+            self.session_numbers[session['id']] = session
+        self.connections = {}
+        self.connection_numbers = {}
+        for connection in connections:
+            self.connections[connection['connection']] = connection
+            self.connection_numbers[connection['conn_id']] = connection
+
+    def lock_session(self, lock):
+        session = self.sessions.get(lock['session'])
+        if session is None:
+            connection = self.connections.get(lock['connection'])
+            if connection is not None:
+                session = self.session_numbers.get(connection['session_number'])
+        return session
+
+    def blocker(self, session):
+        if session['blocked_by_ls']:
+            return self.session_numbers.get(session['blocked_by_ls'])
+        if session['blocked_by_dbms']:
+            connection = self.connection_numbers.get(session['blocked_by_dbms'])
+            if connection is not None:
+                return self.session_numbers.get(connection['session_number'])
+        return None
+
+    def lock_list(self):
+        records = []
+        for lock in self.locks:
+            session = self.lock_session(lock)
+            record = dict(lock)
+            record['session_number'] = session['id'] if session is not None else None
+            record['user_name'] = session['user_name'] if session is not None else None
+            record['app_id'] = session['app_id'] if session is not None else None
+            records.append(record)
+        return records
+
+    def trees(self):
+        # Returns the sessions that block others while waiting on nobody, each with the sessions
+        # waiting on it under 'blocked' and their total number in 'blocked_count'. Sessions waiting
+        # on each other in a cycle are returned as a tree with 'deadlock' set on the root; the edge
+        # back to the root is dropped, so every tree is finite.
+        parents = {}
+        children = collections.defaultdict(list)
+        for session_id, session in self.sessions.items():
+            blocker = self.blocker(session)
+            if blocker is not None and blocker['session_id'] != session_id:
+                parents[session_id] = blocker['session_id']
+                children[blocker['session_id']].append(session_id)
+        session_locks = collections.defaultdict(list)
+        for lock in self.locks:
+            session = self.lock_session(lock)
+            if session is not None and (session['session_id'] in children or session['session_id'] in parents):
+                session_locks[session['session_id']].append({name: lock[name] for name in LOCK_FIELDS})
+
+        nodes = {}
+        order = []
+
+        def walk(root_id):
+            stack = [root_id]
+            while stack:
+                session_id = stack.pop()
+                node = {name: self.sessions[session_id][name] for name in LOCK_SESSION_FIELDS}
+                node['locks'] = session_locks.get(session_id, [])
+                node['blocked_count'] = 0
+                node['blocked'] = []
+                nodes[session_id] = node
+                order.append(session_id)
+                if session_id != root_id:
+                    nodes[parents[session_id]]['blocked'].append(node)
+                stack.extend(children.get(session_id, ()))
+            return nodes[root_id]
+
+        roots = [walk(session_id) for session_id in children if session_id not in parents]
+        for session_id in list(parents):
+            if session_id in nodes:
+                continue
+            # Not reachable from a root, so the chain of blockers above it ends in a cycle
+            path = set()
+            while session_id not in path:
+                path.add(session_id)
+                session_id = parents[session_id]
+            children[parents.pop(session_id)].remove(session_id)
+            root = walk(session_id)
+            root['deadlock'] = True
+            roots.append(root)
+        for session_id in reversed(order):
+            if session_id in parents:
+                nodes[parents[session_id]]['blocked_count'] += nodes[session_id]['blocked_count'] + 1
+        return roots
+
+
+METADATA_TTL = {'clusters': 300, 'infobases': 300, 'infobase': 30}
+# The kinds kept in the cache file, with the layout of their records. Infobase info carries the
+# database credentials, so it is only cached in memory.
+METADATA_FILE_LAYOUTS = {'clusters': 'cluster', 'infobases': 'infobase_short'}
+
+
+def restore_record(layout, record):
+    # Turns a record read back from JSON into the types read_<layout>() returns
+    record = dict(record)
+    for name, kind in RECORD_LAYOUTS[layout]:
+        value = record.get(name)
+        if value is None:
+            continue
+        if kind == 'uuid':
+            record[name] = uuid.UUID(value)
+        elif kind == 'date':
+            record[name] = datetime.datetime.fromisoformat(value)
+        elif kind == 'bytes':
+            record[name] = bytes.fromhex(value)
+    return record
+
+
+class MetadataCache:
+    # Cluster lists, short infobase lists and infobase info, each kept for the TTL of its kind.
+    # Entries are keyed by the address of the RAS and the ids the request was made for. With a
+    # path, the lists are also written to a JSON file (readable by the owner only) and read back by
+    # the next process, so names can be resolved to ids without asking the server again. Callers
+    # get copies, so changing a returned record does not change the cache.
+    def __init__(self, path=None, ttl=None):
+        self.path = path
+        self.ttl = dict(METADATA_TTL, **(ttl or {}))
+        self.entries = {kind: {} for kind in self.ttl}
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as cache_file:
+                stored = json.load(cache_file)
+        except (OSError, ValueError):
+            return  # a damaged file is ignored and rewritten on the next save
+        for kind, layout in METADATA_FILE_LAYOUTS.items():
+            for key, (stored_at, records) in stored.get(kind, {}).items():
+                self.entries[kind][key] = (stored_at, [restore_record(layout, record) for record in records])
+
+    def save(self):
+        if self.path is None:
+            return
+        now = time.time()
+        stored = {kind: {key: entry for key, entry in self.entries[kind].items() if now - entry[0] <= self.ttl[kind]}
+                  for kind in METADATA_FILE_LAYOUTS}
+        # Each save writes its own temporary file (mkstemp creates it readable by the owner only), so
+        # processes sharing the cache file do not clash; the last replace wins. The cache is only an
+        # optimization, so a failed write is reported and never fails the command.
+        temp_path = None
+        try:
+            descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)),
+                                                     prefix=os.path.basename(self.path) + '.', suffix='.tmp')
+            with open(descriptor, 'w') as cache_file:
+                json.dump(stored, cache_file, ensure_ascii=False, default=json_default)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print("Can't save metadata cache -", e, file=sys.stderr)
+            if temp_path is not None:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+    def get(self, kind, key):
+        entry = self.entries[kind].get(key)
+        if entry is None or time.time() - entry[0] > self.ttl[kind]:
+            return None
+        return [dict(record) for record in entry[1]]
+
+    def put(self, kind, key, records):
+        self.entries[kind][key] = (time.time(), [dict(record) for record in records])
+        if kind in METADATA_FILE_LAYOUTS:
+            self.save()
+
+    def invalidate(self, kind, key):
+        if self.entries[kind].pop(key, None) is not None and kind in METADATA_FILE_LAYOUTS:
+            self.save()
+
+
+COUNTER_VALUE_FIELDS = tuple(name for name, kind in RECORD_LAYOUTS['counter_value'] if kind == 'long')
+COUNTER_PERCENTILES = (0.5, 0.9, 0.99)
+
+
+class SampleRing:
+    # The last `capacity` samples of one counter object: a timestamp column and an int64 column per
+    # value, preallocated as array.array. Once the ring is full every sample overwrites the oldest
+    # one, so memory does not grow however long sampling runs.
+    def __init__(self, capacity, fields=COUNTER_VALUE_FIELDS):
+        self.capacity = capacity
+        self.total = 0
+        self.times = array.array('d', bytes(8 * capacity))
+        self.columns = {name: array.array('q', bytes(8 * capacity)) for name in fields}
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def append(self, timestamp, record):
+        slot = self.total % self.capacity
+        self.times[slot] = timestamp
+        for name, column in self.columns.items():
+            column[slot] = record[name]
+        self.total += 1
+
+    def last_time(self):
+        return self.times[(self.total - 1) % self.capacity] if self.total else None
+
+    def window_start(self, since):
+        # Samples are appended in time order, so the first one at or after `since` is found by
+        # bisecting the logical positions of the stored samples
+        low, high = self.total - len(self), self.total
+        while low < high:
+            middle = (low + high) // 2
+            if self.times[middle % self.capacity] < since:
+                low = middle + 1
             else:
-                cluster = packet_array[0]
-                if ras_args.lifetime_limit is not None:
-                    cluster['lifetime-limit'] = ras_args.lifetime_limit
-                if ras_args.expiration_timeout is not None:
-                    cluster['expiration-timeout'] = ras_args.expiration_timeout
-                if ras_args.name is not None:
-                    cluster['name'] = ras_args.name
-                if ras_args.agent_user is not None and ras_args.agent_pwd is not None:
-                    packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.AUTHENTICATE_AGENT_REQUEST)
-                    packet.append(ras_args.agent_user.encode())
-                    packet.append(ras_args.agent_pwd.encode())
-                    send_packet(writer, packet)
-                    packet_type, packet_array = await read_packet(reader)
-                    assert packet_type == PacketType.ENDPOINT_MESSAGE
-                packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.REG_CLUSTER_REQUEST)
-                write_cluster(cluster, packet)
-                send_packet(writer, packet)
-                packet_type, packet_array = await read_packet(reader)
-                assert packet_type == PacketType.ENDPOINT_MESSAGE
+                high = middle
+        return low
+
+    def window(self, name, seconds=None, now=None):
+        # Values of `name` sampled in the last `seconds` (all stored ones without it), oldest first
+        start = self.total - len(self)
+        if seconds is not None:
+            start = self.window_start((time.time() if now is None else now) - seconds)
+        column = self.columns[name]
+        first, end = start % self.capacity, self.total % self.capacity
+        if start == self.total:
+            return column[:0]
+        if first < end:
+            return column[first:end]
+        return column[first:] + column[:end]
+
+    def stats(self, name, seconds=None, now=None, percentiles=COUNTER_PERCENTILES):
+        # Min, max and nearest-rank percentiles of the window, or None when it has no samples
+        values = sorted(self.window(name, seconds, now))
+        if not values:
+            return None
+        result = {'count': len(values), 'min': values[0], 'max': values[-1]}
+        for fraction in percentiles:
+            result[f'p{fraction * 100:g}'] = values[max(0, math.ceil(fraction * len(values)) - 1)]
+        return result
+
+
+class CounterSampler:
+    # Polls the values of resource counters of a cluster every `interval` seconds over one
+    # endpoint and keeps the last `capacity` samples of every (counter, object) in a SampleRing.
+    # The requests of a poll are pipelined, so it takes one round trip whatever the number of
+    # counters. Polls follow a fixed schedule; a poll that overruns its slot skips the missed ones.
+    # Rings of objects that have not been seen for a full ring's time are dropped.
+    def __init__(self, endpoint, cluster, counters=None, interval=5, capacity=720):
+        self.endpoint = endpoint
+        self.cluster = cluster
+        self.counters = counters
+        self.interval = interval
+        self.capacity = capacity
+        self.rings = {}
+        self.polls = 0
+        self.poll_errors = 0
+        self.errors = {}
+
+    async def poll(self):
+        if self.counters is None:
+            self.counters = [counter['name'] for counter in await self.endpoint.get_resource_counters(self.cluster)]
+        now = time.time()
+        async for counter, records, error in self.endpoint.call_pipelined(
+                self.counters, lambda counter: self.endpoint.get_counter_values_packet(self.cluster, counter),
+                max(len(self.counters), 1)):
+            if error is not None:
+                self.errors[counter] = str(error)
+                continue
+            self.errors.pop(counter, None)
+            for record in records:
+                ring = self.rings.get((counter, record['object']))
+                if ring is None:
+                    ring = self.rings[(counter, record['object'])] = SampleRing(self.capacity)
+                ring.append(now, record)
+        expired = now - self.capacity * self.interval
+        for key in [key for key, ring in self.rings.items() if ring.last_time() < expired]:
+            del self.rings[key]
+        self.polls += 1
+
+    async def run(self, duration=None):
+        started = next_poll = time.monotonic()
+        while duration is None or next_poll - started < duration:
+            try:
+                await self.poll()
+            except (Exception, MessageException) as e:
+                print("Can't poll counter values -", e, file=sys.stderr)
+                self.poll_errors += 1
+            now = time.monotonic()
+            next_poll += self.interval
+            if next_poll < now:
+                next_poll += (now - next_poll) // self.interval * self.interval + self.interval
+            await asyncio.sleep(next_poll - now)
+
+    def summary(self, seconds=None, fields=COUNTER_VALUE_FIELDS, percentiles=COUNTER_PERCENTILES):
+        # One record per counter object with the statistics of every field over the window
+        now = time.time()
+        records = []
+        for (counter, counter_object), ring in self.rings.items():
+            record = {'counter': counter, 'object': counter_object, 'samples': len(ring)}
+            for name in fields:
+                record[name] = ring.stats(name, seconds, now, percentiles)
+            records.append(record)
+        return records
+
+
+def parse_ras_address(value, default_port=1545):
+    host, sep, port = value.strip().rpartition(':')
+    if not sep or not port.isdigit():
+        return value.strip(), default_port
+    return host, int(port)
+
+
+def read_ras_addresses(path, default_port=1545):
+    with open(path) as f:
+        lines = [line.split('#', 1)[0].strip() for line in f]
+    return [parse_ras_address(line, default_port) for line in lines if line]
+
+
+async def fleet_map(addresses, func, concurrency=16, timeout=30, connect_timeout=2000, tracer=None):
+    # Runs func(client) against every RAS address with its own connection, at most `concurrency`
+    # at a time and each limited to `timeout` seconds. Yields (address, result, error) tuples in
+    # completion order.
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(host, port):
+        async with RasClient(host, port, connect_timeout, tracer=tracer) as client:
+            return await func(client)
+
+    async def run(host, port):
+        async with semaphore:
+            try:
+                return (host, port), await asyncio.wait_for(run_one(host, port), timeout), None
+            except (Exception, MessageException) as e:
+                return (host, port), None, e
+
+    for task in asyncio.as_completed([run(host, port) for host, port in addresses]):
+        yield await task
+
+
+def fleet_clusters():
+    async def query(client):
+        ras = f'{client.host}:{client.port}'
+        return [{'ras': ras, **cluster} for cluster in await client.get_clusters()]
+    return query
+
+
+def fleet_cluster_records(query_cluster, cluster_user=None, cluster_pwd=None):
+    # Calls query_cluster(endpoint, cluster_id) for every cluster of the agent and tags each record
+    # with the RAS address and the cluster. Clusters are queried at the same time, each over its
+    # own endpoint of the agent connection.
+    async def query(client):
+        ras = f'{client.host}:{client.port}'
+
+        async def query_one(cluster):
+            endpoint = await client.cluster_endpoint(cluster)
+            if cluster_user is not None and cluster_pwd is not None:
+                await endpoint.authenticate_cluster(cluster, cluster_user, cluster_pwd)
+            return [{'ras': ras, 'cluster': cluster, **record} for record in await query_cluster(endpoint, cluster)]
+
+        results = await asyncio.gather(*(query_one(cluster['cluster']) for cluster in await client.get_clusters()))
+        return [record for records in results for record in records]
+    return query
+
+
+def fleet_sessions(cluster_user=None, cluster_pwd=None):
+    async def query_cluster(endpoint, cluster):
+        return await endpoint.get_sessions(cluster, materialize=True)
+    return fleet_cluster_records(query_cluster, cluster_user, cluster_pwd)
+
+
+def fleet_infobases(cluster_user=None, cluster_pwd=None):
+    async def query_cluster(endpoint, cluster):
+        return await endpoint.get_infobases_short(cluster)
+    return fleet_cluster_records(query_cluster, cluster_user, cluster_pwd)
+
+
+def prometheus_labels(labels):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+class MetricsExporter:
+    # Polls clusters and sessions over one RAS connection and keeps the rendered Prometheus text.
+    # Scrapes are answered from that text and never reach the RAS server.
+    SESSION_METRICS = [
+        ('rac_sessions', 'gauge', 'Number of sessions'),
+        ('rac_sessions_hibernated', 'gauge', 'Number of hibernated sessions'),
+        ('rac_sessions_blocked_by_dbms', 'gauge', 'Number of sessions waiting for a DBMS lock'),
+        ('rac_sessions_blocked_by_ls', 'gauge', 'Number of sessions waiting for a managed lock'),
+        ('rac_session_cpu_time_last5min_seconds', 'gauge', 'CPU time used by sessions in the last 5 minutes'),
+        ('rac_session_memory_current_bytes', 'gauge', 'Memory used by the current server calls of sessions'),
+        ('rac_session_duration_current_dbms_seconds', 'gauge', 'Duration of the current DBMS calls of sessions'),
+        ('rac_session_calls_last5min', 'gauge', 'Server calls made by sessions in the last 5 minutes'),
+    ]
+
+    def __init__(self, client, clusters=None, cluster_user=None, cluster_pwd=None, interval=15):
+        self.client = client
+        # Ids are compared as UUIDs, so their case and format in the arguments do not matter
+        self.clusters = {uuid.UUID(str(cluster)) for cluster in clusters} if clusters else None
+        self.cluster_user = cluster_user
+        self.cluster_pwd = cluster_pwd
+        self.interval = interval
+        self.connected = False
+        self.up = False
+        self.poll_errors = 0
+        self.poll_duration = 0
+        self.last_success = 0
+        self.cluster_lines = []
+        self.sessions = {}
+        self.text = b''
+
+    async def collect(self):
+        # After the first connect the client re-establishes a lost connection by itself
+        if not self.connected:
+            try:
+                await self.client.connect()
+            except (Exception, MessageException):
+                # The socket of a failed handshake is closed before the next poll opens another one
+                self.client.drop_connection()
+                raise
+            self.connected = True
+        clusters = await self.client.get_clusters()
+        if self.clusters:
+            clusters = [cluster for cluster in clusters if cluster['cluster'] in self.clusters]
+        cluster_lines = [prometheus_labels({'cluster': cluster['cluster'], 'name': cluster['name'],
+                                            'host': cluster['host'], 'port': cluster['port']})
+                         for cluster in clusters]
+        sessions = {}
+        # Each cluster is polled over its own endpoint, so the clusters are polled at the same time
+        results = await asyncio.gather(*(self.collect_cluster(cluster['cluster']) for cluster in clusters))
+        for cluster_sessions in results:
+            sessions.update(cluster_sessions)
+        return cluster_lines, sessions
+
+    async def collect_cluster(self, cluster_id):
+        endpoint = await self.client.cluster_endpoint(cluster_id)
+        if self.cluster_user is not None and self.cluster_pwd is not None:
+            await endpoint.authenticate_cluster(cluster_id, self.cluster_user, self.cluster_pwd)
+        infobase_names = {infobase['infobase']: infobase['name']
+                          for infobase in await endpoint.get_infobases_short(cluster_id)}
+        sessions = {}
+        for session in await endpoint.get_sessions(cluster_id):
+            infobase_id = session['infobase_id']
+            key = (cluster_id, infobase_id, infobase_names.get(infobase_id, ''), session['app_id'])
+            values = sessions.get(key)
+            if values is None:
+                values = sessions[key] = [0] * len(self.SESSION_METRICS)
+            values[0] += 1
+            values[1] += session['hibernate']
+            values[2] += session['blocked_by_dbms'] != 0
+            values[3] += session['blocked_by_ls'] != 0
+            values[4] += session['cpu_time_last5min'] / 1000
+            values[5] += session['memory_current']
+            values[6] += session['duration_current_dbms'] / 1000
+            values[7] += session['calls_last5min']
+        return sessions
+
+    def render(self):
+        lines = ['# HELP rac_cluster_info Cluster known to the RAS agent', '# TYPE rac_cluster_info gauge']
+        lines.extend(f'rac_cluster_info{labels} 1' for labels in self.cluster_lines)
+        session_labels = [prometheus_labels({'cluster': cluster, 'infobase': infobase, 'infobase_name': name,
+                                             'app_id': app_id})
+                          for cluster, infobase, name, app_id in self.sessions]
+        for index, (name, metric_type, help_text) in enumerate(self.SESSION_METRICS):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            lines.extend(f'{name}{labels} {values[index]}' for labels, values in zip(session_labels,
+                                                                                     self.sessions.values()))
+        lines.extend([
+            '# HELP rac_up Whether the last poll of the RAS server succeeded', '# TYPE rac_up gauge',
+            f'rac_up {int(self.up)}',
+            '# HELP rac_poll_duration_seconds Duration of the last successful poll',
+            '# TYPE rac_poll_duration_seconds gauge', f'rac_poll_duration_seconds {self.poll_duration}',
+            '# HELP rac_last_success_timestamp_seconds Time of the last successful poll',
+            '# TYPE rac_last_success_timestamp_seconds gauge',
+            f'rac_last_success_timestamp_seconds {self.last_success}',
+            '# HELP rac_poll_errors_total Number of failed polls', '# TYPE rac_poll_errors_total counter',
+            f'rac_poll_errors_total {self.poll_errors}',
+        ])
+        return ('\n'.join(lines) + '\n').encode()
+
+    async def poll(self):
+        started = time.monotonic()
+        try:
+            self.cluster_lines, self.sessions = await self.collect()
+            self.up = True
+            self.poll_duration = time.monotonic() - started
+            self.last_success = time.time()
+        except (Exception, MessageException) as e:
+            # The last known values are kept, rac_up reports that they are stale
+            print("Can't poll RAS server -", e, file=sys.stderr)
+            self.up = False
+            self.poll_errors += 1
+        self.text = self.render()
+
+    async def run_poller(self):
+        while True:
+            started = time.monotonic()
+            await self.poll()
+            await asyncio.sleep(max(0, self.interval - (time.monotonic() - started)))
+
+    async def handle_scrape(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+            parts = request_line.split()
+            if len(parts) >= 2 and parts[1].split(b'?')[0] == b'/metrics':
+                status, content_type, body = b'200 OK', b'text/plain; version=0.0.4; charset=utf-8', self.text
+            else:
+                status, content_type, body = b'404 Not Found', b'text/plain; charset=utf-8', b'Not found\n'
+            writer.write(b'HTTP/1.0 ' + status + b'\r\nContent-Type: ' + content_type +
+                         b'\r\nContent-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_scrape, host, port)
+        async with server:
+            await asyncio.gather(self.run_poller(), server.serve_forever())
+
+
+def json_default(value):
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.hex()
+    if isinstance(value, collections.abc.Mapping):
+        return dict(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def print_record(record):
+    print(json.dumps(record, ensure_ascii=False, default=json_default))
+
+
+def print_records(ras_args, records):
+    if ras_args.format == 'ndjson':
+        for record in records:
+            print_record(record)
+    else:
+        pp(list(records))
+
+
+async def print_record_stream(ras_args, records):
+    if ras_args.format == 'ndjson':
+        async for record in records:
+            print_record(record)
+    else:
+        pp([record async for record in records])
+
+
+def print_stats(tracer):
+    print(f"{'message_type':36} {'count':>7} {'errors':>6} {'sent':>10} {'received':>12} "
+          f"{'wait ms mean/p99/max':>22} {'decode ms mean/p99/max':>24}", file=sys.stderr)
+    for stats in tracer.summary():
+        wait = '/'.join(f'{stats["wait"][name] * 1000:.1f}' for name in ('mean', 'p99', 'max'))
+        decode = '/'.join(f'{stats["decode"][name] * 1000:.1f}' for name in ('mean', 'p99', 'max'))
+        print(f"{stats['message_type']:36} {stats['count']:7} {stats['errors']:6} {stats['bytes_sent']:10} "
+              f"{stats['bytes_received']:12} {wait:>22} {decode:>24}", file=sys.stderr)
+
+
+def session_filter_from_args(ras_args, materialize=True):
+    equals = {}
+    minimum = {}
+    if ras_args.app_id is not None:
+        equals['app_id'] = ras_args.app_id
+    if ras_args.user is not None:
+        equals['user_name'] = ras_args.user
+    if ras_args.min_memory is not None:
+        minimum['memory_current'] = ras_args.min_memory
+    if ras_args.min_cpu_5min is not None:
+        minimum['cpu_time_last5min'] = ras_args.min_cpu_5min
+    if not equals and not minimum:
+        return None
+    return SessionFilter(equals, minimum, materialize)
+
+
+def infobase_patch(ras_args):
+    # Infobase fields set by the options of `infobase update`. An empty --denied-from/--denied-to
+    # clears the date, which read_infobase() returns as None.
+    patch = {}
+    for field in ('descr', 'denied_message', 'denied_parameter', 'permission_code'):
+        if getattr(ras_args, field) is not None:
+            patch[field] = getattr(ras_args, field)
+    for field in ('denied_from', 'denied_to'):
+        if getattr(ras_args, field) is not None:
+            patch[field] = getattr(ras_args, field) or None
+    if ras_args.sessions_deny in ['on', 'off']:
+        patch['sessions_denied'] = ras_args.sessions_deny == 'on'
+    if ras_args.scheduled_jobs_deny in ['on', 'off']:
+        patch['scheduled_jobs_denied'] = ras_args.scheduled_jobs_deny == 'on'
+    return patch
+
+
+async def update_infobases_command(client, ras_args):
+    # All infobases are read first and the previous values of the fields that are going to change
+    # are written to the rollback file; only then the changed records are written back. Reads and
+    # writes are pipelined over the endpoint. Prints one result per infobase. An existing rollback file
+    # is never overwritten: a second run would find nothing to change and replace the saved values.
+    if ras_args.rollback_file and os.path.exists(ras_args.rollback_file):
+        raise FileExistsError(f'Rollback file {ras_args.rollback_file!r} already exists')
+    if ras_args.restore:
+        with open(ras_args.restore) as restore_file:
+            entries = [restore_record('infobase', entry) for entry in json.load(restore_file)]
+        patches = {entry['infobase']: {field: value for field, value in entry.items()
+                                       if field not in ('infobase', 'name')}
+                   for entry in entries}
+    else:
+        if ras_args.all_infobases:
+            infobases = [infobase['infobase'] for infobase in
+                         await client.get_infobases_short(ras_args.cluster, fresh=True)]
+        else:
+            infobases = [uuid.UUID(str(infobase)) for infobase in ras_args.infobase]
+        patch = infobase_patch(ras_args)
+        patches = {infobase: patch for infobase in infobases}
+
+    results = {}
+    rollback = []
+    updates = []
+    async for infobase, record, error in client.get_infobases_info(ras_args.cluster, patches,
+                                                                    ras_args.pipeline_window):
+        if error is not None:
+            results[infobase] = {'infobase': infobase, 'name': None, 'result': 'failed', 'error': str(error)}
+            continue
+        changes = {field: value for field, value in patches[infobase].items() if record[field] != value}
+        results[infobase] = {'infobase': infobase, 'name': record['name'],
+                             'result': 'updated' if changes else 'unchanged', 'changes': sorted(changes)}
+        if changes:
+            rollback.append(dict({'infobase': infobase, 'name': record['name']},
+                                 **{field: record[field] for field in changes}))
+            updates.append(dict(record, **changes))
+
+    if ras_args.rollback_file:
+        # The permission code may be among the previous values, so the file is readable by the owner only
+        with open(os.open(ras_args.rollback_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600),
+                  'w') as rollback_file:
+            json.dump(rollback, rollback_file, ensure_ascii=False, indent=2, default=json_default)
+
+    async for record, error in client.update_infobases(ras_args.cluster, updates, ras_args.pipeline_window):
+        if error is not None:
+            results[record['infobase']].update(result='failed', error=str(error))
+    print_records(ras_args, list(results.values()))
 
 
+async def ras_command(ras_args):
+    cache_ttl = None if ras_args.cache_ttl is None else {'clusters': ras_args.cache_ttl, 'infobases': ras_args.cache_ttl}
+    async with RasClient(ras_args.ras_host, ras_args.ras_port, ras_args.connect_timeout, tracer=ras_args.tracer,
+                         metadata_cache=MetadataCache(ras_args.cache_file, cache_ttl)) as client:
+        ids = await resolve_ras_args(client, ras_args)
+        try:
+            await run_ras_command(client, ras_args)
+        except MessageException:
+            # An id taken from the metadata cache may belong to a cluster or infobase removed since. The
+            # names are resolved again from fresh lists: a name that is gone fails with LookupError, and
+            # when an id has changed the command is run once more.
+            if await resolve_ras_args(client, ras_args, fresh=True) == ids:
+                raise
+            await run_ras_command(client, ras_args)
+
+
+async def resolve_ras_args(client, ras_args, fresh=False):
+    # Turns --cluster-name and --infobase-name into ids and authenticates on the cluster, which
+    # reading the infobase list requires. Returns the ids.
+    if getattr(ras_args, 'cluster_name', None) is not None:
+        ras_args.cluster = await client.resolve_cluster(ras_args.cluster_name, fresh)
+
     if hasattr(ras_args, 'cluster_user') and hasattr(ras_args,
                                                      'cluster_pwd') and ras_args.cluster_user is not None and ras_args.cluster_pwd is not None:
-        packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.AUTHENTICATE_REQUEST)
-        packet.append_raw(uuid.UUID(ras_args.cluster).bytes)
-        packet.append(ras_args.cluster_user.encode())
-        packet.append(ras_args.cluster_pwd.encode())
-        send_packet(writer, packet)
-        packet_type, packet_array = await read_packet(reader)
-        assert packet_type == PacketType.ENDPOINT_MESSAGE
+        await client.authenticate_cluster(ras_args.cluster, ras_args.cluster_user, ras_args.cluster_pwd)
+
+    if getattr(ras_args, 'infobase_name', None) is not None:
+        if isinstance(ras_args.infobase_name, list):
+            ras_args.infobase = [await client.resolve_infobase(ras_args.cluster, name, fresh)
+                                 for name in ras_args.infobase_name]
+        else:
+            ras_args.infobase = await client.resolve_infobase(ras_args.cluster, ras_args.infobase_name, fresh)
+    return getattr(ras_args, 'cluster', None), getattr(ras_args, 'infobase', None)
+
+
+async def run_ras_command(client, ras_args):
+    if ras_args.command == 'cluster':
+        if ras_args.subcommand1 == 'list':
+            print_records(ras_args, await client.get_clusters(fresh=True))
+        elif ras_args.subcommand1 == 'info':
+            print_records(ras_args, [await client.get_cluster_info(ras_args.cluster)])
+        elif ras_args.subcommand1 == 'update':
+            cluster = await client.get_cluster_info(ras_args.cluster)
+            if ras_args.lifetime_limit is not None:
+                cluster['lifetime-limit'] = ras_args.lifetime_limit
+            if ras_args.expiration_timeout is not None:
+                cluster['expiration-timeout'] = ras_args.expiration_timeout
+            if ras_args.name is not None:
+                cluster['name'] = ras_args.name
+            if ras_args.agent_user is not None and ras_args.agent_pwd is not None:
+                await client.authenticate_agent(ras_args.agent_user, ras_args.agent_pwd)
+            await client.update_cluster(cluster)
 
     if ras_args.command == 'infobase':
-        cluster_id = uuid.UUID(ras_args.cluster).bytes
         if ras_args.subcommand1 == 'summary' and ras_args.subcommand2 == 'list':
-            packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.GET_INFOBASES_SHORT_REQUEST)
-            packet.append_raw(cluster_id)
-            send_packet(writer, packet)
-            packet_type, packet_array = await read_packet(reader)
-            assert packet_type == PacketType.ENDPOINT_MESSAGE
-            pp(packet_array)
+            await print_record_stream(ras_args, client.iter_infobases(ras_args.cluster))
 
         if hasattr(ras_args, 'infobase_user') and hasattr(ras_args, 'infobase_pwd') and ras_args.infobase_user is not None and ras_args.infobase_pwd is not None:
-            packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.ADD_AUTHENTICATION_REQUEST)
-            packet.append_raw(cluster_id)
-            packet.append(ras_args.infobase_user.encode())
-            packet.append(ras_args.infobase_pwd.encode())
-            send_packet(writer, packet)
-            packet_type, packet_array = await read_packet(reader)
-            assert packet_type == PacketType.ENDPOINT_MESSAGE
+            await client.authenticate_infobase(ras_args.cluster, ras_args.infobase_user, ras_args.infobase_pwd)
 
-        if ras_args.subcommand1 == 'info' or ras_args.subcommand1 == 'update':
-            packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.GET_INFOBASE_INFO_REQUEST)
-            packet.append_raw(cluster_id)
-            packet.append_raw(uuid.UUID(ras_args.infobase).bytes)
-            send_packet(writer, packet)
-            packet_type, packet_array = await read_packet(reader)
-            assert packet_type == PacketType.ENDPOINT_MESSAGE
-            if ras_args.subcommand1 == 'update':
-                packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.UPDATE_INFOBASE_REQUEST)
-                packet.append_raw(cluster_id)
-                infobase = packet_array[0]
-                if ras_args.descr is not None:
-                    infobase['descr'] = ras_args.descr
-                if ras_args.denied_message is not None:
-                    infobase['denied_message'] = ras_args.denied_message
-                if ras_args.permission_code is not None:
-                    infobase['permission_code'] = ras_args.permission_code
-                if ras_args.sessions_deny in ['on', 'off']:
-                    infobase['sessions_denied'] = ras_args.sessions_deny == 'on'
-                if ras_args.scheduled_jobs_deny in ['on', 'off']:
-                    infobase['scheduled_jobs_denied'] = ras_args.scheduled_jobs_deny == 'on'
-                if ras_args.denied_from is not None:
-                    infobase['denied_from'] = ras_args.denied_from
-                if ras_args.denied_to is not None:
-                    infobase['denied_to'] = ras_args.denied_to
-                write_infobase(infobase, packet)
-                send_packet(writer, packet)
-                packet_type, packet_array = await read_packet(reader)
-                assert packet_type == PacketType.ENDPOINT_MESSAGE
-            else:
-                pp(packet_array)
+        if ras_args.subcommand1 == 'info':
+            print_records(ras_args, [await client.get_infobase_info(ras_args.cluster, ras_args.infobase)])
+        elif ras_args.subcommand1 == 'update':
+            await update_infobases_command(client, ras_args)
 
     if ras_args.command == 'session':
-        cluster_id = uuid.UUID(ras_args.cluster).bytes
         session_ids = []
         session_info = {}
-        if ras_args.subcommand1 == 'list' or (ras_args.subcommand1 == 'terminate' and not ras_args.session):
-            if hasattr(ras_args, 'infobase') and ras_args.infobase:
-                packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.GET_INFOBASE_SESSIONS_REQUEST)
-                packet.append_raw(cluster_id)
-                packet.append_raw(uuid.UUID(ras_args.infobase).bytes)
-                send_packet(writer, packet)
-                packet_type, packet_array = await read_packet(reader)
-                assert packet_type == PacketType.ENDPOINT_MESSAGE
-                if ras_args.subcommand1 == 'list':
-                    pp(packet_array)
-                else:
-                    session_ids.extend(
-                        [session['session_id'].bytes for session in packet_array if session['app_id'] != 'RAS'])
-                    session_info.update({session['session_id'].bytes: session for session in packet_array})
+        if ras_args.subcommand1 == 'list':
+            session_filter = session_filter_from_args(ras_args)
+            await print_record_stream(ras_args, client.iter_sessions(ras_args.cluster, ras_args.infobase,
+                                                                     session_filter=session_filter))
+        elif ras_args.subcommand1 == 'export':
+            columns = await client.get_session_columns(ras_args.cluster, ras_args.infobase)
+            if ras_args.output.endswith('.npy'):
+                import numpy
+                numpy.save(ras_args.output, columns.to_numpy(), allow_pickle=True)
             else:
-                packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.GET_SESSIONS_REQUEST)
-                packet.append_raw(cluster_id)
-                send_packet(writer, packet)
-                packet_type, packet_array = await read_packet(reader)
-                assert packet_type == PacketType.ENDPOINT_MESSAGE
-                if ras_args.subcommand1 == 'list':
-                    pp(packet_array)
-                else:
-                    session_ids.extend(
-                        [session['session_id'].bytes for session in packet_array if session['app_id'] != 'RAS'])
-                    session_info.update({session['session_id'].bytes: session for session in packet_array})
+                import pyarrow.parquet
+                pyarrow.parquet.write_table(columns.to_arrow(), ras_args.output)
+            print("Exported", len(columns), "sessions to", ras_args.output)
+        elif ras_args.subcommand1 == 'watch':
+            # The first poll is the baseline; afterwards only the differences are printed
+            snapshot = SessionSnapshot()
+            session_filter = session_filter_from_args(ras_args, materialize=False)
+            snapshot.update(await client.get_sessions(ras_args.cluster, ras_args.infobase,
+                                                      session_filter=session_filter))
+            for poll in range(ras_args.count or sys.maxsize):
+                await asyncio.sleep(ras_args.interval)
+                print_records(ras_args, snapshot.update(await client.get_sessions(
+                    ras_args.cluster, ras_args.infobase, session_filter=session_filter)))
+                sys.stdout.flush()
+        elif ras_args.subcommand1 == 'terminate' and not ras_args.session:
+            sessions = await client.get_sessions(ras_args.cluster, ras_args.infobase)
+            session_ids.extend([session['session_id'] for session in sessions if session['app_id'] != 'RAS'])
+            session_info.update({session['session_id']: session for session in sessions})
         if ras_args.subcommand1 == 'terminate':
             if ras_args.session:
-                session_id = uuid.UUID(ras_args.session).bytes
-                session_ids.append(session_id)
-            for session_id in session_ids:
-                packet = Packet(PacketType.ENDPOINT_MESSAGE, MessageType.TERMINATE_SESSION_REQUEST)
-                packet.append_raw(cluster_id)
-                packet.append_raw(session_id)
-                if hasattr(ras_args, 'error_message') and ras_args.error_message:
-                    packet.append(ras_args.error_message.encode())
+                session_ids.append(uuid.UUID(ras_args.session))
+            if hasattr(ras_args, 'error_message') and ras_args.error_message:
+                message = ras_args.error_message
+            else:
+                message = 'Session terminated by admin'
+            async for session_id, error in client.terminate_sessions(ras_args.cluster, session_ids, message,
+                                                                    ras_args.pipeline_window):
+                if error is not None:
+                    print("Can't terminate session", session_id, "-", error)
+                elif session_id in session_info.keys():
+                    print("Terminated session", session_id, session_info[session_id]['app_id'])
                 else:
-                    packet.append(b'Session terminated by admin')
-                send_packet(writer, packet)
-                try:
-                    packet_type, packet_array = await read_packet(reader)
-                    assert packet_type == PacketType.ENDPOINT_MESSAGE
-                    if session_id in session_info.keys():
-                        print("Terminated session", uuid.UUID(bytes=session_id), session_info[session_id]['app_id'])
-                    else:
-                        print("Terminated session", uuid.UUID(bytes=session_id))
-                except MessageException as e:
-                    print("Can't terminate session", uuid.UUID(bytes=session_id), "-", e)
-
-    packet = Packet(PacketType.ENDPOINT_CLOSE)
-    packet.append(pack_varint_base64(endpoint_id))
-    send_packet(writer, packet)
-    packet = Packet(PacketType.DISCONNECT)
-    send_packet(writer, packet)
+                    print("Terminated session", session_id)
+
+    if ras_args.command == 'lock':
+        graph = await client.get_lock_graph(ras_args.cluster, ras_args.infobase)
+        if ras_args.subcommand1 == 'list':
+            print_records(ras_args, graph.lock_list())
+        elif ras_args.subcommand1 == 'graph':
+            print_records(ras_args, graph.trees())
+
+    if ras_args.command == 'counter':
+        if ras_args.subcommand1 == 'list':
+            print_records(ras_args, await client.get_resource_counters(ras_args.cluster))
+        elif ras_args.subcommand1 == 'values':
+            print_records(ras_args, await client.get_counter_values(ras_args.cluster, ras_args.counter,
+                                                                    ras_args.object, ras_args.accumulated))
+        elif ras_args.subcommand1 == 'sample':
+            # The summary is printed every report interval and once more when sampling ends
+            sampler = CounterSampler(client, ras_args.cluster, ras_args.counter, ras_args.interval,
+                                     ras_args.capacity)
+            sampling = asyncio.create_task(sampler.run(ras_args.duration))
+            try:
+                while not sampling.done():
+                    await asyncio.wait([sampling], timeout=ras_args.report_interval)
+                    print_records(ras_args, sampler.summary(ras_args.window))
+                    sys.stdout.flush()
+                sampling.result()
+            finally:
+                sampling.cancel()
+
+
+async def exporter_command(ras_args):
+    client = RasClient(ras_args.ras_host, ras_args.ras_port, ras_args.connect_timeout,
+                       keep_alive_interval=ras_args.keep_alive, request_timeout=ras_args.request_timeout,
+                       reconnect_attempts=ras_args.reconnect_attempts)
+    exporter = MetricsExporter(client, ras_args.cluster, ras_args.cluster_user, ras_args.cluster_pwd,
+                               ras_args.interval)
+    await exporter.serve(ras_args.listen_host, ras_args.listen_port)
+
+
+async def fleet_command(ras_args):
+    addresses = [parse_ras_address(address, ras_args.ras_port) for address in ras_args.ras or []]
+    if ras_args.ras_file:
+        addresses.extend(read_ras_addresses(ras_args.ras_file, ras_args.ras_port))
+    if not addresses:
+        addresses.append((ras_args.ras_host, ras_args.ras_port))
+
+    if ras_args.subcommand1 == 'cluster':
+        query = fleet_clusters()
+    elif ras_args.subcommand1 == 'session':
+        query = fleet_sessions(ras_args.cluster_user, ras_args.cluster_pwd)
+    else:
+        query = fleet_infobases(ras_args.cluster_user, ras_args.cluster_pwd)
+
+    merged = []
+    async for (host, port), records, error in fleet_map(addresses, query, ras_args.concurrency, ras_args.timeout,
+                                                        ras_args.connect_timeout, ras_args.tracer):
+        if error is not None:
+            print(f"Can't query {host}:{port} -", str(error) or type(error).__name__, file=sys.stderr)
+        elif ras_args.format == 'ndjson':
+            print_records(ras_args, records)
+        else:
+            merged.extend(records)
+    if ras_args.format != 'ndjson':
+        print_records(ras_args, merged)
 
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
+    # Without abbreviations, so the --ras of fleet is not taken for a prefix of --ras-host or --ras-port
+    parser = argparse.ArgumentParser(allow_abbrev=False)
     parser.add_argument('--ras-host', default='localhost',
                         help='адрес сервера администрирования (по-умолчанию: localhost)')
     parser.add_argument('--ras-port', default=1545, type=int,
                         help='порт сервера администрирования (по-умолчанию: 1545)')
+    parser.add_argument('--connect-timeout', default=2000, type=int,
+                        help='значение параметра connect.timeout соединения, в миллисекундах (по-умолчанию: 2000)')
+    parser.add_argument('--format', default='pprint', choices=['pprint', 'ndjson'],
+                        help="""формат вывода (по-умолчанию: pprint):
+                pprint - список записей в формате pprint
+                ndjson - по одной записи JSON в строке, записи выводятся по мере получения""")
+
+    parser.add_argument('--stats', action='store_true',
+                        help='вывести в stderr статистику запросов: количество, ошибки, объем переданных данных, '
+                             'время ожидания ответа и время разбора по типам сообщений')
+
+    parser.add_argument('--cache-file',
+                        help='файл кэша списков кластеров и информационных баз для поиска по имени '
+                             '(по-умолчанию: кэш хранится только в памяти)')
+    parser.add_argument('--cache-ttl', type=float,
+                        help='время жизни списков кластеров и информационных баз в кэше, в секундах '
+                             '(по-умолчанию: 300)')
 
     sub_parsers = parser.add_subparsers(help='Группы команд', dest='command', required=True)
 
@@ -772,11 +2971,17 @@ if __name__ == '__main__':
                                                         required=True, dest='subcommand1')
     parser_cluster_list = cluster_sub_parsers.add_parser('list', help='получение списка информации о кластерах')
     parser_cluster_info = cluster_sub_parsers.add_parser('info', help='получение информации о кластере')
-    parser_cluster_info.add_argument('--cluster',
-                                     help='идентификатор кластера серверов', required=True)
+    parser_cluster_info_cluster = parser_cluster_info.add_mutually_exclusive_group(required=True)
+    parser_cluster_info_cluster.add_argument('--cluster',
+                                             help='идентификатор кластера серверов')
+    parser_cluster_info_cluster.add_argument('--cluster-name',
+                                             help='имя кластера серверов вместо идентификатора')
     parser_cluster_update = cluster_sub_parsers.add_parser('update', help='обновление параметров кластера')
-    parser_cluster_update.add_argument('--cluster',
-                                     help='идентификатор кластера серверов', required=True)
+    parser_cluster_update_cluster = parser_cluster_update.add_mutually_exclusive_group(required=True)
+    parser_cluster_update_cluster.add_argument('--cluster',
+                                               help='идентификатор кластера серверов')
+    parser_cluster_update_cluster.add_argument('--cluster-name',
+                                               help='имя кластера серверов вместо идентификатора')
     parser_cluster_update.add_argument('--agent-user',
                                  help='имя администратора агента кластера', required=False)
     parser_cluster_update.add_argument('--agent-pwd',
@@ -790,8 +2995,11 @@ if __name__ == '__main__':
                                        required=False)
 
     parser_infobase = sub_parsers.add_parser('infobase', help='Режим администрирования информационных баз')
-    parser_infobase.add_argument('--cluster',
-                                 help='идентификатор кластера серверов', required=True)
+    parser_infobase_cluster = parser_infobase.add_mutually_exclusive_group(required=True)
+    parser_infobase_cluster.add_argument('--cluster',
+                                         help='идентификатор кластера серверов')
+    parser_infobase_cluster.add_argument('--cluster-name',
+                                         help='имя кластера серверов вместо идентификатора')
     parser_infobase.add_argument('--cluster-user',
                                  help='имя администратора кластера', required=False)
     parser_infobase.add_argument('--cluster-pwd',
@@ -805,16 +3013,35 @@ if __name__ == '__main__':
     parser_infobase_summary_list = infobase_summary_sub_parsers.add_parser('list',
                                                                            help='получение списка краткой информации об информационных базах')
     parser_infobase_info = infobase_sub_parsers.add_parser('info', help='получение информации об информационной базе')
-    parser_infobase_info.add_argument('--infobase',
-                                      help='идентификатор информационной базы', required=True)
+    parser_infobase_info_infobase = parser_infobase_info.add_mutually_exclusive_group(required=True)
+    parser_infobase_info_infobase.add_argument('--infobase',
+                                               help='идентификатор информационной базы')
+    parser_infobase_info_infobase.add_argument('--infobase-name',
+                                               help='имя информационной базы вместо идентификатора')
     parser_infobase_info.add_argument('--infobase-user',
                                       help='имя администратора информационной базы', required=False)
     parser_infobase_info.add_argument('--infobase-pwd',
                                       help='пароль администратора информационной базы', required=False)
     parser_infobase_update = infobase_sub_parsers.add_parser('update',
-                                                             help='обновление информации об информационной базе')
-    parser_infobase_update.add_argument('--infobase',
-                                        help='идентификатор информационной базы', required=True)
+                                                             help='обновление информации об информационных базах')
+    parser_infobase_update_infobase = parser_infobase_update.add_mutually_exclusive_group(required=True)
+    parser_infobase_update_infobase.add_argument('--infobase', action='append',
+                                                 help='идентификатор информационной базы, может быть указан '
+                                                      'несколько раз')
+    parser_infobase_update_infobase.add_argument('--infobase-name', action='append',
+                                                 help='имя информационной базы вместо идентификатора, может быть '
+                                                      'указано несколько раз')
+    parser_infobase_update_infobase.add_argument('--all-infobases', action='store_true',
+                                                 help='обновить все информационные базы кластера')
+    parser_infobase_update_infobase.add_argument('--restore',
+                                                 help='вернуть значения, сохраненные в файле --rollback-file '
+                                                      'предыдущего запуска')
+    parser_infobase_update.add_argument('--rollback-file',
+                                        help='новый файл JSON, в который до изменения сохраняются прежние значения '
+                                             'изменяемых параметров каждой информационной базы; существующий файл '
+                                             'не перезаписывается')
+    parser_infobase_update.add_argument('--pipeline-window', default=64, type=int,
+                                        help='количество запросов, отправляемых без ожидания ответа (по-умолчанию: 64)')
     parser_infobase_update.add_argument('--infobase-user',
                                         help='имя администратора информационной базы', required=False)
     parser_infobase_update.add_argument('--infobase-pwd',
@@ -850,8 +3077,11 @@ if __name__ == '__main__':
                                         required=False)
 
     parser_session = sub_parsers.add_parser('session', help='Режим администрирования сеансов информационных баз')
-    parser_session.add_argument('--cluster',
-                                help='идентификатор кластера серверов', required=True)
+    parser_session_cluster = parser_session.add_mutually_exclusive_group(required=True)
+    parser_session_cluster.add_argument('--cluster',
+                                        help='идентификатор кластера серверов')
+    parser_session_cluster.add_argument('--cluster-name',
+                                        help='имя кластера серверов вместо идентификатора')
     parser_session.add_argument('--cluster-user',
                                 help='имя администратора кластера', required=False)
     parser_session.add_argument('--cluster-pwd',
@@ -860,18 +3090,184 @@ if __name__ == '__main__':
                                                         required=True, dest='subcommand1')
     parser_session_list = session_sub_parsers.add_parser('list',
                                                          help='получение списка информации о сеансах')
-    parser_session_list.add_argument('--infobase',
-                                     help='идентификатор информационной базы')
+    parser_session_list_infobase = parser_session_list.add_mutually_exclusive_group()
+    parser_session_list_infobase.add_argument('--infobase',
+                                              help='идентификатор информационной базы')
+    parser_session_list_infobase.add_argument('--infobase-name',
+                                              help='имя информационной базы вместо идентификатора')
     parser_session_list.add_argument('--licenses', action='store_true',
                                      help='вывод информации о лицензиях, полученных сеансом')
+    parser_session_filters = [parser_session_list]
+    parser_session_export = session_sub_parsers.add_parser('export',
+                                                           help='выгрузка сеансов в файл Parquet (требуется pyarrow) '
+                                                                'или структурированный массив NumPy .npy')
+    parser_session_export_infobase = parser_session_export.add_mutually_exclusive_group()
+    parser_session_export_infobase.add_argument('--infobase',
+                                                help='идентификатор информационной базы')
+    parser_session_export_infobase.add_argument('--infobase-name',
+                                                help='имя информационной базы вместо идентификатора')
+    parser_session_export.add_argument('--output', required=True,
+                                       help='имя файла; .npy - массив NumPy, иначе Parquet')
+    parser_session_watch = session_sub_parsers.add_parser('watch',
+                                                          help='периодический опрос сеансов с выводом появившихся, '
+                                                               'завершившихся и изменившихся сеансов')
+    parser_session_watch_infobase = parser_session_watch.add_mutually_exclusive_group()
+    parser_session_watch_infobase.add_argument('--infobase',
+                                               help='идентификатор информационной базы')
+    parser_session_watch_infobase.add_argument('--infobase-name',
+                                               help='имя информационной базы вместо идентификатора')
+    parser_session_watch.add_argument('--interval', default=10, type=float,
+                                      help='интервал опроса в секундах (по-умолчанию: 10)')
+    parser_session_watch.add_argument('--count', default=0, type=int,
+                                      help='количество опросов после первого, 0 - без ограничения (по-умолчанию: 0)')
+    parser_session_filters.append(parser_session_watch)
+    for parser_session_filter in parser_session_filters:
+        # Checked against the raw records, so sessions that do not match are never decoded
+        parser_session_filter.add_argument('--app-id',
+                                           help='только сеансы приложения с указанным идентификатором, '
+                                                'например BackgroundJob')
+        parser_session_filter.add_argument('--user',
+                                           help='только сеансы пользователя с указанным именем')
+        parser_session_filter.add_argument('--min-memory', type=int,
+                                           help='только сеансы, занимающие не меньше указанного объема памяти '
+                                                '(memory_current), в байтах')
+        parser_session_filter.add_argument('--min-cpu-5min', type=int,
+                                           help='только сеансы, потратившие за последние 5 минут не меньше '
+                                                'указанного процессорного времени (cpu_time_last5min), в миллисекундах')
     parser_session_terminate = session_sub_parsers.add_parser('terminate',
                                                               help='принудительное завершение сеанса')
     parser_session_terminate.add_argument('--session',
                                           help='идентификатор сеанса информационной базы')
-    parser_session_terminate.add_argument('--infobase',
-                                          help='идентификатор информационной базы')
+    parser_session_terminate_infobase = parser_session_terminate.add_mutually_exclusive_group()
+    parser_session_terminate_infobase.add_argument('--infobase',
+                                                   help='идентификатор информационной базы')
+    parser_session_terminate_infobase.add_argument('--infobase-name',
+                                                   help='имя информационной базы вместо идентификатора')
     parser_session_terminate.add_argument('--error-message',
                                           help='сообщение о причине завершения сеанса')
+    parser_session_terminate.add_argument('--pipeline-window', default=1, type=int,
+                                          help='количество запросов на завершение сеансов, отправляемых '
+                                               'без ожидания ответа (по-умолчанию: 1)')
+
+    parser_lock = sub_parsers.add_parser('lock', help='Режим анализа блокировок')
+    parser_lock_cluster = parser_lock.add_mutually_exclusive_group(required=True)
+    parser_lock_cluster.add_argument('--cluster',
+                                     help='идентификатор кластера серверов')
+    parser_lock_cluster.add_argument('--cluster-name',
+                                     help='имя кластера серверов вместо идентификатора')
+    parser_lock.add_argument('--cluster-user',
+                             help='имя администратора кластера', required=False)
+    parser_lock.add_argument('--cluster-pwd',
+                             help='пароль администратора кластера', required=False)
+    lock_sub_parsers = parser_lock.add_subparsers(help='Команды анализа блокировок', required=True,
+                                                  dest='subcommand1')
+    parser_lock_list = lock_sub_parsers.add_parser('list',
+                                                   help='получение списка блокировок с номером, пользователем и '
+                                                        'приложением удерживающего их сеанса')
+    parser_lock_list_infobase = parser_lock_list.add_mutually_exclusive_group()
+    parser_lock_list_infobase.add_argument('--infobase',
+                                           help='идентификатор информационной базы')
+    parser_lock_list_infobase.add_argument('--infobase-name',
+                                           help='имя информационной базы вместо идентификатора')
+    parser_lock_graph = lock_sub_parsers.add_parser('graph',
+                                                    help='дерево ожидания: сеансы, которые удерживают блокировки, '
+                                                         'и ожидающие их сеансы')
+    parser_lock_graph_infobase = parser_lock_graph.add_mutually_exclusive_group()
+    parser_lock_graph_infobase.add_argument('--infobase',
+                                            help='идентификатор информационной базы')
+    parser_lock_graph_infobase.add_argument('--infobase-name',
+                                            help='имя информационной базы вместо идентификатора')
+
+    parser_counter = sub_parsers.add_parser('counter', help='Счетчики потребления ресурсов')
+    parser_counter_cluster = parser_counter.add_mutually_exclusive_group(required=True)
+    parser_counter_cluster.add_argument('--cluster',
+                                        help='идентификатор кластера серверов')
+    parser_counter_cluster.add_argument('--cluster-name',
+                                        help='имя кластера серверов вместо идентификатора')
+    parser_counter.add_argument('--cluster-user',
+                                help='имя администратора кластера', required=False)
+    parser_counter.add_argument('--cluster-pwd',
+                                help='пароль администратора кластера', required=False)
+    counter_sub_parsers = parser_counter.add_subparsers(help='Команды счетчиков', required=True, dest='subcommand1')
+    counter_sub_parsers.add_parser('list', help='получение списка счетчиков потребления ресурсов')
+    parser_counter_values = counter_sub_parsers.add_parser('values', help='получение значений счетчика')
+    parser_counter_values.add_argument('--counter', required=True,
+                                       help='имя счетчика')
+    parser_counter_values.add_argument('--object', default='',
+                                       help='объект, значения которого нужно получить (по-умолчанию: все объекты)')
+    parser_counter_values.add_argument('--accumulated', action='store_true',
+                                       help='получить накопленные значения, сбросив их на сервере')
+    parser_counter_sample = counter_sub_parsers.add_parser('sample',
+                                                           help='периодический опрос значений счетчиков с выводом '
+                                                                'минимума, максимума и перцентилей по объектам')
+    parser_counter_sample.add_argument('--counter', action='append',
+                                       help='имя счетчика, может быть указан несколько раз (по-умолчанию: все '
+                                            'счетчики кластера)')
+    parser_counter_sample.add_argument('--interval', default=5, type=float,
+                                       help='период опроса значений, в секундах (по-умолчанию: 5)')
+    parser_counter_sample.add_argument('--capacity', default=720, type=int,
+                                       help='количество хранимых значений каждого объекта, старые значения '
+                                            'вытесняются новыми (по-умолчанию: 720)')
+    parser_counter_sample.add_argument('--report-interval', default=60, type=float,
+                                       help='период вывода статистики, в секундах (по-умолчанию: 60)')
+    parser_counter_sample.add_argument('--window', type=float,
+                                       help='интервал, за который считается статистика, в секундах '
+                                            '(по-умолчанию: все хранимые значения)')
+    parser_counter_sample.add_argument('--duration', type=float,
+                                       help='продолжительность опроса, в секундах (по-умолчанию: до прерывания)')
+
+    parser_fleet = sub_parsers.add_parser('fleet', help='Одновременный опрос нескольких серверов администрирования')
+    parser_fleet.add_argument('--ras', action='append',
+                              help='адрес сервера администрирования в виде host[:port], может быть указан '
+                                   'несколько раз (по-умолчанию: --ras-host и --ras-port)')
+    parser_fleet.add_argument('--ras-file',
+                              help='файл со списком серверов администрирования, по одному host[:port] в строке')
+    parser_fleet.add_argument('--concurrency', default=16, type=int,
+                              help='количество серверов, опрашиваемых одновременно (по-умолчанию: 16)')
+    parser_fleet.add_argument('--timeout', default=30, type=float,
+                              help='время ожидания ответа одного сервера, в секундах (по-умолчанию: 30)')
+    parser_fleet.add_argument('--cluster-user',
+                              help='имя администратора кластеров', required=False)
+    parser_fleet.add_argument('--cluster-pwd',
+                              help='пароль администратора кластеров', required=False)
+    fleet_sub_parsers = parser_fleet.add_subparsers(help='Объекты для опроса', required=True, dest='subcommand1')
+    for name, help_text in [('cluster', 'кластеры серверов'), ('session', 'сеансы информационных баз'),
+                            ('infobase', 'информационные базы')]:
+        parser_fleet_object = fleet_sub_parsers.add_parser(name, help=help_text)
+        parser_fleet_object_sub_parsers = parser_fleet_object.add_subparsers(help='Команды', required=True,
+                                                                             dest='subcommand2')
+        parser_fleet_object_sub_parsers.add_parser('list', help='получение списка со всех серверов и кластеров')
+
+    parser_exporter = sub_parsers.add_parser('exporter',
+                                             help='Экспорт метрик сеансов и кластеров в формате Prometheus')
+    parser_exporter.add_argument('--cluster', action='append', type=uuid.UUID,
+                                 help='идентификатор кластера серверов, может быть указан несколько раз '
+                                      '(по-умолчанию: все кластеры)')
+    parser_exporter.add_argument('--cluster-user',
+                                 help='имя администратора кластера', required=False)
+    parser_exporter.add_argument('--cluster-pwd',
+                                 help='пароль администратора кластера', required=False)
+    parser_exporter.add_argument('--interval', default=15, type=float,
+                                 help='период опроса сервера администрирования, в секундах (по-умолчанию: 15)')
+    parser_exporter.add_argument('--keep-alive', default=10, type=float,
+                                 help='период отправки keep-alive при простое соединения, в секундах (по-умолчанию: 10)')
+    parser_exporter.add_argument('--request-timeout', default=60, type=float,
+                                 help='время ожидания ответа на запрос в секундах; после трех таких ожиданий '
+                                      'подряд соединение считается потерянным (по-умолчанию: 60)')
+    parser_exporter.add_argument('--reconnect-attempts', default=5, type=int,
+                                 help='количество попыток переподключения при потере соединения (по-умолчанию: 5)')
+    parser_exporter.add_argument('--listen-host', default='127.0.0.1',
+                                 help='адрес, на котором публикуются метрики (по-умолчанию: 127.0.0.1)')
+    parser_exporter.add_argument('--listen-port', default=9545, type=int,
+                                 help='порт, на котором публикуются метрики (по-умолчанию: 9545)')
 
     args = parser.parse_args()
-    asyncio.run(ras_command(args))
+    if getattr(args, 'rollback_file', None) and os.path.exists(args.rollback_file):
+        parser.error(f'rollback file {args.rollback_file!r} already exists')
+    args.tracer = RequestTracer() if args.stats else None
+    commands = {'fleet': fleet_command, 'exporter': exporter_command}
+    try:
+        asyncio.run(commands.get(args.command, ras_command)(args))
+    finally:
+        if args.tracer is not None:
+            print_stats(args.tracer)
@@ -0,0 +1,195 @@
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import random
+import sys
+import time
+
+from rac_client import (COLUMNS, MessageType, Packet, PacketType, RasClient, decode_packet, write_cluster,
+                        write_infobase, write_infobase_short, write_session)
+from ras_fake_server import (FakeRasServer, encode_record, list_frame, make_cluster, make_infobase, make_session,
+                             message_frame)
+
+# Measures codec throughput on synthetic frames built with the record writers and end-to-end
+# latency against an in-process FakeRasServer. Results are written as JSON, and a previous result
+# file can be given with --compare to print the ratio of every measurement.
+
+
+def frame_body(frame):
+    # decode_packet() takes the frame body, without the type byte and length
+    pos = 1
+    while frame[pos] & 0x80:
+        pos += 1
+    return frame[pos + 1:]
+
+
+def best_time(func, repeat):
+    best = None
+    for attempt in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+async def best_async_time(func, repeat):
+    best = None
+    for attempt in range(repeat):
+        start = time.perf_counter()
+        await func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def throughput(name, records, size, elapsed):
+    result = {'name': name, 'records': records, 'seconds': round(elapsed, 6),
+              'records_per_second': round(records / elapsed)}
+    if size:
+        result['mb_per_second'] = round(size / elapsed / 1e6, 2)
+    return result
+
+
+def codec_benchmarks(args):
+    rng = random.Random(args.seed)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    clusters = [make_cluster(rng, number) for number in range(args.records)]
+    infobases = [make_infobase(rng, number) for number in range(args.records)]
+    infobase_ids = [infobase['infobase'] for infobase in infobases[:10]]
+    sessions = [make_session(rng, number, rng.choice(infobase_ids), now) for number in range(args.sessions)]
+
+    frames = {
+        'decode.session': (list_frame(1, MessageType.GET_SESSIONS_RESPONSE,
+                                      [encode_record(write_session, session) for session in sessions]),
+                           len(sessions)),
+        'decode.cluster': (list_frame(1, MessageType.GET_CLUSTERS_RESPONSE,
+                                      [encode_record(write_cluster, cluster) for cluster in clusters]),
+                           len(clusters)),
+        'decode.infobase_short': (list_frame(1, MessageType.GET_INFOBASES_SHORT_RESPONSE,
+                                             [encode_record(write_infobase_short, infobase)
+                                              for infobase in infobases]),
+                                  len(infobases)),
+    }
+    infobase_frames = [frame_body(message_frame(1, MessageType.GET_INFOBASE_INFO_RESPONSE,
+                                                encode_record(write_infobase, infobase)))
+                       for infobase in infobases]
+
+    results = []
+    for name, (frame, count) in frames.items():
+        body = frame_body(frame)
+        modes = [('', True)]
+        if name == 'decode.session':
+            modes += [('.lazy', False), ('.columns', COLUMNS)]
+        for suffix, materialize in modes:
+            elapsed = best_time(lambda: decode_packet(PacketType.ENDPOINT_MESSAGE, body, materialize), args.repeat)
+            results.append(throughput(name + suffix, count, len(body), elapsed))
+
+    def decode_infobases():
+        for body in infobase_frames:
+            decode_packet(PacketType.ENDPOINT_MESSAGE, body)
+    size = sum(len(body) for body in infobase_frames)
+    results.append(throughput('decode.infobase', len(infobase_frames), size, best_time(decode_infobases, args.repeat)))
+
+    for name, write, records, message_type in [
+            ('encode.cluster', write_cluster, clusters, MessageType.REG_CLUSTER_REQUEST),
+            ('encode.infobase', write_infobase, infobases, MessageType.UPDATE_INFOBASE_REQUEST)]:
+        def encode():
+            for record in records:
+                packet = Packet(PacketType.ENDPOINT_MESSAGE, message_type)
+                write(record, packet)
+                packet.get_frame()
+        results.append(throughput(name, len(records), 0, best_time(encode, args.repeat)))
+    return results
+
+
+async def end_to_end_benchmarks(args):
+    fake_server = FakeRasServer(sessions=args.sessions, latency=args.latency / 1000, seed=args.seed)
+    server = await fake_server.start('127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    cluster = next(iter(fake_server.clusters.values()))['cluster']
+    results = []
+
+    async def measure(name, func, count=1):
+        elapsed = await best_async_time(func, args.repeat)
+        results.append({'name': name, 'records': count, 'seconds': round(elapsed, 6),
+                        'records_per_second': round(count / elapsed)})
+
+    async with server:
+        async def connect():
+            async with RasClient('127.0.0.1', port):
+                pass
+        await measure('e2e.connect', connect)
+
+        async with RasClient('127.0.0.1', port) as client:
+            await measure('e2e.cluster_list', client.get_clusters)
+            await measure('e2e.infobase_list', lambda: client.get_infobases_short(cluster))
+            await measure('e2e.session_list', lambda: client.get_sessions(cluster, materialize=True), args.sessions)
+            await measure('e2e.session_list.lazy', lambda: client.get_sessions(cluster), args.sessions)
+
+            # Every terminate run uses sessions that are still alive, so the server does the same work
+            session_ids = [session['session_id'] for session in await client.get_sessions(cluster)]
+            batch = min(args.terminate, len(session_ids) // (2 * args.repeat))
+            for window in (1, args.window):
+                async def terminate():
+                    ids = [session_ids.pop() for number in range(batch)]
+                    async for session, error in client.terminate_sessions(cluster, ids, window=window):
+                        if error is not None:
+                            raise error
+                await measure(f'e2e.terminate.window{window}', terminate, batch)
+        await fake_server.wait_closed()
+    return results
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as baseline_file:
+        baseline = {result['name']: result for result in json.load(baseline_file)['results']}
+    for result in results:
+        old = baseline.get(result['name'])
+        if old is None:
+            continue
+        ratio = old['seconds'] / result['seconds']
+        print(f"{result['name']:32} {old['seconds']:12.6f} {result['seconds']:12.6f} {ratio:7.2f}x", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замеры производительности rac_client')
+    parser.add_argument('--sessions', default=20000, type=int,
+                        help='количество сеансов в синтетических ответах (по-умолчанию: 20000)')
+    parser.add_argument('--records', default=2000, type=int,
+                        help='количество кластеров и информационных баз в синтетических ответах '
+                             '(по-умолчанию: 2000)')
+    parser.add_argument('--repeat', default=5, type=int,
+                        help='количество повторов каждого замера, берется лучший (по-умолчанию: 5)')
+    parser.add_argument('--seed', default=0, type=int, help='начальное значение генератора данных (по-умолчанию: 0)')
+    parser.add_argument('--latency', default=1, type=float,
+                        help='задержка ответа имитации сервера в миллисекундах (по-умолчанию: 1)')
+    parser.add_argument('--terminate', default=200, type=int,
+                        help='количество сеансов, завершаемых в одном замере (по-умолчанию: 200)')
+    parser.add_argument('--window', default=64, type=int,
+                        help='количество запросов на завершение без ожидания ответа (по-умолчанию: 64)')
+    parser.add_argument('--skip-e2e', action='store_true', help='не выполнять замеры с имитацией сервера')
+    parser.add_argument('--output', help='файл для результатов в формате JSON (по-умолчанию: стандартный вывод)')
+    parser.add_argument('--compare', help='файл с предыдущими результатами для сравнения')
+    args = parser.parse_args()
+
+    results = codec_benchmarks(args)
+    if not args.skip_e2e:
+        results += asyncio.run(end_to_end_benchmarks(args))
+    report = {'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+              'python': platform.python_version(), 'platform': platform.platform(),
+              'parameters': {name: value for name, value in vars(args).items() if name not in ('output', 'compare')},
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
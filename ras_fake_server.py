@@ -0,0 +1,477 @@
+import argparse
+import asyncio
+import datetime
+import random
+import time
+import uuid
+
+from rac_client import (PACKET_HEADER_RESERVE, Decoder, EndpointDataType, FrameReader, MessageType, Packet, PacketType,
+                        date_from_int64, date_to_int64, pack_varint_base64, pack_varint_base128, read_infobase,
+                        write_cluster, write_connection_short, write_counter_value, write_infobase,
+                        write_infobase_short, write_lock, write_resource_counter, write_session)
+
+# A stand-in for the RAS agent that speaks the same framing as rac_client, for tests and load
+# experiments without a 1C installation. The population (clusters, infobases, sessions with their
+# connections and locks) is synthetic and generated from a seed; every response can be delayed by
+# a fixed latency.
+
+APP_IDS = ['1CV8C', '1CV8C', '1CV8C', 'WebClient', 'BackgroundJob', 'Designer', 'COMConnector']
+LOCK_OBJECTS = ['Document.Invoice', 'Document.Order', 'AccumulationRegister.Stock', 'InformationRegister.Prices',
+                'Catalog.Items']
+RESOURCE_COUNTERS = [('users', 'Resource consumption by user'), ('infobases', 'Resource consumption by infobase')]
+
+
+def make_cluster(rng, number):
+    return {'cluster': uuid.UUID(int=rng.getrandbits(128)), 'expiration-timeout': 60, 'host': f'srv{number}',
+            'lifetime-limit': 86400, 'port': 1541 + number % 600 * 100, 'max-memory-size': 0,
+            'max-memory-time-limit': 0, 'name': f'Cluster {number}', 'security-level': 0,
+            'session-fault-tolerance-level': 0, 'load-balancing-mode': 'performance',
+            'errors-count-threshold': 0, 'kill-problem-processes': 1, 'kill-by-memory-with-dump': 0}
+
+
+def make_infobase(rng, number):
+    name = f'ib{number}'
+    return {'infobase': uuid.UUID(int=rng.getrandbits(128)), 'date_offset': 0, 'dbms': 'MSSQLServer',
+            'db_name': name, 'db_password': b'', 'db_server_name': 'db', 'db_user': 'sa', 'denied_from': None,
+            'denied_message': '', 'denied_parameter': '', 'denied_to': None, 'descr': f'Infobase {number}',
+            'locale': 'ru_RU', 'name': name, 'permission_code': '', 'scheduled_jobs_denied': False,
+            'security_level': 0, 'sessions_denied': False, 'license_distribution': 1,
+            'external_connection_string': '', 'external_session_manager_required': False,
+            'securirty_profile': '', 'safe_mode_securirty_profile': '', 'reserve_working_processes': False}
+
+
+def make_license(rng, number):
+    return {'full_name': f'C:\\ProgramData\\1C\\licenses\\{number}.lic', 'full_presentation': 'Client license',
+            'issued_by_server': True, 'license_type': 0, 'max_users_all': 100, 'max_users_cur': 100, 'net': False,
+            'rmngr_address': 'srv', 'rmngr_pid': str(rng.randrange(1000, 65536)), 'rmngr_port': 1541,
+            'series': f'{rng.getrandbits(40):012d}', 'short_presentation': 'Client'}
+
+
+def make_session(rng, number, infobase, now, licenses=1):
+    started_at = now - datetime.timedelta(seconds=rng.randrange(86400))
+    calls = rng.randrange(1000000)
+    session = {'session_id': uuid.UUID(int=rng.getrandbits(128)), 'app_id': rng.choice(APP_IDS),
+               'blocked_by_dbms': 0, 'blocked_by_ls': 0, 'bytes_all': calls * 512,
+               'bytes_last5min': rng.randrange(1 << 20), 'calls_all': calls, 'calls_last5min': rng.randrange(1000),
+               'connection_id': uuid.UUID(int=rng.getrandbits(128)), 'dbms_bytes_all': calls * 256,
+               'dbms_bytes_last5min': rng.randrange(1 << 20), 'db_proc_info': '', 'db_proc_took': 0,
+               'db_proc_took_at': 0, 'duration_all': calls * 3, 'duration_all_dbms': calls,
+               'duration_current': 0, 'duration_current_dbms': 0, 'duration_last_5_min': rng.randrange(300000),
+               'duration_last_5_min_dbms': rng.randrange(100000), 'host': f'pc{number % 500}',
+               'infobase_id': infobase, 'last_active_at': date_to_int64(now), 'hibernate': rng.random() < 0.05,
+               'passive_session_hibernate_time': 1200, 'hibernate_session_terminate_time': 86400,
+               'licenses': [make_license(rng, number) for lic_number in range(licenses)], 'locale': 'ru_RU',
+               'process_id': uuid.UUID(int=rng.getrandbits(128)), 'id': number + 1,
+               'started_at': date_to_int64(started_at), 'user_name': f'user{number % 1000}',
+               'memory_current': rng.randrange(1 << 26), 'memory_last5min': rng.randrange(1 << 28),
+               'memory_total': rng.randrange(1 << 34), 'read_current': 0, 'read_last5min': rng.randrange(1 << 20),
+               'read_total': rng.randrange(1 << 30), 'write_current': 0, 'write_last5min': rng.randrange(1 << 20),
+               'write_total': rng.randrange(1 << 30), 'duration_current_service': 0,
+               'duration_last5min_service': rng.randrange(10000), 'duration_all_service': rng.randrange(1000000),
+               'current_service_name': '', 'cpu_time_current': 0, 'cpu_time_last5min': rng.randrange(300000),
+               'cpu_time_total': rng.randrange(1 << 32), 'data_separation': '',
+               'client_ip_address': f'10.0.{number // 250 % 250}.{number % 250 + 1}'}
+    return session
+
+
+def make_connection(session):
+    return {'connection': session['connection_id'], 'application': session['app_id'],
+            'blocked_by_ls': session['blocked_by_ls'], 'connected_at': date_from_int64(session['started_at']),
+            'conn_id': session['id'], 'host': session['host'], 'infobase': session['infobase_id'],
+            'process': session['process_id'], 'session_number': session['id']}
+
+
+def make_lock(rng, session, now):
+    return {'connection': session['connection_id'],
+            'descr': f"{rng.choice(['Shared', 'Exclusive'])} {rng.choice(LOCK_OBJECTS)}",
+            'locked_at': now - datetime.timedelta(seconds=rng.randrange(600)),
+            'object': uuid.UUID(int=rng.getrandbits(128)), 'session': session['session_id']}
+
+
+def make_resource_counter(name, descr):
+    return {'name': name, 'collection_time': 60000, 'group': 0, 'filter_type': 0, 'filter': '', 'duration': True,
+            'cpu_time': True, 'memory': True, 'read': True, 'write': True, 'duration_dbms': True, 'dbms_bytes': True,
+            'service': True, 'call': True, 'number_of_active_sessions': True, 'number_of_sessions': True,
+            'descr': descr}
+
+
+def make_counter_value(rng, counter_object, sessions):
+    # Mostly quiet objects with an occasional spike, like the values a real counter samples
+    load = rng.random() ** 4
+    return {'object': counter_object, 'duration': int(load * 60000), 'cpu_time': int(load * 50000),
+            'memory': int(load * (1 << 30)), 'read': int(load * (1 << 26)), 'write': int(load * (1 << 24)),
+            'duration_dbms': int(load * 30000), 'dbms_bytes': int(load * (1 << 25)), 'service': int(load * 1000),
+            'call': int(load * 500), 'number_of_active_sessions': int(load * sessions), 'number_of_sessions': sessions}
+
+
+def encode_record(write, record):
+    packet = Packet(PacketType.NEGOTIATE)
+    write(record, packet)
+    return bytes(packet.data[PACKET_HEADER_RESERVE:])
+
+
+def control_frame(packet_type, body=b''):
+    return packet_type.value + pack_varint_base128(len(body)) + body
+
+
+def endpoint_frame(endpoint_id, data_type, body=b''):
+    body = pack_varint_base128(endpoint_id) + b'\x00\x00' + data_type.value + body
+    return control_frame(PacketType.ENDPOINT_MESSAGE, body)
+
+
+def message_frame(endpoint_id, message_type, body=b''):
+    return endpoint_frame(endpoint_id, EndpointDataType.MESSAGE, message_type.value + body)
+
+
+def list_frame(endpoint_id, message_type, records):
+    return message_frame(endpoint_id, message_type, pack_varint_base128(len(records)) + b''.join(records))
+
+
+def string(value):
+    value = value.encode()
+    return pack_varint_base64(len(value)) + value
+
+
+class RequestError(Exception):
+    pass
+
+
+class Endpoint:
+    def __init__(self, endpoint_id):
+        self.endpoint_id = endpoint_id
+        self.agent = False
+        self.clusters = set()
+
+
+class FakeRasServer:
+    def __init__(self, clusters=1, infobases=10, sessions=1000, licenses=1, latency=0, seed=0, agent_user=None,
+                 agent_pwd=None, cluster_user=None, cluster_pwd=None, locks=1, blocked=0):
+        self.latency = latency
+        self.agent_credentials = (agent_user, agent_pwd) if agent_user is not None else None
+        self.cluster_credentials = (cluster_user, cluster_pwd) if cluster_user is not None else None
+        self.requests = 0
+        self.connections = 0
+        self.connection_tasks = set()
+        rng = random.Random(seed)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.clusters = {}
+        self.infobases = {}
+        # Sessions are kept encoded, so a list response is a join of ready records. Connections and locks
+        # come from their own generator, so they do not change the sessions generated for a seed.
+        self.sessions = {}
+        self.session_connections = {}
+        lock_rng = random.Random(seed + 1)
+        self.counter_rng = random.Random(seed + 2)
+        for cluster_number in range(clusters):
+            cluster = make_cluster(rng, cluster_number + 1)
+            cluster_id = cluster['cluster'].bytes
+            self.clusters[cluster_id] = cluster
+            self.infobases[cluster_id] = {}
+            for infobase_number in range(infobases):
+                infobase = make_infobase(rng, infobase_number + 1)
+                self.infobases[cluster_id][infobase['infobase'].bytes] = infobase
+            infobase_ids = [infobase['infobase'] for infobase in self.infobases[cluster_id].values()]
+            self.sessions[cluster_id] = {}
+            self.session_connections[cluster_id] = {}
+            for session_number in range(sessions):
+                session = make_session(rng, session_number, rng.choice(infobase_ids), now, licenses)
+                if session_number and lock_rng.random() < blocked:
+                    # Waits on an earlier session, so the waits form trees
+                    blocker = lock_rng.randrange(session_number) + 1
+                    session['blocked_by_ls' if lock_rng.random() < 0.5 else 'blocked_by_dbms'] = blocker
+                self.sessions[cluster_id][session['session_id'].bytes] = (session['infobase_id'].bytes,
+                                                                         encode_record(write_session, session))
+                self.session_connections[cluster_id][session['session_id'].bytes] = (
+                    session['infobase_id'].bytes, encode_record(write_connection_short, make_connection(session)),
+                    [encode_record(write_lock, make_lock(lock_rng, session, now)) for lock_number in range(locks)])
+        self.handlers = {
+            MessageType.AUTHENTICATE_AGENT_REQUEST: self.authenticate_agent,
+            MessageType.AUTHENTICATE_REQUEST: self.authenticate_cluster,
+            MessageType.ADD_AUTHENTICATION_REQUEST: self.authenticate_infobase,
+            MessageType.GET_CLUSTERS_REQUEST: self.get_clusters,
+            MessageType.GET_CLUSTER_INFO_REQUEST: self.get_cluster_info,
+            MessageType.GET_INFOBASES_SHORT_REQUEST: self.get_infobases_short,
+            MessageType.GET_INFOBASE_SHORT_INFO_REQUEST: self.get_infobase_short_info,
+            MessageType.GET_INFOBASE_INFO_REQUEST: self.get_infobase_info,
+            MessageType.UPDATE_INFOBASE_REQUEST: self.update_infobase,
+            MessageType.GET_SESSIONS_REQUEST: self.get_sessions,
+            MessageType.GET_INFOBASE_SESSIONS_REQUEST: self.get_sessions,
+            MessageType.TERMINATE_SESSION_REQUEST: self.terminate_session,
+            MessageType.GET_CONNECTIONS_SHORT_REQUEST: self.get_connections,
+            MessageType.GET_INFOBASE_CONNECTIONS_SHORT_REQUEST: self.get_connections,
+            MessageType.GET_LOCKS_REQUEST: self.get_locks,
+            MessageType.GET_INFOBASE_LOCKS_REQUEST: self.get_locks,
+            MessageType.GET_RESOURCE_COUNTERS_REQUEST: self.get_resource_counters,
+            MessageType.GET_COUNTER_VALUES_REQUEST: self.get_counter_values,
+            MessageType.GET_COUNTER_ACCUMULATED_VALUES_REQUEST: self.get_counter_accumulated_values,
+        }
+
+    async def start(self, host='127.0.0.1', port=1545):
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def wait_closed(self):
+        # Waits until the clients have closed every connection
+        await asyncio.gather(*self.connection_tasks)
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        task = asyncio.current_task()
+        self.connection_tasks.add(task)
+        responses = asyncio.Queue()
+        sender = asyncio.create_task(self.send_responses(writer, responses))
+        endpoints = {}
+        try:
+            await reader.readexactly(8)  # magic
+            frames = FrameReader(reader, absorb_keep_alive=False)
+            while True:
+                packet_type, packet_data = await frames.read_frame()
+                if packet_type == PacketType.DISCONNECT:
+                    break
+                frame = self.handle_frame(packet_type, packet_data, endpoints)
+                if frame is not None:
+                    responses.put_nowait((time.monotonic() + self.latency, frame))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            responses.put_nowait(None)
+            await sender
+            writer.close()
+            self.connection_tasks.discard(task)
+
+    async def send_responses(self, writer, responses):
+        # Responses leave in request order, each one `latency` seconds after its request arrived,
+        # so pipelined requests overlap their latency like they do over a real network
+        try:
+            while True:
+                item = await responses.get()
+                if item is None:
+                    break
+                due, frame = item
+                delay = due - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                writer.write(frame)
+                if responses.empty():
+                    await writer.drain()
+        except ConnectionError:
+            pass
+
+    def handle_frame(self, packet_type, packet_data, endpoints):
+        packet = Decoder(packet_data)
+        if packet_type == PacketType.CONNECT:
+            return control_frame(PacketType.CONNECT_ACK, b'\x80')
+        if packet_type == PacketType.ENDPOINT_OPEN:
+            service = packet.read_string()
+            version = packet.read_string()
+            endpoint = Endpoint(max(endpoints, default=0) + 1)
+            endpoints[endpoint.endpoint_id] = endpoint
+            return control_frame(PacketType.ENDPOINT_OPEN_ACK,
+                                 string(service) + string(version) + pack_varint_base64(endpoint.endpoint_id))
+        if packet_type == PacketType.KEEP_ALIVE:
+            return control_frame(PacketType.KEEP_ALIVE)
+        if packet_type == PacketType.ENDPOINT_CLOSE:
+            # The client sends the id as length-prefixed bytes holding the varint
+            endpoints.pop(Decoder(packet.read_bytes()).read_varint_base64(), None)
+            return None
+        if packet_type != PacketType.ENDPOINT_MESSAGE:
+            return None
+        self.requests += 1
+        endpoint_id = packet.read_varint_base128()
+        endpoint = endpoints.get(endpoint_id)
+        if endpoint is None:
+            body = (string('v8.service.Admin.Cluster') + string('10.0') + pack_varint_base128(endpoint_id)
+                    + string('EndpointNotFound') + string(f'Endpoint {endpoint_id} is not open'))
+            return control_frame(PacketType.ENDPOINT_FAILURE, body)
+        packet.read_raw(3)  # format and data type
+        try:
+            handler = self.handlers.get(MessageType(packet.read_byte()))
+            if handler is None:
+                raise RequestError('Unsupported request')
+            return handler(endpoint, packet)
+        except (RequestError, ValueError, KeyError) as e:
+            message = e.args[0] if isinstance(e, RequestError) else f'Bad request: {e!r}'
+            return endpoint_frame(endpoint_id, EndpointDataType.EXCEPTION, string('svc') + string(message))
+
+    def cluster(self, endpoint, packet):
+        cluster_id = packet.read_raw(16).tobytes()
+        if cluster_id not in self.clusters:
+            raise RequestError('Cluster not found')
+        if self.cluster_credentials is not None and cluster_id not in endpoint.clusters:
+            raise RequestError('Cluster administrator is not authenticated')
+        return cluster_id
+
+    def infobase(self, cluster_id, packet):
+        infobase_id = packet.read_raw(16).tobytes()
+        if infobase_id not in self.infobases[cluster_id]:
+            raise RequestError('Infobase not found')
+        return infobase_id
+
+    def check_agent(self, endpoint):
+        if self.agent_credentials is not None and not endpoint.agent:
+            raise RequestError('Central server administrator is not authenticated')
+
+    def authenticate_agent(self, endpoint, packet):
+        credentials = (packet.read_string(), packet.read_string())
+        if self.agent_credentials is not None and credentials != self.agent_credentials:
+            raise RequestError('Invalid central server administrator credentials')
+        endpoint.agent = True
+        return endpoint_frame(endpoint.endpoint_id, EndpointDataType.VOID_MESSAGE)
+
+    def authenticate_cluster(self, endpoint, packet):
+        cluster_id = packet.read_raw(16).tobytes()
+        credentials = (packet.read_string(), packet.read_string())
+        if cluster_id not in self.clusters:
+            raise RequestError('Cluster not found')
+        if self.cluster_credentials is not None and credentials != self.cluster_credentials:
+            raise RequestError('Invalid cluster administrator credentials')
+        endpoint.clusters.add(cluster_id)
+        return endpoint_frame(endpoint.endpoint_id, EndpointDataType.VOID_MESSAGE)
+
+    def authenticate_infobase(self, endpoint, packet):
+        return endpoint_frame(endpoint.endpoint_id, EndpointDataType.VOID_MESSAGE)
+
+    def get_clusters(self, endpoint, packet):
+        self.check_agent(endpoint)
+        records = [encode_record(write_cluster, cluster) for cluster in self.clusters.values()]
+        return list_frame(endpoint.endpoint_id, MessageType.GET_CLUSTERS_RESPONSE, records)
+
+    def get_cluster_info(self, endpoint, packet):
+        self.check_agent(endpoint)
+        cluster = self.clusters[self.cluster(endpoint, packet)]
+        return message_frame(endpoint.endpoint_id, MessageType.GET_CLUSTER_INFO_RESPONSE,
+                             encode_record(write_cluster, cluster))
+
+    def get_infobases_short(self, endpoint, packet):
+        infobases = self.infobases[self.cluster(endpoint, packet)]
+        records = [encode_record(write_infobase_short, infobase) for infobase in infobases.values()]
+        return list_frame(endpoint.endpoint_id, MessageType.GET_INFOBASES_SHORT_RESPONSE, records)
+
+    def get_infobase_short_info(self, endpoint, packet):
+        infobases = self.infobases[self.cluster(endpoint, packet)]
+        infobase = infobases.get(packet.read_raw(16).tobytes())
+        if infobase is None:
+            raise RequestError('Infobase not found')
+        return message_frame(endpoint.endpoint_id, MessageType.GET_INFOBASE_SHORT_INFO_RESPONSE,
+                             encode_record(write_infobase_short, infobase))
+
+    def get_infobase_info(self, endpoint, packet):
+        infobases = self.infobases[self.cluster(endpoint, packet)]
+        infobase = infobases.get(packet.read_raw(16).tobytes())
+        if infobase is None:
+            raise RequestError('Infobase not found')
+        return message_frame(endpoint.endpoint_id, MessageType.GET_INFOBASE_INFO_RESPONSE,
+                             encode_record(write_infobase, infobase))
+
+    def update_infobase(self, endpoint, packet):
+        infobases = self.infobases[self.cluster(endpoint, packet)]
+        infobase = read_infobase(packet)
+        if infobase['infobase'].bytes not in infobases:
+            raise RequestError('Infobase not found')
+        infobases[infobase['infobase'].bytes] = infobase
+        return endpoint_frame(endpoint.endpoint_id, EndpointDataType.VOID_MESSAGE)
+
+    def get_sessions(self, endpoint, packet):
+        cluster_id = self.cluster(endpoint, packet)
+        sessions = self.sessions[cluster_id]
+        if packet.remaining():
+            infobase_id = self.infobase(cluster_id, packet)
+            records = [record for session_infobase, record in sessions.values() if session_infobase == infobase_id]
+            return list_frame(endpoint.endpoint_id, MessageType.GET_INFOBASE_SESSIONS_RESPONSE, records)
+        records = [record for session_infobase, record in sessions.values()]
+        return list_frame(endpoint.endpoint_id, MessageType.GET_SESSIONS_RESPONSE, records)
+
+    def terminate_session(self, endpoint, packet):
+        cluster_id = self.cluster(endpoint, packet)
+        session_id = packet.read_raw(16).tobytes()
+        if self.sessions[cluster_id].pop(session_id, None) is None:
+            raise RequestError('Session not found')
+        self.session_connections[cluster_id].pop(session_id, None)
+        return endpoint_frame(endpoint.endpoint_id, EndpointDataType.VOID_MESSAGE)
+
+    def get_connections(self, endpoint, packet):
+        cluster_id = self.cluster(endpoint, packet)
+        connections = self.session_connections[cluster_id].values()
+        if packet.remaining():
+            infobase_id = self.infobase(cluster_id, packet)
+            records = [record for infobase, record, locks in connections if infobase == infobase_id]
+            return list_frame(endpoint.endpoint_id, MessageType.GET_INFOBASE_CONNECTIONS_SHORT_RESPONSE, records)
+        records = [record for infobase, record, locks in connections]
+        return list_frame(endpoint.endpoint_id, MessageType.GET_CONNECTIONS_SHORT_RESPONSE, records)
+
+    def get_locks(self, endpoint, packet):
+        cluster_id = self.cluster(endpoint, packet)
+        connections = self.session_connections[cluster_id].values()
+        if packet.remaining():
+            infobase_id = self.infobase(cluster_id, packet)
+            records = [lock for infobase, record, locks in connections if infobase == infobase_id for lock in locks]
+            return list_frame(endpoint.endpoint_id, MessageType.GET_INFOBASE_LOCKS_RESPONSE, records)
+        records = [lock for infobase, record, locks in connections for lock in locks]
+        return list_frame(endpoint.endpoint_id, MessageType.GET_LOCKS_RESPONSE, records)
+
+    def get_resource_counters(self, endpoint, packet):
+        self.cluster(endpoint, packet)
+        records = [encode_record(write_resource_counter, make_resource_counter(name, descr))
+                   for name, descr in RESOURCE_COUNTERS]
+        return list_frame(endpoint.endpoint_id, MessageType.GET_RESOURCE_COUNTERS_RESPONSE, records)
+
+    def get_counter_values(self, endpoint, packet, response_type=MessageType.GET_COUNTER_VALUES_RESPONSE):
+        # Values are generated on every request; objects are the infobases or the first ten users
+        cluster_id = self.cluster(endpoint, packet)
+        counter = packet.read_string()
+        counter_object = packet.read_string()
+        if counter == 'infobases':
+            objects = [infobase['name'] for infobase in self.infobases[cluster_id].values()]
+        elif counter == 'users':
+            objects = [f'user{number}' for number in range(10)]
+        else:
+            raise RequestError('Counter not found')
+        sessions = len(self.sessions[cluster_id]) // len(objects)
+        records = [encode_record(write_counter_value, make_counter_value(self.counter_rng, name, sessions))
+                   for name in objects if not counter_object or name == counter_object]
+        return list_frame(endpoint.endpoint_id, response_type, records)
+
+    def get_counter_accumulated_values(self, endpoint, packet):
+        return self.get_counter_values(endpoint, packet, MessageType.GET_COUNTER_ACCUMULATED_VALUES_RESPONSE)
+
+
+async def serve(args):
+    fake_server = FakeRasServer(args.clusters, args.infobases, args.sessions, args.licenses, args.latency / 1000,
+                                args.seed, args.agent_user, args.agent_pwd, args.cluster_user, args.cluster_pwd,
+                                args.locks, args.blocked)
+    server = await fake_server.start(args.host, args.port)
+    for cluster in fake_server.clusters.values():
+        print('Cluster', cluster['cluster'], cluster['name'])
+        for infobase in fake_server.infobases[cluster['cluster'].bytes].values():
+            print('  Infobase', infobase['infobase'], infobase['name'])
+    print('Listening on', ', '.join('%s:%s' % sock.getsockname()[:2] for sock in server.sockets), flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Имитация сервера администрирования 1С (RAS) для тестов и '
+                                                 'нагрузочных замеров')
+    parser.add_argument('--host', default='127.0.0.1', help='адрес для входящих соединений (по-умолчанию: 127.0.0.1)')
+    parser.add_argument('--port', default=1545, type=int, help='порт для входящих соединений (по-умолчанию: 1545)')
+    parser.add_argument('--clusters', default=1, type=int, help='количество кластеров (по-умолчанию: 1)')
+    parser.add_argument('--infobases', default=10, type=int,
+                        help='количество информационных баз в кластере (по-умолчанию: 10)')
+    parser.add_argument('--sessions', default=1000, type=int,
+                        help='количество сеансов в кластере (по-умолчанию: 1000)')
+    parser.add_argument('--licenses', default=1, type=int,
+                        help='количество лицензий у каждого сеанса (по-умолчанию: 1)')
+    parser.add_argument('--locks', default=1, type=int,
+                        help='количество блокировок у каждого сеанса (по-умолчанию: 1)')
+    parser.add_argument('--blocked', default=0, type=float,
+                        help='доля сеансов, ожидающих блокировку другого сеанса, от 0 до 1 (по-умолчанию: 0)')
+    parser.add_argument('--latency', default=0, type=float,
+                        help='задержка каждого ответа в миллисекундах (по-умолчанию: 0)')
+    parser.add_argument('--seed', default=0, type=int,
+                        help='начальное значение генератора данных (по-умолчанию: 0)')
+    parser.add_argument('--agent-user', help='имя администратора центрального сервера; без него аутентификация '
+                                             'на агенте не проверяется')
+    parser.add_argument('--agent-pwd', help='пароль администратора центрального сервера')
+    parser.add_argument('--cluster-user', help='имя администратора кластера; без него аутентификация в кластере не '
+                                               'проверяется')
+    parser.add_argument('--cluster-pwd', help='пароль администратора кластера')
+    asyncio.run(serve(parser.parse_args()))
@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rac_client import (PACKET_HEADER_RESERVE, RECORD_CODECS, RECORD_LAYOUTS, STRING, Decoder, Packet,  # noqa: E402
+                        PacketType, RasClient, SessionFilter, update_infobases_command)
+from ras_fake_server import FakeRasServer  # noqa: E402
+
+# Every test runs the client against FakeRasServer on a free local port. The tests are plain functions
+# that drive the event loop themselves, so they need nothing beyond pytest.
+
+
+def run_with_server(fake, test):
+    async def main():
+        server = await fake.start('127.0.0.1', 0)
+        try:
+            await test(server.sockets[0].getsockname()[1])
+        finally:
+            server.close()
+
+    asyncio.run(main())
+
+
+class DelayedServer(FakeRasServer):
+    # The response to the n-th endpoint message is sent delays[n] seconds late; responses still
+    # leave in request order, so the ones after it wait as well
+    def __init__(self, delays, **kwargs):
+        super().__init__(**kwargs)
+        self.delays = delays
+        self.messages = 0
+
+    def handle_frame(self, packet_type, packet_data, endpoints):
+        frame = super().handle_frame(packet_type, packet_data, endpoints)
+        if packet_type == PacketType.ENDPOINT_MESSAGE:
+            self.latency = self.delays.get(self.messages, 0)
+            self.messages += 1
+        return frame
+
+
+class StalledServer(FakeRasServer):
+    # Once stalled, the first connection stops answering endpoint messages; later connections work
+    stalled = False
+
+    def handle_frame(self, packet_type, packet_data, endpoints):
+        if packet_type == PacketType.ENDPOINT_MESSAGE and self.stalled and self.connections == 1:
+            return None
+        return super().handle_frame(packet_type, packet_data, endpoints)
+
+
+class SilentServer(FakeRasServer):
+    # Does not answer KEEP_ALIVE, like a peer behind a half-open connection
+    def handle_frame(self, packet_type, packet_data, endpoints):
+        if packet_type == PacketType.KEEP_ALIVE:
+            return None
+        return super().handle_frame(packet_type, packet_data, endpoints)
+
+
+def field_value(kind, number):
+    if kind == 'uuid':
+        return uuid.UUID(int=number + 1)
+    if kind == 'bool':
+        return bool(number % 2)
+    if kind == 'flag':
+        return number % 2
+    if kind in ('short', 'int', 'long'):
+        return number + 7
+    if kind == 'double':
+        return number + 0.5
+    if kind == 'date':
+        return datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+    if kind == 'load_balancing_mode':
+        return 'memory'
+    if kind == STRING:
+        return f'строка{number}'
+    if kind == 'bytes':
+        return b'\x01\x02'
+    return [sample_record(kind[:-2]), sample_record(kind[:-2])]
+
+
+def sample_record(layout):
+    return {name: field_value(kind, number) for number, (name, kind) in enumerate(RECORD_LAYOUTS[layout])}
+
+
+@pytest.mark.parametrize('layout', sorted(RECORD_LAYOUTS))
+def test_record_codec_round_trip(layout):
+    read, write, skip = RECORD_CODECS[layout]
+    record = sample_record(layout)
+    packet = Packet(PacketType.NEGOTIATE)
+    write(record, packet)
+    data = bytes(packet.data[PACKET_HEADER_RESERVE:])
+    decoder = Decoder(data)
+    assert read(decoder) == record
+    assert decoder.pos == len(data)
+    decoder = Decoder(data)
+    skip(decoder)
+    assert decoder.pos == len(data)
+
+
+def test_lazy_sessions_match_materialized():
+    async def test(port):
+        async with RasClient('127.0.0.1', port) as client:
+            cluster = (await client.get_clusters())[0]['cluster']
+            sessions = await client.get_sessions(cluster, materialize=True)
+            lazy = await client.get_sessions(cluster)
+            assert len(sessions) == 300
+            assert [session.materialize() for session in lazy] == sessions
+            assert [dict(session) for session in lazy] == sessions
+            assert [session['user_name'] for session in lazy] == [session['user_name'] for session in sessions]
+
+    run_with_server(FakeRasServer(sessions=300), test)
+
+
+def test_session_filter_matches_python_filtering():
+    async def test(port):
+        async with RasClient('127.0.0.1', port) as client:
+            cluster = (await client.get_clusters())[0]['cluster']
+            sessions = await client.get_sessions(cluster, materialize=True)
+            cases = [({'app_id': 'BackgroundJob'}, {}), ({'user_name': sessions[3]['user_name']}, {}),
+                     ({}, {'memory_current': 1 << 25}),
+                     ({'app_id': '1CV8C'}, {'cpu_time_last5min': 200000, 'memory_current': 1 << 24}),
+                     ({'infobase_id': sessions[0]['infobase_id'], 'app_id': 'Designer'}, {}),
+                     ({'app_id': 'Nope'}, {})]
+            for equals, minimum in cases:
+                expected = [session for session in sessions
+                            if all(session[name] == value for name, value in equals.items())
+                            and all(session[name] >= value for name, value in minimum.items())]
+                assert await client.get_sessions(cluster, session_filter=SessionFilter(equals, minimum)) == expected
+                lazy = await client.get_sessions(cluster, session_filter=SessionFilter(equals, minimum, False))
+                assert [session.materialize() for session in lazy] == expected
+
+    run_with_server(FakeRasServer(sessions=500), test)
+
+
+def test_session_filter_rejects_non_numeric_minimum():
+    with pytest.raises(ValueError):
+        SessionFilter(minimum={'user_name': 'user'})
+
+
+def test_concurrent_requests_get_their_own_responses():
+    async def test(port):
+        async with RasClient('127.0.0.1', port) as client:
+            clusters = await client.get_clusters()
+            cluster = clusters[0]['cluster']
+            infobases = await client.get_infobases_short(cluster)
+            sessions = await client.get_sessions(cluster, materialize=True)
+            calls = []
+            for infobase in infobases:
+                calls.append(client.get_clusters(fresh=True))
+                calls.append(client.get_infobase_info(cluster, infobase['infobase'], fresh=True))
+                calls.append(client.get_sessions(cluster, infobase['infobase'], materialize=True))
+            results = await asyncio.gather(*calls)
+            for number, infobase in enumerate(infobases):
+                assert results[3 * number] == clusters
+                assert results[3 * number + 1]['name'] == infobase['name']
+                assert results[3 * number + 2] == [session for session in sessions
+                                                   if session['infobase_id'] == infobase['infobase']]
+
+    run_with_server(FakeRasServer(sessions=200, latency=0.01), test)
+
+
+def test_timeout_fails_only_the_late_request():
+    # The late response is matched to the cancelled request and discarded, so the next request
+    # gets its own response over the same connection
+    fake = DelayedServer({1: 0.6}, sessions=50)
+
+    async def test(port):
+        async with RasClient('127.0.0.1', port, request_timeout=0.4) as client:
+            clusters = await client.get_clusters()
+            with pytest.raises(asyncio.TimeoutError):
+                await client.get_sessions(clusters[0]['cluster'])
+            assert await client.get_clusters(fresh=True) == clusters
+            assert client.is_alive()
+            assert client.timeouts == 0
+            assert not any(client.pending.values())
+            assert fake.connections == 1
+
+    run_with_server(fake, test)
+
+
+def test_repeated_timeouts_drop_and_reconnect():
+    fake = StalledServer(sessions=50)
+
+    async def test(port):
+        async with RasClient('127.0.0.1', port, request_timeout=0.2, reconnect_attempts=2, timeout_limit=3) as client:
+            clusters = await client.get_clusters()
+            fake.stalled = True
+            for attempt in range(2):
+                with pytest.raises(asyncio.TimeoutError):
+                    await client.get_clusters(fresh=True)
+                assert client.is_alive()
+            # The third timeout in a row drops the connection and the read-only request is retried
+            assert await client.get_clusters(fresh=True) == clusters
+            assert fake.connections == 2
+            assert not any(client.pending.values())
+
+    run_with_server(fake, test)
+
+
+@pytest.mark.parametrize('keep_alive_misses, connections', [(None, 1), (3, 2)])
+def test_keep_alive_misses(keep_alive_misses, connections):
+    fake = SilentServer(sessions=10)
+
+    async def test(port):
+        async with RasClient('127.0.0.1', port, keep_alive_interval=0.1, request_timeout=2, reconnect_attempts=2,
+                             keep_alive_misses=keep_alive_misses) as client:
+            await asyncio.sleep(0.8)
+            assert client.is_alive() == (keep_alive_misses is None)
+            assert len(await client.get_clusters(fresh=True)) == 1
+            assert fake.connections == connections
+
+    run_with_server(fake, test)
+
+
+def update_args(cluster, **kwargs):
+    args = dict(cluster=cluster, infobase=None, all_infobases=False, restore=None, rollback_file=None,
+                pipeline_window=4, format='ndjson', descr=None, denied_message=None, denied_parameter=None,
+                permission_code=None, denied_from=None, denied_to=None, sessions_deny=None, scheduled_jobs_deny=None)
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+def test_update_infobases_with_rollback(tmp_path, capsys):
+    fake = FakeRasServer(sessions=10)
+    cluster = next(iter(fake.clusters.values()))['cluster']
+    infobases = fake.infobases[cluster.bytes]
+    previous = {infobase_id: dict(infobase) for infobase_id, infobase in infobases.items()}
+    rollback_file = str(tmp_path / 'rollback.json')
+
+    async def test(port):
+        async with RasClient('127.0.0.1', port) as client:
+            await update_infobases_command(client, update_args(cluster, all_infobases=True, rollback_file=rollback_file,
+                                                               descr='Maintenance', sessions_deny='on'))
+            results = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+            assert [result['result'] for result in results] == ['updated'] * len(previous)
+            assert all(infobase['descr'] == 'Maintenance' and infobase['sessions_denied']
+                       for infobase in infobases.values())
+            with open(rollback_file) as file:
+                rollback = json.load(file)
+            assert {entry['infobase']: (entry['descr'], entry['sessions_denied']) for entry in rollback} == {
+                str(uuid.UUID(bytes=infobase_id)): (infobase['descr'], False)
+                for infobase_id, infobase in previous.items()}
+
+            # A second run must not replace the saved values
+            with pytest.raises(FileExistsError):
+                await update_infobases_command(client, update_args(cluster, all_infobases=True,
+                                                                   rollback_file=rollback_file, descr='Other'))
+            assert all(infobase['descr'] == 'Maintenance' for infobase in infobases.values())
+
+            await update_infobases_command(client, update_args(cluster, restore=rollback_file))
+            assert dict(infobases) == previous
+
+    run_with_server(fake, test)